@@ -0,0 +1,170 @@
+# scripts/annotation_io.py
+"""
+Streaming read/write helpers for annotation records.
+
+- JsonlWriter writes one record per line as records are produced;
+  JsonArrayWriter has the same interface and writes the indented JSON array
+  format used by records_*_final.json.
+- iter_records lazily yields records from either a JSON array file
+  (records_*_final.json / annotation.json) or a JSONL file, optionally
+  filtered by step / device / phase. For JSONL the filters are checked on
+  the raw line first, so lines that cannot match are never decoded.
+  A columnar store directory (see record_store.py) is read the same way.
+"""
+import json
+from pathlib import Path
+
+_DECODER = json.JSONDecoder()
+
+
+class JsonlWriter:
+    """Append records to a .jsonl file, one compact JSON object per line."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.count = 0
+        self._fh = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = self.path.open("w", encoding="utf-8")
+        return self
+
+    def write(self, rec: dict):
+        self._fh.write(json.dumps(rec, ensure_ascii=False))
+        self._fh.write("\n")
+        self.count += 1
+
+    def __exit__(self, *exc):
+        self._fh.close()
+        self._fh = None
+
+
+class JsonArrayWriter(JsonlWriter):
+    """Collect records and write them as one indented JSON array on close."""
+
+    def __enter__(self):
+        self._records = []
+        return self
+
+    def write(self, rec: dict):
+        self._records.append(rec)
+        self.count += 1
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self._records, ensure_ascii=False, indent=2), encoding='utf-8')
+        self._records = None
+
+
+def _as_set(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return {value}
+    return set(value)
+
+
+def _device_of(rec: dict) -> str:
+    # CheckDev looks like "Realsense455 mounted on fix_arm"
+    return (rec.get("CheckDev") or "").rsplit(" ", 1)[-1]
+
+
+def _iter_json_array(path: Path, chunk_size: int = 1 << 16):
+    """Yield the elements of a top-level JSON array without loading the whole file."""
+    with path.open("r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        started = False
+        eof = False
+        while True:
+            # skip whitespace / separators
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    break
+                chunk = f.read(chunk_size)
+                buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            if pos >= len(buf):
+                if started:
+                    raise ValueError(f"JSON 数组未结束：{path}")
+                return
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError(f"不是 JSON 数组：{path}")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                obj, end = _DECODER.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+                continue
+            if end == len(buf) and not eof and not isinstance(obj, (dict, list)):
+                # a scalar ending at the buffer end may be truncated
+                chunk = f.read(chunk_size)
+                buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+                continue
+            yield obj
+            pos = end
+            if pos > chunk_size:
+                buf, pos = buf[pos:], 0
+
+
+def iter_records(path: Path, step=None, device=None, phase=None):
+    """
+    Lazily yield annotation records from a .json array, a .jsonl file or a .cols store.
+    step / device / phase accept a single value or a collection of values;
+    device is matched against the arm named in CheckDev (e.g. "fix_arm").
+    """
+    path = Path(path)
+    steps, devices, phases = _as_set(step), _as_set(device), _as_set(phase)
+
+    def keep(rec):
+        return ((steps is None or rec.get("step") in steps)
+                and (phases is None or rec.get("phase") in phases)
+                and (devices is None or _device_of(rec) in devices))
+
+    if path.is_dir():
+        # columnar store (record_store.py): filters become vectorized code masks
+        from record_store import load_store
+        store = load_store(path)
+        mask = None
+        for col, values in (("step", steps), ("phase", phases)):
+            if values is not None:
+                m = store.mask(col, values)
+                mask = m if mask is None else mask & m
+        if devices is not None:
+            m = store.mask("CheckDev", [v for v in store.vocab["CheckDev"]
+                                        if _device_of({"CheckDev": v}) in devices])
+            mask = m if mask is None else mask & m
+        yield from store.iter_records(mask)
+    elif path.suffix.lower() == ".jsonl":
+        # cheap substring checks on the raw line before decoding it
+        needles = []
+        if steps is not None:
+            needles.append([json.dumps(s, ensure_ascii=False) for s in steps])
+        if phases is not None:
+            needles.append([json.dumps(p, ensure_ascii=False) for p in phases])
+        if devices is not None:
+            needles.append(list(devices))
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                if any(not any(n in line for n in group) for group in needles):
+                    continue
+                rec = json.loads(line)
+                if keep(rec):
+                    yield rec
+    else:
+        for rec in _iter_json_array(path):
+            if keep(rec):
+                yield rec
@@ -5,6 +5,10 @@ from pathlib import Path
 import re
 import os
 
+from annotation_io import JsonArrayWriter, JsonlWriter, iter_records
+from build_manifest import (MANIFEST_NAME, empty_manifest, file_sha1, fingerprint_file, json_sha1, load_manifest,
+                            save_manifest)
+
 # Mapping of view IDs to human-readable labels
 VIEW_MAP = {
     0: "top-down view",
@@ -25,83 +29,233 @@ VIEW_MAP = {
 FILENAME_REGEX = re.compile(r"(?P<idx>\d+)_(?P<distance>near|far)_(?P<view>\d+)")
 
 
-def generate_grounding(img_path: Path, anomaly_type: str, category: str, project_root: Path) -> list:
+def label_xml_path(img_path: Path) -> Path:
+    """Pascal-VOC label of an image: <image dir>/label/<name>.xml"""
+    return img_path.parent.joinpath("label", img_path.name.replace(".jpg", ".xml"))
+
+
+ABNORMAL_TYPES = {
+    "Missing", "Inoperable Object", "Transformer Failure",
+    "Unfulfilled Object", "Environmental Disturbance"
+}
+
+
+def parse_label_xml(xml_path: Path) -> list:
     """
-    Generate grounding list from XML.
-    - abnormal_types: defined with capitalized names
-    - matching uses lowercase comparison
-    - category field uses anomaly_type passed from desc
+    Parse a Pascal-VOC label XML into raw boxes: [(name, [xmin, ymin, xmax, ymax]), ...].
+    The anomaly type of the description is applied later by ground_boxes.
     """
-    abnormal_types = {
-        "Missing", "Inoperable Object", "Transformer Failure",
-        "Unfulfilled Object", "Environmental Disturbance"
-    }
+    import xml.etree.ElementTree as ET
+    root = ET.parse(xml_path).getroot()
+    boxes = []
+    for obj in root.findall("object"):
+        name_raw = obj.findtext("name", "").strip()
+        bbox_node = obj.find("bndbox")
+        bbox = [int(bbox_node.findtext(k)) for k in ("xmin", "ymin", "xmax", "ymax")]
+        boxes.append((name_raw, bbox))
+    return boxes
+
+
+def _parse_label_job(xml_path: str):
+    # runs in a worker process: return errors instead of raising
+    try:
+        return xml_path, parse_label_xml(Path(xml_path)), None
+    except Exception as e:
+        return xml_path, None, f"{type(e).__name__}: {e}"
+
+
+def extract_groundings(xml_paths, cache: dict = None, workers: int = None) -> dict:
+    """
+    Grounding extraction stage: parse every unique label XML once, across a
+    process pool, into cache keyed by (xml path, mtime_ns) -> raw boxes.
+    Returns {xml path: raw boxes}. Missing files and parse errors are
+    collected and reported together in a single exception.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    cache = {} if cache is None else cache
+    result = {}
+    errors = []
+    todo = {}
+    for xml_path in {Path(p) for p in xml_paths}:
+        try:
+            key = (str(xml_path), xml_path.stat().st_mtime_ns)
+        except FileNotFoundError:
+            errors.append(f"Label XML not found: {xml_path}")
+            continue
+        if key in cache:
+            result[xml_path] = cache[key]
+        else:
+            todo[str(xml_path)] = key
+
+    jobs = sorted(todo)
+    if workers == 1 or len(jobs) < 64:
+        parsed = [_parse_label_job(j) for j in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(_parse_label_job, jobs, chunksize=32))
+    for xml_path, boxes, err in parsed:
+        if err:
+            errors.append(f"{xml_path}: {err}")
+            continue
+        cache[todo[xml_path]] = boxes
+        result[Path(xml_path)] = boxes
+
+    if errors:
+        for err in errors:
+            print(f"[EXCEPTION] {err}")
+        raise RuntimeError(f"[ERROR] {len(errors)} label XML file(s) could not be parsed")
+    return result
 
-    # Convert to lowercase for matching
-    abnormal_types_lower = {t.lower() for t in abnormal_types}
 
+GROUNDING_CACHE_NAME = "grounding_cache.json"
+GROUNDING_CACHE_VERSION = 1
+
+
+def load_grounding_cache(path: Path) -> dict:
+    """Persisted extract_groundings cache: (xml path, mtime_ns) -> raw boxes; empty if missing / outdated."""
+    if not path.exists():
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding='utf-8'))
+    except ValueError:
+        print(f"[WARN] Ignoring unreadable grounding cache: {path}")
+        return {}
+    if data.get("version") != GROUNDING_CACHE_VERSION:
+        return {}
+    return {(xml_path, mtime_ns): [(name, bbox) for name, bbox in boxes]
+            for xml_path, mtime_ns, boxes in data.get("entries", [])}
+
+
+def save_grounding_cache(path: Path, cache: dict, keep: set = None):
+    """Write the cache; with keep, only the (xml path, mtime_ns) keys in it (drops deleted / edited XMLs)."""
+    entries = [[xml_path, mtime_ns, boxes] for (xml_path, mtime_ns), boxes in sorted(cache.items())
+               if keep is None or (xml_path, mtime_ns) in keep]
+    path.write_text(json.dumps({"version": GROUNDING_CACHE_VERSION, "entries": entries}, ensure_ascii=False),
+                    encoding='utf-8')
+
+
+def ground_boxes(boxes: list, anomaly_type: str) -> list:
+    """
+    Turn raw boxes into the Grounding list of a record.
+    - abnormal types: matching uses lowercase comparison
+    - category field uses anomaly_type passed from desc
+    """
+    abnormal_types_lower = {t.lower() for t in ABNORMAL_TYPES}
     grounding = []
-    matched = False
+    for name_raw, bbox in boxes:
+        name_lower = name_raw.lower()
+        if name_lower in abnormal_types_lower:
+            grounding.append({
+                "text_span": "Abnormal region",
+                "bbox": list(bbox),
+                "category": anomaly_type  # Use the anomaly type from the description
+            })
+        elif name_lower == "normal":
+            grounding.append({
+                "text_span": "Normal region",
+                "bbox": list(bbox),
+                "category": "Normal"
+            })
+        else:
+            grounding.append({
+                "text_span": name_raw,
+                "bbox": list(bbox),
+                "category": "object"
+            })
+    return grounding
 
-    label_file = Path(img_path)
-    xml_path = project_root.joinpath(label_file.parent, "label", label_file.name.replace(".jpg", ".xml"))
+
+def generate_grounding(img_path: Path, anomaly_type: str, category: str, project_root: Path) -> list:
+    """
+    Generate grounding list from XML for a single image.
+    build_records uses extract_groundings + ground_boxes instead.
+    """
+    xml_path = project_root.joinpath(label_xml_path(Path(img_path)))
     if not xml_path.exists():
         raise FileNotFoundError(f"[ERROR] Label XML not found: {xml_path}")
-
     try:
-        import xml.etree.ElementTree as ET
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-
-        for obj in root.findall("object"):
-            name_raw = obj.findtext("name", "").strip()
-            name_lower = name_raw.lower()
-
-            bbox_node = obj.find("bndbox")
-            xmin = int(bbox_node.findtext("xmin"))
-            ymin = int(bbox_node.findtext("ymin"))
-            xmax = int(bbox_node.findtext("xmax"))
-            ymax = int(bbox_node.findtext("ymax"))
-            bbox = [xmin, ymin, xmax, ymax]
-
-            if name_lower in abnormal_types_lower:
-                grounding.append({
-                    "text_span": "Abnormal region",
-                    "bbox": bbox,
-                    "category": anomaly_type  # Use the anomaly type from the description
-                })
-                matched = True
-            elif name_lower == "normal":
-                grounding.append({
-                    "text_span": "Normal region",
-                    "bbox": bbox,
-                    "category": "Normal"
-                })
-                matched = True
-            else:
-                grounding.append({
-                    "text_span": name_raw,
-                    "bbox": bbox,
-                    "category": "object"
-                })
-
-        # if not matched:
-            # raise ValueError(f"[ERROR] No abnormal or normal object found in XML: {xml_path}")
-
+        return ground_boxes(parse_label_xml(xml_path), anomaly_type)
     except Exception as e:
         print(f"[EXCEPTION] Failed to parse XML or assign grounding for {img_path}: {e}")
         raise
 
-    return grounding
-
 import shutil
 
-def collect_and_rename_images(project_root: Path, groups: dict):
+IMAGE_MODES = ("copy", "hardlink", "reflink", "symlink")
+FICLONE = 0x40049409  # Linux ioctl: share extents with another file (btrfs, xfs, ...)
+
+
+def _reflink(src: Path, dst: Path) -> bool:
+    """Clone src into dst without copying data; False if the filesystem can't."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, "rb") as fs, open(dst, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        return True
+    except OSError:
+        dst.unlink(missing_ok=True)
+        return False
+
+
+def materialize_image(src: Path, dst: Path, mode: str = "copy", src_sha1: str = None):
+    """
+    Make dst an image identical to src using mode (copy / hardlink / reflink / symlink).
+    Links fall back to a plain copy when the filesystem does not support them.
+    Returns (action, bytes_avoided) with action in {"copied", "linked", "skipped"}.
+    """
+    size = src.stat().st_size
+    if dst.is_symlink():
+        if mode == "symlink" and os.readlink(dst) == str(src.resolve()):
+            return "skipped", size
+        dst.unlink()
+    elif dst.exists():
+        if mode == "hardlink" and os.path.samefile(src, dst):
+            return "skipped", size
+        # copy / reflink 需要独立的文件：与源文件同 inode（旧的硬链接）时重新生成
+        if (mode in ("copy", "reflink") and dst.stat().st_size == size and not os.path.samefile(src, dst)
+                and file_sha1(dst) == (src_sha1 or file_sha1(src))):
+            return "skipped", size
+        dst.unlink()
+
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return "linked", size
+        except OSError:
+            pass
+    elif mode == "symlink":
+        os.symlink(src.resolve(), dst)
+        return "linked", size
+    elif mode == "reflink" and _reflink(src, dst):
+        return "linked", size
+    shutil.copyfile(src, dst)
+    return "copied", 0
+
+
+def collect_and_rename_images(project_root: Path, groups: dict, previous: dict = None, unchanged: set = None,
+                              mode: str = "copy", hashes: dict = None, max_workers: int = 8,
+                              previous_mode: str = None):
     """
     收集所有图片，复制并重命名到 data/image 文件夹下，返回新旧路径映射表。
+    previous: 上一次构建的 {源图片相对路径: data/image/NNNN.jpg}，保留其编号；
+    新图片按路径排序后从当前最大编号之后继续编号。
+    unchanged: 内容未变化的源图片相对路径集合，目标文件存在且上次构建使用同一 mode
+    （previous_mode）时直接跳过；mode 改变时逐个交给 materialize_image 重新生成。
+    mode: copy / hardlink / reflink / symlink，见 materialize_image；
+    复制在有界线程池中进行，目标文件大小与哈希一致时跳过。
+    hashes: 可选的 {源图片相对路径: sha1}，避免重复计算源文件哈希。
     """
+    if mode not in IMAGE_MODES:
+        raise ValueError(f"Unknown image mode: {mode} (expected one of {IMAGE_MODES})")
     image_dir = project_root.joinpath("data", "image")
     image_dir.mkdir(parents=True, exist_ok=True)
+    previous = previous or {}
+    unchanged = unchanged or set()
+    hashes = hashes or {}
 
     # 1. 收集所有图片并排序
     all_imgs = []
@@ -110,108 +264,245 @@ def collect_and_rename_images(project_root: Path, groups: dict):
     # 可根据需求排序（比如按照原始路径排序，保证顺序一致）
     all_imgs = sorted(set(all_imgs), key=lambda p: str(p))
 
-    # 2. 重命名并复制
+    # 2. 分配编号：已有图片沿用旧编号，新图片顺延
+    numbered = []
+    used = set()
+    fresh = []
+    for img_path in all_imgs:
+        old = previous.get(img_path.relative_to(project_root).as_posix())
+        if old:
+            numbered.append((img_path, old))
+            used.add(old)
+        else:
+            fresh.append(img_path)
+    next_idx = max((int(Path(n).stem) for n in used), default=0) + 1
+    for img_path in fresh:
+        numbered.append((img_path, f"data/image/{next_idx:04d}.jpg"))
+        next_idx += 1
+
+    # 3. 重命名并落盘（线程池）
+    from concurrent.futures import ThreadPoolExecutor
+
     mapping = {}
-    for idx, img_path in enumerate(all_imgs, start=1):
-        new_name = f"{idx:04d}.jpg"
-        new_path = image_dir.joinpath(new_name)
-        shutil.copyfile(img_path, new_path)
+    jobs = []
+    stats = {"copied": 0, "linked": 0, "skipped": 0}
+    avoided = 0
+    for img_path, new_rel in numbered:
+        new_path = project_root.joinpath(new_rel)
+        rel_src = img_path.relative_to(project_root).as_posix()
         mapping[img_path.resolve()] = new_path.relative_to(project_root)
-    print(f"Copied {len(all_imgs)} images to {image_dir}")
+        if (mode == previous_mode and rel_src in unchanged and rel_src in previous
+                and os.path.lexists(new_path)):
+            stats["skipped"] += 1
+            avoided += img_path.stat().st_size
+        else:
+            jobs.append((img_path, new_path, hashes.get(rel_src)))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for action, saved in pool.map(lambda job: materialize_image(job[0], job[1], mode, job[2]), jobs):
+            stats[action] += 1
+            avoided += saved
+    print(f"Materialized {len(all_imgs)} images to {image_dir} (mode={mode}): "
+          f"{stats['copied']} copied, {stats['linked']} linked, {stats['skipped']} skipped, "
+          f"{avoided / 1e6:.1f} MB not copied")
     return mapping
 
 
 
-def collect_image_groups_for_device(device_folder: Path) -> dict:
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png'}
+
+
+def _step_segment(parts) -> str:
+    return next((p for p in parts if p.startswith("step") and ("-pre" in p or "-post" in p)), None)
+
+
+def scan_device_folder(device_folder: Path) -> dict:
     """
-    Traverse device_folder and group both images and txt references into
-    groups keyed by (step, phase, category, idx). Also output groups to JSON for debug.
+    Walk device_folder once and build an in-memory manifest:
+    - "images": (step, phase, category, idx, distance, view) -> [paths]
+    - "groups": (step, phase, category, idx) -> [paths], txt references included
+    Txt references are resolved by dictionary lookup against the images seen
+    during the same walk instead of re-scanning the referenced folder. As in a
+    walk that resolves each txt on the spot, a group only exists once an image
+    (own or referenced) lands in it, and keys keep the order of their first image.
     """
-    groups = {}
-    # single pass: handle images and txt
+    images = {}
+    # (group key, image path or txt slot) in walk order; groups are built after the txt slots are filled
+    order = []
+    # (category folder, filename prefix before '_') -> images, mirrors rglob(f"{ref_idx}_*.*")
+    by_prefix = {}
+    pending = []
     for path in device_folder.rglob("*"):
         suffix = path.suffix.lower()
         # image file
-        if suffix in {'.jpg', '.jpeg', '.png'}:
+        if suffix in IMAGE_SUFFIXES:
             parts = path.parts
-            step_seg = next((p for p in parts if p.startswith("step") and ("-pre" in p or "-post" in p)), None)
+            step_seg = _step_segment(parts)
             if not step_seg:
                 continue
             step, phase = step_seg.split("-", 1)
-            category = parts[parts.index(step_seg) + 1]
+            pos = parts.index(step_seg)
+            category = parts[pos + 1]
             m = FILENAME_REGEX.match(path.stem)
             idx = int(m.group('idx')) if m else None
-            key = (step, phase, category, idx)
-            groups.setdefault(key, []).append(path)
-        # txt file: supplement group
+            distance = m.group('distance') if m else None
+            view = int(m.group('view')) if m else None
+            images.setdefault((step, phase, category, idx, distance, view), []).append(path)
+            order.append(((step, phase, category, idx), path))
+            if "_" in path.name:
+                cat_dir = Path(*parts[:pos + 2])
+                by_prefix.setdefault((cat_dir, path.name.split("_", 1)[0]), []).append(path)
+        # txt file: supplement group, resolved after the walk
         elif suffix == '.txt':
             parts = path.stem.split("-")
             if len(parts) < 5:
                 continue
             idx0, ref_step, ref_phase, ref_cat, ref_idx = parts[:5]
             # determine this txt's own group key
-            seg = next((p for p in path.parts if p.startswith("step") and ("-pre" in p or "-post" in p)), None)
+            seg = _step_segment(path.parts)
             if not seg:
                 continue
             step0, phase0 = seg.split("-", 1)
             cat0 = path.parts[path.parts.index(seg) + 1]
             idx_group = int(idx0) if idx0.isdigit() else None
             key0 = (step0, phase0, cat0, idx_group)
-            # resolve referenced images under same point
+            # referenced images live under the same point
             point_dir = path.parent.parent.parent
             ref_folder = point_dir.joinpath(f"{ref_step}-{ref_phase}", ref_cat)
-            if ref_folder.exists():
-                for img in ref_folder.rglob(f"{ref_idx}_*.*"):
-                    if img.suffix.lower() in {'.jpg', '.jpeg', '.png'}:
-                        groups.setdefault(key0, []).append(img)
-    # debug dump groups to JSON
+            # keep a slot so referenced images land where the txt was seen
+            slot = []
+            order.append((key0, slot))
+            pending.append((slot, (ref_folder, ref_idx)))
+    for slot, ref in pending:
+        slot.extend(by_prefix.get(ref, []))
+    groups = {}
+    for key, item in order:
+        found = item if isinstance(item, list) else [item]
+        # 引用全部未解析的 txt 不建分组
+        if found:
+            groups.setdefault(key, []).extend(found)
+    return {"images": images, "groups": groups}
+
+
+def write_groups_debug(device_folder: Path, groups: dict) -> Path:
+    """Dump groups to data/annotation/groups_<device>.json for debugging."""
     debug_dir = device_folder.parent.parent.joinpath("annotation")
     debug_dir.mkdir(parents=True, exist_ok=True)
-    total = sum(len(v) for v in groups.values())
-    # ser = {
-    #     "total_count": total,
-    #     "groups": {
-    #         "_".join(map(str, k)) + f" ({len(v)} imgs)": [
-    #             str(p.relative_to(device_folder.parent.parent)) for p in v
-    #         ]
-    #         for k, v in groups.items()
-    #     }
-    # }
     ser = {"_".join([str(x) for x in key]): [str(p.relative_to(device_folder.parent.parent)) for p in imgs]
            for key, imgs in groups.items()}
     debug_file = debug_dir.joinpath(f"groups_{device_folder.name}.json")
     debug_file.write_text(json.dumps(ser, ensure_ascii=False, indent=2), encoding='utf-8')
+    return debug_file
+
+
+def collect_image_groups_for_device(device_folder: Path, manifest: dict = None) -> dict:
+    """
+    Group both images and txt references into groups keyed by
+    (step, phase, category, idx). Also output groups to JSON for debug.
+    Pass a manifest from scan_device_folder to avoid walking the folder again.
+    """
+    if manifest is None:
+        manifest = scan_device_folder(device_folder)
+    groups = manifest["groups"]
+    write_groups_debug(device_folder, groups)
     return groups
-    
 
-def build_records(project_root: Path):
+
+def make_record(img: Path, mapping: dict, device: str, step: str, entry: dict, phase: str,
+                category: str, desc: dict, boxes: list) -> dict:
+    m = FILENAME_REGEX.match(img.stem)
+    return {
+        # "Image_Id": img.relative_to(project_root).as_posix(),
+        "Image_Id": mapping[img.resolve()].as_posix(),
+        "Stage_Description": entry.get("subtask"),
+        "step": step,
+        "phase": phase,
+        "Operator": entry.get("operator"),
+        "Obj": entry.get("obj"),
+        "Start_Position": entry.get("start_position"),
+        "Dest_Position": entry.get("dest_position"),
+        "Checktype": entry.get(f"{phase}CheckType"),
+        "CheckDev": ("Realsense455" if device == "fix_arm" else "Realsense435i") + f" mounted on {device}",
+        "Detection_Location": entry.get(f"{phase}CheckLocation"),
+        "Detection_Content": entry.get(f"{phase}CheckContent"),
+        "Views": VIEW_MAP.get(int(m.group('view'))) if m else None,
+        "Distance": m.group('distance') if m else None,
+        "Anomaly_Label": (category == "abnormal"),
+        "Anomaly_Type": desc.get("type"),
+        "Anomaly_Label_Description": desc.get("description"),
+        "Caption": desc.get("caption"),
+        "Grounding": ground_boxes(boxes, desc.get("type"))
+    }
+
+
+def build_records(project_root: Path, incremental: bool = False, workers: int = None,
+                  output_format: str = "json", image_mode: str = "copy"):
+    """
+    Build records_<device>_final.json and annotation.json.
+    With incremental=True, groups whose images, label XMLs and metastep entry
+    are unchanged since the last build (see build_manifest.py) are spliced from
+    the existing outputs, unchanged images are not copied again and the
+    NNNN.jpg numbering of previously built images is kept.
+    Every build reuses the content hashes of the previous manifest for files
+    whose size / mtime are unchanged, so only new or modified files are hashed.
+    Label XMLs are parsed once each by extract_groundings using `workers` processes;
+    the parsed boxes are kept in data/annotation/grounding_cache.json keyed by
+    (XML path, mtime), so later builds only parse new or modified XMLs.
+    output_format="jsonl" writes records_<device>_final.jsonl / annotation.jsonl
+    line by line as records are produced (read them back with annotation_io.iter_records).
+    image_mode selects how data/image is materialized (copy / hardlink / reflink / symlink).
+    """
     meta = json.loads(project_root.joinpath("data").joinpath("metasteps_caption.json").read_text(encoding='utf-8'))
     base_folder = project_root.joinpath("data").joinpath("anomalyDataset_label")
     output_dir = project_root.joinpath("data").joinpath("annotation")
     output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir.joinpath(MANIFEST_NAME)
+    previous = load_manifest(manifest_path) if incremental else empty_manifest()
    
-    all_groups = {}
+    # single filesystem scan per device, shared by every stage below
+    manifests = {}
     for device_folder in base_folder.iterdir():
         if not device_folder.is_dir():
             continue
-        groups = collect_image_groups_for_device(device_folder)
+        manifests[device_folder.name] = scan_device_folder(device_folder)
+
+    all_groups = {}
+    for device, manifest in manifests.items():
+        groups = collect_image_groups_for_device(base_folder.joinpath(device), manifest)
         for k, v in groups.items():
             all_groups.setdefault(k, []).extend(v)
     # 去重，每个分组的图片合并
     for k in all_groups:
         all_groups[k] = list(set(all_groups[k]))
 
+    # 指纹：源图片与对应 label XML，仅在 size/mtime 变化时重新计算哈希
+    # 非增量构建也沿用上次 manifest 中的指纹（只用于跳过哈希，不复用记录和编号）
+    def rel(path: Path) -> str:
+        return path.relative_to(project_root).as_posix()
+
+    prev_files = previous["files"] if incremental else load_manifest(manifest_path)["files"]
+    all_imgs = sorted({img for imgs in all_groups.values() for img in imgs}, key=lambda p: str(p))
+    files = {}
+    for img in all_imgs:
+        for path in (img, label_xml_path(img)):
+            if path.exists():
+                files[rel(path)] = fingerprint_file(path, prev_files.get(rel(path)))
+    unchanged = {k for k, v in files.items() if prev_files.get(k, {}).get("sha1") == v["sha1"]} if incremental else set()
+    steps = {step: json_sha1(entry) for step, entry in meta.items()}
+    prev_groups = previous["groups"]
+
     # 1. 生成图片重命名及映射
-    mapping = collect_and_rename_images(project_root, all_groups)
+    mapping = collect_and_rename_images(project_root, all_groups, previous["images"], unchanged,
+                                        mode=image_mode, hashes={k: v["sha1"] for k, v in files.items()},
+                                        previous_mode=previous.get("image_mode"))
 
-    all_devices_records = []
-    for device_folder in base_folder.iterdir():
-        if not device_folder.is_dir():
-            continue
-        device = device_folder.name
-        # collect groups once per device
-        groups = collect_image_groups_for_device(device_folder)
-        all_records = []
+    # 2. 规划：每个分组沿用旧记录或重新生成
+    plan = {}
+    for device, manifest in manifests.items():
+        groups = manifest["groups"]
+        out = output_dir.joinpath(f"records_{device}_final.{output_format}")
+        prev_records = None
+        if incremental and out.exists():
+            prev_records = list(iter_records(out))
         # iterate metasteps to align descriptions by index
         for step, entry in meta.items():
             for phase in ['pre', 'post']:
@@ -221,55 +512,98 @@ def build_records(project_root: Path):
                     for i, desc in enumerate(descs, start=1):
                         key = (step, phase, category, i)
                         imgs = groups.get(key) or []
-                        for img in imgs:
-                            m = FILENAME_REGEX.match(img.stem)
-                            rec = {
-                                # "Image_Id": img.relative_to(project_root).as_posix(),
-                                "Image_Id": mapping[img.resolve()].as_posix(),
-                                "Stage_Description": entry.get("subtask"),
-                                "step": step,
-                                "phase": phase,
-                                "Operator": entry.get("operator"),
-                                "Obj": entry.get("obj"),
-                                "Start_Position": entry.get("start_position"),
-                                "Dest_Position": entry.get("dest_position"),
-                                "Checktype": entry.get(f"{phase}CheckType"),
-                                "CheckDev": ("Realsense455" if device == "fix_arm" else "Realsense435i") + f" mounted on {device}",
-                                "Detection_Location": entry.get(f"{phase}CheckLocation"),
-                                "Detection_Content": entry.get(f"{phase}CheckContent"),                                
-                                "Views": VIEW_MAP.get(int(m.group('view'))) if m else None,
-                                "Distance": m.group('distance') if m else None,
-                                "Anomaly_Label": (category == "abnormal"),
-                                "Anomaly_Type": desc.get("type"),
-                                "Anomaly_Label_Description": desc.get("description"),
-                                "Caption": desc.get("caption"),
-                                "Grounding": generate_grounding(img, desc.get("type"), category, project_root)
-                            }
-                            all_records.append(rec)
-                            all_devices_records.append(rec)
-        out = output_dir.joinpath(f"records_{device}_final.json")
-        out.write_text(json.dumps(all_records, ensure_ascii=False, indent=2), encoding='utf-8')
-        print(f"Wrote {len(all_records)} records to {out}")
-
-    all_out = output_dir.joinpath("annotation.json")
-    all_out.write_text(json.dumps(all_devices_records, ensure_ascii=False, indent=2), encoding='utf-8')
-    print(f"Wrote merged {len(all_devices_records)} records to {all_out}")
+                        gid = f"{device}|{step}|{phase}|{category}|{i}"
+                        digest = json_sha1([
+                            steps[step],
+                            [(rel(img), files[rel(img)]["sha1"],
+                              files.get(rel(label_xml_path(img)), {}).get("sha1"),
+                              mapping[img.resolve()].as_posix()) for img in imgs],
+                        ])
+                        cached = prev_groups.get(gid)
+                        reuse = None
+                        if (prev_records is not None and cached and cached["digest"] == digest
+                                and cached["offset"] + cached["count"] <= len(prev_records)):
+                            reuse = prev_records[cached["offset"]:cached["offset"] + cached["count"]]
+                        plan.setdefault(device, []).append(
+                            (gid, digest, step, entry, phase, category, desc, imgs, reuse))
+
+    # 3. Grounding：每个 label XML 只解析一次（进程池）
+    needed = {label_xml_path(img) for items in plan.values()
+              for *_, imgs, reuse in items if reuse is None for img in imgs}
+    # 解析结果按 (路径, mtime) 持久化在 manifest 旁边，未修改的 XML 下次构建不再解析
+    grounding_cache_path = output_dir.joinpath(GROUNDING_CACHE_NAME)
+    grounding_cache = load_grounding_cache(grounding_cache_path)
+    boxes = extract_groundings(needed, cache=grounding_cache, workers=workers)
+
+    # 4. 组装记录（jsonl 模式下边生成边写出，不在内存中累积）
+    writer_cls = JsonlWriter if output_format == "jsonl" else JsonArrayWriter
+    all_out = output_dir.joinpath(f"annotation.{output_format}")
+    new_groups = {}
+    reused = rebuilt = 0
+    with writer_cls(all_out) as merged:
+        for device, items in plan.items():
+            out = output_dir.joinpath(f"records_{device}_final.{output_format}")
+            with writer_cls(out) as writer:
+                for gid, digest, step, entry, phase, category, desc, imgs, reuse in items:
+                    if reuse is not None:
+                        recs = reuse
+                        reused += 1
+                    else:
+                        recs = [make_record(img, mapping, device, step, entry, phase, category, desc,
+                                            boxes[label_xml_path(img)]) for img in imgs]
+                        rebuilt += 1
+                    new_groups[gid] = {"digest": digest, "offset": writer.count, "count": len(recs)}
+                    for rec in recs:
+                        writer.write(rec)
+                        merged.write(rec)
+            print(f"Wrote {writer.count} records to {out}")
+    print(f"Wrote merged {merged.count} records to {all_out}")
+    if incremental:
+        print(f"Reused {reused} groups, rebuilt {rebuilt} groups")
+
+    current_xmls = {(str(path), path.stat().st_mtime_ns) for path in
+                    {label_xml_path(img) for img in all_imgs} if path.exists()}
+    save_grounding_cache(grounding_cache_path, grounding_cache, keep=current_xmls)
+    save_manifest(manifest_path, {
+        "files": files,
+        "images": {rel(img): mapping[img.resolve()].as_posix() for img in all_imgs},
+        "image_mode": image_mode,
+        "steps": steps,
+        "groups": new_groups,
+    })
 
 def split_by_step(project_root: Path, device: str):
+    from dataset import Dataset
     input_file = project_root.joinpath("data", "annotation", f"records_{device}.json")
-    records = json.loads(input_file.read_text(encoding='utf-8'))
-    by_step = {}
-    for rec in records:
-        by_step.setdefault(rec.get("step"), []).append(rec)
+    ds = Dataset.from_files(input_file)
     out_dir = project_root.joinpath("data", "annotation")
-    for step, recs in by_step.items():
+    for step in ds.values("step"):
+        recs = list(ds.query(step=step))
         out_path = out_dir.joinpath(f"{device}_{step}.json")
         out_path.write_text(json.dumps(recs, ensure_ascii=False, indent=2), encoding='utf-8')
         print(f"Wrote {len(recs)} records to {out_path}")
 
 
-if __name__ == "__main__":
-    root = Path.cwd()
-    build_records(root)
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build annotation records from data/anomalyDataset_label")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only rebuild groups whose inputs changed since the last build")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used to parse label XMLs (default: CPU count)")
+    parser.add_argument("--format", choices=["json", "jsonl"], default="json",
+                        help="json: indented arrays (default); jsonl: streamed, one record per line")
+    parser.add_argument("--image-mode", choices=IMAGE_MODES, default="copy",
+                        help="how data/image/NNNN.jpg is created from the source capture (default: copy)")
+    parser.add_argument("--root", type=Path, default=Path.cwd(),
+                        help="project root holding data/anomalyDataset_label (default: current directory)")
+    args = parser.parse_args()
+    root = args.root
+    build_records(root, incremental=args.incremental, workers=args.workers, output_format=args.format,
+                  image_mode=args.image_mode)
     # for dev in ["fix_arm", "mobile_arm"]:
     #     split_by_step(root, dev)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# scripts/benchmark.py
+"""
+Offline CPU benchmark of the pipeline stages:
+
+    build_records   auto_annotation_final.build_records on a synthetic capture tree
+    grounding       extract_groundings + ground_boxes over the label XMLs of that tree
+    clipscore       compute_clipscore.compute_scores with a tiny randomly initialized CLIP
+    report          ScoreAggregator + the CSV tables / pivots of clipscore_full_report
+    charts          render_charts (every chart, forced) from the count cube
+
+Every stage runs at every `--scales` factor: scale 1 is the bundled dataset
+(2 788 records / 1 671 images; for build_records / grounding the
+capture_tree.py tree of the same size), scale N has N times the inputs
+(tree replicas, repeated records / scores). Each run
+(stage, scale, repeat) happens in a fresh subprocess, so peak RSS
+(ru_maxrss of the process and its worker processes) belongs to that stage
+only; input preparation is done in the subprocess before the clock starts.
+Wall time is the best of `--repeat` runs.
+
+Results go to a JSON file:
+    {"meta": {...}, "results": [{"stage", "scale", "items", "unit", "wall_s", "items_per_s", "peak_rss_mb"}]}
+With --baseline, every (stage, scale) present in both files is compared and
+the run exits with status 1 when wall time or peak RSS grew by more than
+--threshold / --rss_threshold. --save_baseline stores the results as the
+new baseline.
+
+Nothing is downloaded: the CLIP model is a 2-layer, 32-wide random config
+written to <work_dir>/tiny_clip with a byte-level vocabulary, and the
+Hugging Face hub is forced offline in the stage subprocesses.
+
+    python scripts/benchmark.py --scales 1 10 --repeat 3 --save_baseline benchmarks/baseline.json
+    python scripts/benchmark.py --scales 1 10 --repeat 3 --baseline benchmarks/baseline.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from capture_tree import generate_tree
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+ANNOTATION_DIR = PROJECT_ROOT.joinpath("data", "annotation")
+BUNDLED_RECORDS = ("records_fix_arm_final.json", "records_mobile_arm_final.json")
+STAGE_NAMES = ("build_records", "grounding", "clipscore", "report", "charts")
+
+
+def bundled_records() -> list:
+    from annotation_io import iter_records
+    return [rec for name in BUNDLED_RECORDS for rec in iter_records(ANNOTATION_DIR.joinpath(name))]
+
+
+def write_scaled_annotations(path: Path, scale: int) -> int:
+    """Bundled records repeated `scale` times as .jsonl; copy r > 0 gets Image_Id data/image/rep<r>/NNNN.jpg."""
+    from annotation_io import JsonlWriter
+    records = bundled_records()
+    with JsonlWriter(path) as writer:
+        for r in range(scale):
+            for rec in records:
+                if r:
+                    rec = dict(rec, Image_Id=rec["Image_Id"].replace("data/image/", f"data/image/rep{r}/", 1))
+                writer.write(rec)
+        return writer.count
+
+
+# ---------------------------------------------------------------- inputs
+
+def capture_tree(work_dir: Path, scale: int) -> Path:
+    """Synthetic capture tree (capture_tree.py) of a scale, generated once per work_dir."""
+    root = work_dir.joinpath(f"capture_tree_x{scale}")
+    done = root.joinpath(".complete")
+    if not done.exists():
+        shutil.rmtree(root, ignore_errors=True)
+        generate_tree(root, scale)
+        done.write_text("", encoding="utf-8")
+    return root
+
+
+def bytes_to_unicode() -> dict:
+    """GPT-2 / CLIP byte -> printable character table (the byte-level BPE alphabet)."""
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, (chr(c) for c in cs)))
+
+
+def tiny_clip(out_dir: Path) -> Path:
+    """Write a tiny randomly initialized CLIP (model + processor) to out_dir, once; no download needed."""
+    if out_dir.joinpath("config.json").exists():
+        return out_dir
+    import torch
+    from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel, CLIPProcessor, CLIPTokenizer
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # 字节级词表、无 merge：每个字符一个 token，分词器无需下载
+    chars = list(bytes_to_unicode().values())
+    vocab = {}
+    for c in chars + [c + "</w>" for c in chars] + ["<|startoftext|>", "<|endoftext|>"]:
+        vocab.setdefault(c, len(vocab))
+    out_dir.joinpath("vocab.json").write_text(json.dumps(vocab), encoding="utf-8")
+    out_dir.joinpath("merges.txt").write_text("#version: 0.2\n", encoding="utf-8")
+    tokenizer = CLIPTokenizer(str(out_dir.joinpath("vocab.json")), str(out_dir.joinpath("merges.txt")))
+    image_processor = CLIPImageProcessor(size={"shortest_edge": 32}, crop_size={"height": 32, "width": 32})
+    CLIPProcessor(image_processor=image_processor, tokenizer=tokenizer).save_pretrained(out_dir)
+    config = CLIPConfig(
+        text_config=dict(vocab_size=len(vocab), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=2, max_position_embeddings=512,
+                         bos_token_id=vocab["<|startoftext|>"], eos_token_id=vocab["<|endoftext|>"],
+                         pad_token_id=vocab["<|endoftext|>"]),
+        vision_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=2,
+                           image_size=32, patch_size=8),
+        projection_dim=16,
+    )
+    torch.manual_seed(0)
+    CLIPModel(config).save_pretrained(out_dir)
+    return out_dir
+
+
+# ---------------------------------------------------------------- stages
+# prepare_<stage>(work_dir, scale, tmp) does the untimed setup and returns (run, unit);
+# run() does the timed work and returns the number of items processed.
+
+def prepare_build_records(work_dir: Path, scale: int, tmp: Path):
+    from auto_annotation_final import build_records
+    tree = capture_tree(work_dir, scale)
+    for name in ("image", "annotation"):
+        shutil.rmtree(tree.joinpath("data", name), ignore_errors=True)
+
+    def run():
+        build_records(tree)
+        from annotation_io import iter_records
+        return sum(1 for _ in iter_records(tree.joinpath("data", "annotation", "annotation.json")))
+
+    return run, "records"
+
+
+def prepare_grounding(work_dir: Path, scale: int, tmp: Path):
+    from auto_annotation_final import ABNORMAL_TYPES, extract_groundings, ground_boxes
+    tree = capture_tree(work_dir, scale)
+    xml_paths = sorted(tree.joinpath("data", "anomalyDataset_label").rglob("*.xml"))
+    anomaly_type = sorted(ABNORMAL_TYPES)[0]
+
+    def run():
+        boxes = extract_groundings(xml_paths)
+        for raw in boxes.values():
+            ground_boxes(raw, anomaly_type)
+        return len(boxes)
+
+    return run, "label XMLs"
+
+
+def prepare_clipscore(work_dir: Path, scale: int, tmp: Path):
+    from compute_clipscore import compute_scores
+    model_dir = tiny_clip(work_dir.joinpath("tiny_clip"))
+    records = bundled_records() * scale
+
+    def run():
+        compute_scores(records, PROJECT_ROOT, device="cpu", model_name=str(model_dir))
+        return len(records)
+
+    return run, "records"
+
+
+def prepare_report(work_dir: Path, scale: int, tmp: Path):
+    import random
+    from annotation_io import JsonlWriter, iter_records
+    from clipscore_full_report import DEFAULT_GROUPINGS, write_pivots, write_table
+    from score_aggregate import ScoreAggregator
+
+    annotations = tmp.joinpath("records_bench.jsonl")
+    write_scaled_annotations(annotations, scale)
+    scores = tmp.joinpath("bench_clipscore_results.jsonl")
+    rng = random.Random(0)
+    with JsonlWriter(scores) as writer:
+        for rec in iter_records(annotations):
+            clip = rng.uniform(0.0, 1.0)
+            writer.write({"image_id": rec["Image_Id"], "clip_score": clip, "ref_clip_score": clip * 0.9})
+    out_dir = tmp.joinpath("reports")
+    out_dir.mkdir()
+
+    def run():
+        agg = ScoreAggregator([annotations], DEFAULT_GROUPINGS)
+        agg.add_scores(scores)
+        for grouping, rows in agg.tables().items():
+            write_table(out_dir.joinpath("clipscore_by_" + ("_".join(grouping) or "all") + ".csv"),
+                        rows, grouping, agg.metrics)
+        write_pivots(agg, out_dir)
+        return agg.scores
+
+    return run, "scores"
+
+
+def prepare_charts(work_dir: Path, scale: int, tmp: Path):
+    import matplotlib
+    matplotlib.use("Agg")
+    from count_cube import load_cube
+    from render_charts import chart_jobs, render_charts
+
+    annotations = tmp.joinpath("records_bench.jsonl")
+    write_scaled_annotations(annotations, scale)
+
+    def run():
+        cube = load_cube(annotations, cache_path=tmp.joinpath("count_cube.npz"))
+        cubes = {"raw": cube, "normal": cube.relabel("anomaly_type", {None: "normal"})}
+        rows = render_charts(chart_jobs(cubes), cubes, tmp.joinpath("plot"), force=True)
+        return sum(r["status"] == "rendered" for r in rows)
+
+    return run, "charts"
+
+
+STAGES = {
+    "build_records": prepare_build_records,
+    "grounding": prepare_grounding,
+    "clipscore": prepare_clipscore,
+    "report": prepare_report,
+    "charts": prepare_charts,
+}
+
+
+def _peak_rss_mb() -> float:
+    # Linux reports ru_maxrss in KiB, macOS in bytes
+    unit = 1 if sys.platform == "darwin" else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * unit / (1024 * 1024)
+
+
+def run_stage(stage: str, scale: int, work_dir: Path) -> dict:
+    """Prepare and time one stage in this process (called in the stage subprocess)."""
+    import tempfile
+    with tempfile.TemporaryDirectory(prefix=f"bench_{stage}_", dir=work_dir) as tmp:
+        run, unit = STAGES[stage](work_dir, scale, Path(tmp))
+        gc.collect()
+        t0 = time.perf_counter()
+        items = run()
+        wall = time.perf_counter() - t0
+    return {"stage": stage, "scale": scale, "items": items, "unit": unit, "wall_s": wall,
+            "items_per_s": items / wall if wall > 0 else None, "peak_rss_mb": _peak_rss_mb()}
+
+
+def spawn_stage(stage: str, scale: int, work_dir: Path, verbose: bool = False) -> dict:
+    """Run one stage in a fresh interpreter; returns its result dict (or one with "error")."""
+    result_path = work_dir.joinpath(f".result_{stage}_x{scale}.json")
+    result_path.unlink(missing_ok=True)
+    env = dict(os.environ, HF_HUB_OFFLINE="1", TRANSFORMERS_OFFLINE="1", MPLBACKEND="Agg")
+    if not verbose:
+        env["TQDM_DISABLE"] = "1"
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--_stage", stage, "--_scale", str(scale),
+           "--work_dir", str(work_dir), "--_result", str(result_path)]
+    out = None if verbose else subprocess.DEVNULL
+    proc = subprocess.run(cmd, cwd=PROJECT_ROOT, env=env, stdout=out, stderr=None if verbose else subprocess.PIPE,
+                          text=True)
+    if proc.returncode != 0 or not result_path.exists():
+        tail = (proc.stderr or "").strip().splitlines()[-5:]
+        return {"stage": stage, "scale": scale, "error": f"exit {proc.returncode}: " + " | ".join(tail)}
+    result = json.loads(result_path.read_text(encoding="utf-8"))
+    result_path.unlink()
+    return result
+
+
+def best_of(runs: list) -> dict:
+    """Fastest wall time, highest peak RSS of the repeats of one (stage, scale)."""
+    ok = [r for r in runs if "error" not in r]
+    if not ok:
+        return runs[-1]
+    best = dict(min(ok, key=lambda r: r["wall_s"]))
+    best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in ok)
+    best["runs"] = len(ok)
+    return best
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_meta() -> dict:
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(), "python": platform.python_version(),
+            "platform": platform.platform(), "machine": platform.machine(), "cpu_count": os.cpu_count()}
+
+
+def compare(results: list, baseline: list, threshold: float, rss_threshold: float) -> list:
+    """Rows {"stage", "scale", "wall_ratio", "rss_ratio", "regressed"} for (stage, scale) pairs in both."""
+    base = {(b["stage"], b["scale"]): b for b in baseline if "error" not in b}
+    rows = []
+    for r in results:
+        b = base.get((r["stage"], r["scale"]))
+        if b is None or "error" in r:
+            continue
+        wall_ratio = r["wall_s"] / b["wall_s"] if b["wall_s"] else None
+        rss_ratio = r["peak_rss_mb"] / b["peak_rss_mb"] if b["peak_rss_mb"] else None
+        regressed = []
+        if wall_ratio is not None and wall_ratio > 1 + threshold:
+            regressed.append("wall")
+        if rss_ratio is not None and rss_ratio > 1 + rss_threshold:
+            regressed.append("rss")
+        rows.append({"stage": r["stage"], "scale": r["scale"], "wall_ratio": wall_ratio, "rss_ratio": rss_ratio,
+                     "items_changed": r["items"] != b["items"], "regressed": regressed})
+    return rows
+
+
+def print_results(results: list, comparison: list = None):
+    cmp = {(c["stage"], c["scale"]): c for c in comparison or []}
+    print(f"{'stage':<14} {'scale':>5} {'items':>8} {'wall s':>8} {'items/s':>10} {'peak MB':>8}  vs baseline")
+    for r in results:
+        if "error" in r:
+            print(f"{r['stage']:<14} {r['scale']:>5}  FAILED {r['error']}")
+            continue
+        c = cmp.get((r["stage"], r["scale"]))
+        note = ""
+        if c is not None:
+            note = f"wall x{c['wall_ratio']:.2f}, rss x{c['rss_ratio']:.2f}"
+            if c["items_changed"]:
+                note += ", item count changed"
+            if c["regressed"]:
+                note += "  REGRESSION (" + ", ".join(c["regressed"]) + ")"
+        print(f"{r['stage']:<14} {r['scale']:>5} {r['items']:>8} {r['wall_s']:>8.2f} {r['items_per_s']:>10.1f} "
+              f"{r['peak_rss_mb']:>8.1f}  {note}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of annotation build, grounding, CLIPScore, "
+                                                 "report aggregation and charts")
+    parser.add_argument("--stages", nargs="+", choices=STAGE_NAMES, default=list(STAGE_NAMES), help="要测的阶段")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1], help="输入规模倍数（1 = 现有数据集规模）")
+    parser.add_argument("--repeat", type=int, default=1, help="每个阶段 / 规模运行次数，取最快的一次")
+    parser.add_argument("--work_dir", type=Path, default=Path(".cache", "benchmark"),
+                        help="合成数据与小模型的目录（相对项目根目录，跨运行复用）")
+    parser.add_argument("--out", type=Path, default=Path("benchmark_results.json"), help="结果文件（相对项目根目录）")
+    parser.add_argument("--baseline", type=Path, default=None, help="与此基线结果比较，超出阈值时退出码为 1")
+    parser.add_argument("--save_baseline", type=Path, default=None, help="把本次结果另存为基线")
+    parser.add_argument("--threshold", type=float, default=0.2, help="墙钟时间允许增长的比例")
+    parser.add_argument("--rss_threshold", type=float, default=0.25, help="峰值内存允许增长的比例")
+    parser.add_argument("--verbose", action="store_true", help="显示各阶段自身的输出")
+    parser.add_argument("--_stage", help=argparse.SUPPRESS)
+    parser.add_argument("--_scale", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--_result", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    work_dir = PROJECT_ROOT.joinpath(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    if args._stage:
+        # 子进程：只跑一个阶段，结果写入 --_result
+        result = run_stage(args._stage, args._scale, work_dir)
+        args._result.write_text(json.dumps(result), encoding="utf-8")
+        return
+
+    results = []
+    for stage in args.stages:
+        for scale in args.scales:
+            runs = []
+            for k in range(args.repeat):
+                print(f"[bench] {stage} x{scale} run {k + 1}/{args.repeat}", flush=True)
+                runs.append(spawn_stage(stage, scale, work_dir, args.verbose))
+            results.append(best_of(runs))
+
+    report = {"meta": run_meta(), "results": results}
+    out_path = PROJECT_ROOT.joinpath(args.out)
+    out_path.write_text(json.dumps(report, indent=1), encoding="utf-8")
+
+    comparison = None
+    if args.baseline:
+        baseline = json.loads(PROJECT_ROOT.joinpath(args.baseline).read_text(encoding="utf-8"))
+        comparison = compare(results, baseline["results"], args.threshold, args.rss_threshold)
+    print_results(results, comparison)
+    print("results ->", out_path)
+    if args.save_baseline:
+        path = PROJECT_ROOT.joinpath(args.save_baseline)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=1), encoding="utf-8")
+        print("baseline saved to", path)
+
+    failed = [r for r in results if "error" in r]
+    regressed = [c for c in comparison or [] if c["regressed"]]
+    if regressed:
+        print(f"{len(regressed)} regression(s) beyond +{args.threshold:.0%} wall / +{args.rss_threshold:.0%} RSS")
+    if failed or regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# scripts/build_manifest.py
+"""
+Persisted content-hash manifest for incremental annotation rebuilds.
+
+The manifest lives next to the annotation outputs (data/annotation/build_manifest.json)
+and records, from the previous build:
+- "files":  source image / label XML -> {"size", "mtime_ns", "sha1"}
+- "images": source image -> renamed data/image/NNNN.jpg
+- "image_mode": how data/image was materialized (copy / hardlink / reflink / symlink)
+- "steps":  metastep name -> sha1 of its metasteps_caption.json entry
+- "groups": "<device>|<step>|<phase>|<category>|<idx>" -> {"digest", "offset", "count"},
+            where offset/count locate the group's records in records_<device>_final.json
+"""
+import hashlib
+import json
+from pathlib import Path
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "build_manifest.json"
+
+
+def empty_manifest() -> dict:
+    return {"version": MANIFEST_VERSION, "files": {}, "images": {}, "image_mode": None, "steps": {}, "groups": {}}
+
+
+def load_manifest(path: Path) -> dict:
+    """Load a previous manifest; a missing or outdated one yields an empty manifest (full rebuild)."""
+    if not path.exists():
+        return empty_manifest()
+    try:
+        manifest = json.loads(path.read_text(encoding='utf-8'))
+    except ValueError:
+        print(f"[WARN] Ignoring unreadable build manifest: {path}")
+        return empty_manifest()
+    if manifest.get("version") != MANIFEST_VERSION:
+        return empty_manifest()
+    for k, v in empty_manifest().items():
+        manifest.setdefault(k, v)
+    return manifest
+
+
+def save_manifest(path: Path, manifest: dict):
+    manifest["version"] = MANIFEST_VERSION
+    path.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding='utf-8')
+
+
+def file_sha1(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint_file(path: Path, previous: dict = None) -> dict:
+    """
+    Return {"size", "mtime_ns", "sha1"} for path. The file is only re-hashed
+    when its size or mtime differ from the previous fingerprint.
+    """
+    st = path.stat()
+    if previous and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns:
+        return previous
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": file_sha1(path)}
+
+
+def json_sha1(obj) -> str:
+    """Stable hash of any JSON-serializable value (e.g. one metastep entry)."""
+    data = json.dumps(obj, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
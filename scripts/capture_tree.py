@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# scripts/capture_tree.py
+"""
+Synthetic capture tree for scale tests of the annotation pipeline.
+
+Writes the layout build_records() reads, from data/metasteps_caption.json:
+
+    <root>/data/metasteps_caption.json
+    <root>/data/anomalyDataset_label/<device>/point<P>/<step>-<pre|post>/<normal|abnormal>/
+        <idx>_<near|far>_<view>.jpg                 placeholder JPEG (image_size)
+        label/<idx>_<near|far>_<view>.xml           Pascal-VOC boxes matching the JPEG size
+        <idx>-<ref step>-<ref phase>-<ref category>-<ref idx>.txt
+                                                    reuse the images of another description at the same point
+
+Scale 1 matches the bundled dataset: fix_arm 466 images / 746 records and
+mobile_arm 1 205 images / 2 042 records (DATASET_SIZE). The share of
+records that come from txt references is the same. A device takes the
+(step, phase) checks whose CheckDev names it. Every description gets its
+share of the device's images, at one of 11 inspection points, with distinct
+(distance, view) pairs that rotate over both distances and all 14 VIEW_MAP
+views. Scale N writes N replicas of that layout at points 11·r + 1 ..
+11·r + 11 (different view draws per replica), so images, records, points
+and txt references all grow N times while every folder keeps at most
+28 images per description.
+
+Label XMLs hold one "normal" box (normal category) or one box named after
+the description's anomaly type (abnormal category), plus 0-3 object boxes.
+The JPEGs are one small gray frame per category, made unique per file by a
+JPEG comment holding the file's path (distinct content hashes, no encoding
+cost per image).
+
+    python scripts/capture_tree.py --scale 10 --out .cache/capture_tree_x10
+    python scripts/auto_annotation_final.py --root .cache/capture_tree_x10
+"""
+import argparse
+import io
+import json
+import random
+import shutil
+import struct
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from auto_annotation_final import VIEW_MAP
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+METASTEPS = PROJECT_ROOT.joinpath("data", "metasteps_caption.json")
+# (images, records) per device in the bundled data/annotation/records_<device>_final.json
+DATASET_SIZE = {"fix_arm": (466, 746), "mobile_arm": (1205, 2042)}
+DEVICE_NAMES = {"fix_arm": "fixed robot arm", "mobile_arm": "mobile robot arm"}
+POINTS = 11
+DISTANCES = ("near", "far")
+VIEW_SLOTS = [(d, v) for v in sorted(VIEW_MAP) for d in DISTANCES]    # 28 (distance, view) pairs
+OBJECT_NAMES = ("test tube", "test tube cap", "silicone container", "mold", "mold brush", "pigment container")
+
+
+class Group(NamedTuple):
+    step: str
+    phase: str
+    category: str
+    idx: int            # 1-based position of the description in <phase>CheckRes[category]
+    desc: dict
+    point: int          # home point (1..POINTS) within a replica
+
+
+class TreeStats(NamedTuple):
+    devices: int
+    points: int
+    groups: int
+    images: int
+    label_xmls: int
+    txt_refs: int
+    records: int        # records build_records() will produce
+    bytes: int
+
+
+def device_checks(meta: dict, device: str) -> list:
+    """(step, phase, entry) of the checks done by a device (its name in <phase>CheckDev)."""
+    name = DEVICE_NAMES[device]
+    return [(step, phase, entry) for step, entry in meta.items() for phase in ("pre", "post")
+            if name in (entry.get(f"{phase}CheckDev") or "")]
+
+
+def device_groups(meta: dict, device: str) -> list:
+    groups = []
+    for step, phase, entry in device_checks(meta, device):
+        res_block = entry.get(f"{phase}CheckRes") or {}
+        for category in ("normal", "abnormal"):
+            for i, desc in enumerate(res_block.get(category) or [], start=1):
+                groups.append(Group(step, phase, category, i, desc, len(groups) % POINTS + 1))
+    return groups
+
+
+def allocate(total: int, n: int, rng: random.Random) -> list:
+    """Split total into n near-equal counts (at most len(VIEW_SLOTS) each), remainder spread at random."""
+    if n == 0:
+        return []
+    counts = [total // n] * n
+    for k in rng.sample(range(n), total % n):
+        counts[k] += 1
+    return [min(c, len(VIEW_SLOTS)) for c in counts]
+
+
+def plan_refs(groups: list, counts: list, target: int, rng: random.Random) -> list:
+    """
+    (referrer, referenced) group index pairs at the same point and category,
+    adding about `target` records (each pair adds the referenced group's images).
+    """
+    candidates = [(a, b) for a, ga in enumerate(groups) for b, gb in enumerate(groups)
+                  if a != b and ga.point == gb.point and ga.category == gb.category and counts[b]]
+    rng.shuffle(candidates)
+    refs, added = [], 0
+    for a, b in candidates:
+        if added >= target:
+            break
+        if added + counts[b] <= target + counts[b] // 2:
+            refs.append((a, b))
+            added += counts[b]
+    return refs
+
+
+def _placeholder_jpeg(size: tuple, shade: int) -> bytes:
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", size, (shade, shade, shade)).save(buf, format="JPEG", quality=75)
+    return buf.getvalue()
+
+
+def _with_comment(jpeg: bytes, text: str) -> bytes:
+    # COM 段紧跟在 SOI 之后：像素不变，文件内容（哈希）各不相同
+    data = text.encode("utf-8")[:65533]
+    return jpeg[:2] + b"\xff\xfe" + struct.pack(">H", len(data) + 2) + data + jpeg[2:]
+
+
+def _box(rng: random.Random, width: int, height: int) -> tuple:
+    x0, x1 = sorted(rng.sample(range(width), 2))
+    y0, y1 = sorted(rng.sample(range(height), 2))
+    return x0, y0, x1, y1
+
+
+def label_xml(filename: str, size: tuple, objects: list) -> str:
+    """Pascal-VOC annotation with [(name, (xmin, ymin, xmax, ymax)), ...]."""
+    width, height = size
+    lines = ["<annotation>", f"  <filename>{filename}</filename>",
+             f"  <size><width>{width}</width><height>{height}</height><depth>3</depth></size>"]
+    for name, (x0, y0, x1, y1) in objects:
+        lines.append(f"  <object><name>{name}</name><bndbox><xmin>{x0}</xmin><ymin>{y0}</ymin>"
+                     f"<xmax>{x1}</xmax><ymax>{y1}</ymax></bndbox></object>")
+    lines.append("</annotation>")
+    return "\n".join(lines) + "\n"
+
+
+def generate_tree(root: Path, scale: int = 1, seed: int = 0, image_size: tuple = (64, 48),
+                  devices=tuple(DATASET_SIZE), dry_run: bool = False) -> TreeStats:
+    """Write a capture tree of `scale` times the bundled dataset under root; dry_run only counts."""
+    meta = json.loads(METASTEPS.read_text(encoding="utf-8"))
+    data_dir = root.joinpath("data")
+    base = data_dir.joinpath("anomalyDataset_label")
+    if not dry_run:
+        data_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(METASTEPS, data_dir.joinpath("metasteps_caption.json"))
+    jpegs = {"normal": _placeholder_jpeg(image_size, 140), "abnormal": _placeholder_jpeg(image_size, 110)}
+    width, height = image_size
+    n_groups = n_images = n_refs = n_records = n_bytes = 0
+
+    for device in devices:
+        rng = random.Random(f"{seed}-{device}")
+        groups = device_groups(meta, device)
+        images, records = DATASET_SIZE[device]
+        counts = allocate(images, len(groups), rng)
+        refs = plan_refs(groups, counts, records - sum(counts), rng)
+        n_groups += len(groups)
+        for r in range(scale):
+            made = set()
+            for g, n in zip(groups, counts):
+                point = POINTS * r + g.point
+                folder = base.joinpath(device, f"point{point}", f"{g.step}-{g.phase}", g.category)
+                start = rng.randrange(len(VIEW_SLOTS))
+                slots = [VIEW_SLOTS[(start + k) % len(VIEW_SLOTS)] for k in range(n)]
+                n_images += n
+                n_records += n
+                if dry_run:
+                    continue
+                if folder not in made:
+                    folder.joinpath("label").mkdir(parents=True, exist_ok=True)
+                    made.add(folder)
+                for distance, view in slots:
+                    stem = f"{g.idx}_{distance}_{view}"
+                    jpeg = _with_comment(jpegs[g.category], folder.joinpath(stem).relative_to(root).as_posix())
+                    folder.joinpath(stem + ".jpg").write_bytes(jpeg)
+                    anomaly = g.desc.get("type") if g.category == "abnormal" else "normal"
+                    objects = [(anomaly or "abnormal", _box(rng, width, height))]
+                    objects += [(rng.choice(OBJECT_NAMES), _box(rng, width, height)) for _ in range(rng.randrange(4))]
+                    xml = label_xml(stem + ".jpg", image_size, objects)
+                    folder.joinpath("label", stem + ".xml").write_text(xml, encoding="utf-8")
+                    n_bytes += len(jpeg) + len(xml)
+            for a, b in refs:
+                ga, gb = groups[a], groups[b]
+                n_refs += 1
+                n_records += counts[b]
+                if dry_run:
+                    continue
+                folder = base.joinpath(device, f"point{POINTS * r + ga.point}", f"{ga.step}-{ga.phase}", ga.category)
+                folder.mkdir(parents=True, exist_ok=True)
+                folder.joinpath(f"{ga.idx}-{gb.step}-{gb.phase}-{gb.category}-{gb.idx}.txt").write_text(
+                    f"same capture as {gb.step}-{gb.phase}/{gb.category} #{gb.idx}\n", encoding="utf-8")
+    return TreeStats(len(devices), POINTS * scale, n_groups, n_images, n_images, n_refs, n_records, n_bytes)
+
+
+def parse_size(spec: str) -> tuple:
+    w, h = spec.lower().split("x")
+    return int(w), int(h)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic anomalyDataset_label capture tree")
+    parser.add_argument("--scale", type=int, default=1, help="相对现有数据集的规模倍数，如 1 / 10 / 100")
+    parser.add_argument("--out", type=Path, default=None,
+                        help="输出根目录（相对项目根目录），默认 .cache/capture_tree_x<scale>")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--image_size", type=parse_size, default=(64, 48), help="占位 JPEG 尺寸，如 64x48")
+    parser.add_argument("--devices", nargs="+", choices=sorted(DATASET_SIZE), default=list(DATASET_SIZE))
+    parser.add_argument("--force", action="store_true", help="输出目录已存在时先删除")
+    parser.add_argument("--dry_run", action="store_true", help="只统计数量，不写文件")
+    args = parser.parse_args()
+    if args.scale < 1:
+        parser.error("--scale must be >= 1")
+
+    root = PROJECT_ROOT.joinpath(args.out or Path(".cache", f"capture_tree_x{args.scale}"))
+    if not args.dry_run and root.joinpath("data", "anomalyDataset_label").exists():
+        if not args.force:
+            parser.error(f"{root} already holds a capture tree (use --force to replace it)")
+        shutil.rmtree(root.joinpath("data", "anomalyDataset_label"))
+    t0 = time.perf_counter()
+    stats = generate_tree(root, args.scale, args.seed, args.image_size, tuple(args.devices), args.dry_run)
+    print(f"{'would write' if args.dry_run else 'wrote'} {stats.images} images + {stats.label_xmls} label XMLs, "
+          f"{stats.txt_refs} txt references ({stats.groups} descriptions x {stats.points} points, "
+          f"{stats.devices} devices) -> {stats.records} records expected")
+    if not args.dry_run:
+        print(f"{stats.bytes / 1e6:.1f} MB in {time.perf_counter() - t0:.1f}s, tree root: {root}")
+
+
+if __name__ == "__main__":
+    main()
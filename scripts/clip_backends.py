@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# scripts/clip_backends.py
+"""
+Inference backends for the CLIPScore scripts.
+
+- fp32         eager CLIPModel (reference)
+- int8         dynamically int8-quantized nn.Linear layers (CPU)
+- torchscript  traced image / text encoders (texts padded to a fixed length)
+- onnx         encoders exported to ONNX and run with onnxruntime on CPU
+               (optional dependency: pip install onnx onnxruntime)
+
+Every backend returns L2-normalized features as torch tensors, so the
+scoring code in compute_clipscore.py does not depend on the backend.
+
+Parity check against fp32 on the bundled dataset:
+    python scripts/clip_backends.py data/annotation/annotation.json --backends int8 torchscript onnx
+
+torch and transformers are only imported when a backend is built, so
+importing BACKENDS / MODEL_ID (e.g. for argument parsing) stays cheap.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import functools
+
+import numpy as np
+
+from lazy_import import lazy_import
+
+torch = lazy_import("torch")
+
+MODEL_ID = "openai/clip-vit-base-patch32"
+BACKENDS = ("fp32", "int8", "torchscript", "onnx")
+
+
+def as_features(out):
+    # transformers>=5 returns a model output whose pooler_output holds the projected features
+    return out if isinstance(out, torch.Tensor) else out.pooler_output
+
+
+def set_threads(num_threads: int = None, interop_threads: int = None):
+    """Intra-op / inter-op thread counts for torch (call before the first forward pass)."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work has started
+            print(f"[WARN] inter-op threads already fixed at {torch.get_num_interop_threads()}")
+
+
+@functools.lru_cache(maxsize=None)
+def encoder_classes() -> tuple:
+    """(ImageEncoder, TextEncoder) nn.Modules, defined on first use so that importing this module does not load torch."""
+
+    class ImageEncoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            v = as_features(self.model.get_image_features(pixel_values=pixel_values))
+            return v / v.norm(p=2, dim=-1, keepdim=True)
+
+    class TextEncoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            t = as_features(self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask))
+            return t / t.norm(p=2, dim=-1, keepdim=True)
+
+    return ImageEncoder, TextEncoder
+
+
+class EagerBackend:
+    """fp32 eager CLIPModel."""
+    name = "fp32"
+    fixed_length = False
+
+    def __init__(self, model_name: str = MODEL_ID, device: str = "cpu"):
+        self.model_name = model_name
+        self.device = device
+        from transformers import CLIPModel, CLIPProcessor
+        self.model = CLIPModel.from_pretrained(model_name).to(device)
+        self.model.eval()
+        self.proc = CLIPProcessor.from_pretrained(model_name)
+        self.prepare()
+        image_encoder, text_encoder = encoder_classes()
+        self.image_encoder = image_encoder(self.model).eval()
+        self.text_encoder = text_encoder(self.model).eval()
+        self.compile()
+
+    def prepare(self):
+        """Hook to transform self.model before the encoders are built."""
+
+    def compile(self):
+        """Hook to replace the eager encoders (tracing / export)."""
+
+    @property
+    def max_length(self) -> int:
+        return self.model.config.text_config.max_position_embeddings
+
+    def tokenize(self, texts: list):
+        if self.fixed_length:
+            return self.proc.tokenizer(texts, return_tensors="pt", padding="max_length",
+                                       max_length=self.max_length, truncation=True)
+        return self.proc.tokenizer(texts, return_tensors="pt", padding=True)
+
+    def image_features(self, pixel_values: np.ndarray) -> torch.Tensor:
+        with torch.no_grad():
+            return self.image_encoder(torch.from_numpy(pixel_values).to(self.device))
+
+    def text_features(self, texts: list) -> torch.Tensor:
+        tok = self.tokenize(texts)
+        with torch.no_grad():
+            return self.text_encoder(tok["input_ids"].to(self.device), tok["attention_mask"].to(self.device))
+
+    def fingerprint_parts(self) -> list:
+        return [self.name, self.model.config.to_dict(), self.proc.image_processor.to_dict()]
+
+    def _example_pixels(self):
+        size = self.model.config.vision_config.image_size
+        return torch.zeros(2, 3, size, size, device=self.device)
+
+    def _example_text(self):
+        tok = self.tokenize(["a photo", "a photo of a test tube"])
+        return tok["input_ids"].to(self.device), tok["attention_mask"].to(self.device)
+
+
+class Int8Backend(EagerBackend):
+    """Dynamic int8 quantization of every nn.Linear (weights int8, activations quantized on the fly)."""
+    name = "int8"
+
+    def prepare(self):
+        if self.device != "cpu":
+            raise ValueError("int8 backend runs on CPU only")
+        self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class TorchScriptBackend(EagerBackend):
+    """Traced encoders; texts are padded to a fixed length so one trace covers every batch."""
+    name = "torchscript"
+    fixed_length = True
+
+    def compile(self):
+        with torch.no_grad():
+            self.image_encoder = torch.jit.optimize_for_inference(
+                torch.jit.trace(self.image_encoder, self._example_pixels(), check_trace=False))
+            self.text_encoder = torch.jit.optimize_for_inference(
+                torch.jit.trace(self.text_encoder, self._example_text(), check_trace=False))
+
+
+class OnnxBackend(EagerBackend):
+    """Encoders exported to ONNX and executed by onnxruntime's CPU provider."""
+    name = "onnx"
+    fixed_length = True
+
+    def __init__(self, model_name: str = MODEL_ID, device: str = "cpu", num_threads: int = None,
+                 interop_threads: int = None, export_dir: Path = None):
+        self.num_threads = num_threads
+        self.interop_threads = interop_threads
+        self.export_dir = export_dir
+        super().__init__(model_name, device)
+
+    def compile(self):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("onnx backend requires `pip install onnx onnxruntime`") from e
+
+        export_dir = Path(self.export_dir or tempfile.mkdtemp(prefix="clip_onnx_"))
+        export_dir.mkdir(parents=True, exist_ok=True)
+        image_path, text_path = export_dir.joinpath("image.onnx"), export_dir.joinpath("text.onnx")
+        with torch.no_grad():
+            torch.onnx.export(self.image_encoder, (self._example_pixels(),), str(image_path),
+                              input_names=["pixel_values"], output_names=["image_embeds"],
+                              dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                              dynamo=False)
+            torch.onnx.export(self.text_encoder, self._example_text(), str(text_path),
+                              input_names=["input_ids", "attention_mask"], output_names=["text_embeds"],
+                              dynamic_axes={"input_ids": {0: "batch"}, "attention_mask": {0: "batch"},
+                                            "text_embeds": {0: "batch"}},
+                              dynamo=False)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            opts.intra_op_num_threads = self.num_threads
+        if self.interop_threads:
+            opts.inter_op_num_threads = self.interop_threads
+        providers = ["CPUExecutionProvider"]
+        self.image_session = ort.InferenceSession(str(image_path), opts, providers=providers)
+        self.text_session = ort.InferenceSession(str(text_path), opts, providers=providers)
+
+    def image_features(self, pixel_values: np.ndarray) -> torch.Tensor:
+        out = self.image_session.run(None, {"pixel_values": pixel_values.astype(np.float32)})[0]
+        return torch.from_numpy(out)
+
+    def text_features(self, texts: list) -> torch.Tensor:
+        tok = self.tokenize(texts)
+        out = self.text_session.run(None, {"input_ids": tok["input_ids"].numpy(),
+                                           "attention_mask": tok["attention_mask"].numpy()})[0]
+        return torch.from_numpy(out)
+
+
+def load_backend(name: str = "fp32", model_name: str = MODEL_ID, device: str = "cpu",
+                 num_threads: int = None, interop_threads: int = None) -> EagerBackend:
+    """Build a CLIP inference backend by name (see BACKENDS)."""
+    set_threads(num_threads, interop_threads)
+    if name == "fp32":
+        return EagerBackend(model_name, device)
+    if name == "int8":
+        return Int8Backend(model_name, device)
+    if name == "torchscript":
+        return TorchScriptBackend(model_name, device)
+    if name == "onnx":
+        return OnnxBackend(model_name, device, num_threads, interop_threads)
+    raise ValueError(f"Unknown backend: {name} (expected one of {BACKENDS})")
+
+
+def max_deviation(ref: dict, other: dict) -> float:
+    """Largest absolute score difference over keys scored by both runs."""
+    diffs = [abs(ref[k] - other[k]) for k in ref if ref[k] is not None and other.get(k) is not None]
+    return max(diffs, default=0.0)
+
+
+def parity_check(records: list, images_root: Path, backends=("int8", "torchscript", "onnx"),
+                 model_name: str = MODEL_ID, **kwargs) -> list:
+    """
+    Score records with fp32 and each backend; report the maximum CLIPScore /
+    RefCLIPScore deviation from fp32 and the wall time of every run.
+    """
+    from compute_clipscore import compute_scores
+
+    results = []
+    base = None
+    for name in ("fp32",) + tuple(b for b in backends if b != "fp32"):
+        t0 = time.perf_counter()
+        clip, ref = compute_scores(records, images_root, device="cpu", backend=name,
+                                   model_name=model_name, **kwargs)
+        row = {"backend": name, "seconds": round(time.perf_counter() - t0, 3)}
+        if base is None:
+            base = (clip, ref)
+        else:
+            row["max_clip_score_dev"] = max_deviation(base[0], clip)
+            row["max_ref_clip_score_dev"] = max_deviation(base[1], ref)
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLIPScore backend parity check against fp32")
+    parser.add_argument("records_json", type=Path, help="records file, e.g. data/annotation/annotation.json")
+    parser.add_argument("--backends", nargs="+", default=["int8", "torchscript", "onnx"], choices=BACKENDS)
+    parser.add_argument("--model", default=MODEL_ID)
+    parser.add_argument("--limit", type=int, default=None, help="only score the first N records")
+    parser.add_argument("--num_threads", type=int, default=None, help="intra-op threads")
+    parser.add_argument("--interop_threads", type=int, default=None, help="inter-op threads")
+    parser.add_argument("--batch_size", type=int, default=32)
+    args = parser.parse_args()
+
+    from annotation_io import iter_records
+    project_root = Path(__file__).parent.parent.resolve()
+    records = list(iter_records(project_root.joinpath(args.records_json)))[:args.limit]
+    parity_check(records, project_root, args.backends, model_name=args.model, batch_size=args.batch_size,
+                 num_threads=args.num_threads, interop_threads=args.interop_threads)
+
+
+if __name__ == "__main__":
+    main()
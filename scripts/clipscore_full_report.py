@@ -1,7 +1,9 @@
-import json
-import pandas as pd
+import argparse
+import csv
 from pathlib import Path
 
+from score_aggregate import FIELDS, METRICS, ScoreAggregator
+
 # 定义视角列表（索引0~13）
 VIEWS_ORDER = [
     "top-down view", "left-down view", "front-down view", "right-down view",
@@ -15,68 +17,106 @@ VIEWS_ORDER = [
 BASE_DIR = Path(__file__).parent.parent
 FIX_PATH = BASE_DIR.joinpath("data", "clipscores", "fix_clipscoreslow_results.json")
 MOBILE_PATH = BASE_DIR.joinpath("data", "clipscores", "mobile_clipscoreslow_results.json")
+ANNOTATION_GLOB = "data/annotation/records_*_final.json"
 OUTPUT_DIR = BASE_DIR.joinpath("data", "clipscores", "reports")
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-
-# 加载 JSON 文件
-def load_json(path):
-    if not path.exists():
-        print(f"⚠️ 文件未找到: {path}")
-        return []
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
-
-# 解析 clip_score、near/far 和视角 index
-def parse_data(data):
-    records = []
-    for item in data:
-        image_id = item.get("image_id", "")
-        score = item.get("clip_score", None)
-        parts = Path(image_id).stem.split("_")
-        if len(parts) == 3 and score is not None:
-            distance = parts[1]  # near / far
-            view_index = int(parts[2])
-            records.append({
-                "distance": distance,
-                "view": view_index,
-                "clip_score": score
-            })
-    return pd.DataFrame(records)
+
+# 默认分组：distance × view 透视表所需的分组 + 各维度汇总
+DEFAULT_GROUPINGS = [
+    ("distance", "view"), ("distance",), ("view",), (),
+    ("arm",), ("step",), ("anomaly_type",), ("source",),
+    ("arm", "step", "view", "distance", "anomaly_type"),
+]
+
+
+def parse_grouping(spec: str) -> tuple:
+    """"arm,step" -> ("arm", "step"); "all" -> () (overall totals)."""
+    spec = spec.strip()
+    return () if spec in ("", "all") else tuple(f.strip() for f in spec.split(",") if f.strip())
+
+
+def _fmt(v):
+    return "" if v is None else v
+
+
+def write_table(path: Path, rows: list, grouping: tuple, metrics=METRICS):
+    columns = list(grouping) + [f"{m}_{s}" for m in metrics for s in ("count", "sum", "mean", "var", "std")]
+    with path.open("w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(columns)
+        for row in rows:
+            w.writerow([_fmt(row.get(c)) for c in columns])
+
+
+def _view_order(view):
+    return (VIEWS_ORDER.index(view), "") if view in VIEWS_ORDER else (len(VIEWS_ORDER), str(view))
+
+
+def write_pivots(agg: ScoreAggregator, out_dir: Path, metric: str = "clip_score"):
+    """
+    distance × view 透视表（均值 / 累计 / 计数，含边际汇总），与旧版 pivot_table 输出的三张表对应。
+    需要分组 (distance, view)、(distance,)、(view,) 和 () 都在 agg 中。
+    """
+    cells = {(r["distance"], r["view"]): r for r in agg.table(("distance", "view"))}
+    by_distance = {r["distance"]: r for r in agg.table(("distance",))}
+    by_view = {r["view"]: r for r in agg.table(("view",))}
+    overall = (agg.table(()) or [{}])[0]
+    distances = sorted((d for d in by_distance if d is not None), key=str)
+    views = sorted((v for v in by_view if v is not None), key=_view_order)
+
+    for stat, name, margin in (("mean", "clipscore_avg.csv", "Average"),
+                               ("sum", "clipscore_sum.csv", "Total"),
+                               ("count", "clipscore_count.csv", "Total")):
+        col = f"{metric}_{stat}"
+        with out_dir.joinpath(name).open("w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["distance"] + views + [margin])
+            for d in distances:
+                w.writerow([d] + [_fmt(cells.get((d, v), {}).get(col)) for v in views]
+                           + [_fmt(by_distance[d].get(col))])
+            w.writerow([margin] + [_fmt(by_view[v].get(col)) for v in views] + [_fmt(overall.get(col))])
+
 
 def main():
-    # 加载数据
-    fix_data = load_json(FIX_PATH)
-    mobile_data = load_json(MOBILE_PATH)
-    all_data = fix_data + mobile_data
+    parser = argparse.ArgumentParser(description="CLIPScore 分组统计报表（流式单遍聚合）")
+    parser.add_argument("--scores", type=Path, nargs="+", default=None,
+                        help="CLIPScore 结果文件（.json / .jsonl），默认 fix / mobile 两个结果文件")
+    parser.add_argument("--annotations", type=Path, nargs="+", default=None,
+                        help=f"标注 records 文件，用于按 Image_Id 关联元数据（默认 {ANNOTATION_GLOB}）")
+    parser.add_argument("--group_by", action="append", default=None, metavar="FIELDS",
+                        help=f"分组字段，逗号分隔，可多次指定；all 表示总体。可选字段：{', '.join(FIELDS)}")
+    parser.add_argument("--out_dir", type=Path, default=OUTPUT_DIR)
+    parser.add_argument("--chunk_size", type=int, default=1 << 16, help="每次归并的分数条数")
+    args = parser.parse_args()
+
+    score_paths = []
+    for p in args.scores or [FIX_PATH, MOBILE_PATH]:
+        if Path(p).exists():
+            score_paths.append(p)
+        else:
+            print(f"⚠️ 文件未找到: {p}")
+    annotation_paths = args.annotations or sorted(BASE_DIR.glob(ANNOTATION_GLOB))
 
-    df = parse_data(all_data)
+    groupings = [parse_grouping(g) for g in args.group_by] if args.group_by else list(DEFAULT_GROUPINGS)
+    pivot = all(g in groupings for g in DEFAULT_GROUPINGS[:4])
 
-    if df.empty:
+    agg = ScoreAggregator(annotation_paths, groupings, chunk_size=args.chunk_size)
+    for path in score_paths:
+        agg.add_scores(path)
+
+    if not agg.scores:
         print("❌ 没有有效数据，请检查 JSON 文件内容。")
         return
+    if agg.unmatched:
+        print(f"⚠️ {agg.unmatched} 条分数在标注中找不到对应的 Image_Id，元数据字段记为空")
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    for grouping, rows in agg.tables().items():
+        name = "clipscore_by_" + ("_".join(grouping) or "all") + ".csv"
+        write_table(args.out_dir.joinpath(name), rows, grouping, agg.metrics)
+    if pivot:
+        write_pivots(agg, args.out_dir)
 
-    # 平均值表
-    pivot_mean = df.pivot_table(
-        index="distance", columns="view", values="clip_score",
-        aggfunc="mean", margins=True, margins_name="Average"
-    )
-    pivot_mean.to_csv(OUTPUT_DIR.joinpath("clipscore_avg.csv"))
-
-    # 累计值表
-    pivot_sum = df.pivot_table(
-        index="distance", columns="view", values="clip_score",
-        aggfunc="sum", margins=True, margins_name="Total"
-    )
-    pivot_sum.to_csv(OUTPUT_DIR.joinpath("clipscore_sum.csv"))
-
-    # 计数字段
-    pivot_count = df.pivot_table(
-        index="distance", columns="view", values="clip_score",
-        aggfunc="count", margins=True, margins_name="Total"
-    )
-    pivot_count.to_csv(OUTPUT_DIR.joinpath("clipscore_count.csv"))
-
-    print("✅ CLIPScore 分析完成，文件保存在:", OUTPUT_DIR)
+    print(f"✅ CLIPScore 分析完成：{agg.scores} 条分数，{len(groupings)} 个分组，文件保存在:", args.out_dir)
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 import json
+import os
 import argparse
 from pathlib import Path
+from typing import NamedTuple
 from PIL import Image
-import torch
-from transformers import CLIPProcessor, CLIPModel
-from tqdm import tqdm
-from scipy.stats import hmean
 import numpy as np
 
+from lazy_import import lazy_import
+from annotation_io import JsonArrayWriter, iter_records
+from clip_backends import BACKENDS, MODEL_ID, load_backend
+from build_manifest import file_sha1, json_sha1
+from embedding_cache import EmbeddingCache
+from pixel_cache import PixelCache, load_resized_batch, normalize_pixels, processor_size
+from score_checkpoint import ScoreCheckpoint, checkpoint_path, merge_checkpoints, parse_shard, shard_of
+
+# 重依赖按需加载：--help / 参数检查 / --merge 不需要 torch、scipy、tqdm
+torch = lazy_import("torch")
+stats = lazy_import("scipy.stats")
+tqdm = lazy_import("tqdm")
+
 def load_json(path: Path):
     if not path.exists():
         raise FileNotFoundError(f"找不到 JSON 文件：{path}")
@@ -17,95 +28,361 @@ def load_json(path: Path):
         raise ValueError(f"JSON 文件为空：{path}")
     return json.loads(text)
 
+_worker_image_processor = None
+
+
+def _init_decode_worker(image_processor):
+    global _worker_image_processor
+    _worker_image_processor = image_processor
+
+
+def decode_images(paths: list, image_processor=None):
+    """Decode + preprocess a batch of images into a float32 (B, 3, H, W) array."""
+    image_processor = image_processor or _worker_image_processor
+    imgs = [Image.open(p).convert("RGB") for p in paths]
+    return image_processor(images=imgs, return_tensors="np")["pixel_values"]
+
+
+def iter_batches(items, batch_size: int):
+    batch = []
+    for it in items:
+        batch.append(it)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ScoreItem(NamedTuple):
+    key: str                # image id as given in the record
+    path: Path              # resolved image path
+    text: str               # prefix + candidate description
+    ref_text: str           # prefix + caption, or None
+    sha1: str = None        # image content hash (when the embedding cache is used)
+    cached: object = None   # cached normalized image embedding, or None
+    index: int = None       # position of the record in the input (checkpoint key)
+    pixels: object = None   # pre-resized uint8 image from the PixelCache, or None
+
+
+def _to_decode(batch) -> list:
+    return [it.path for it in batch if it.cached is None and it.pixels is None]
+
+
+def _from_pixel_cache(batch, decoded, image_processor, pixel_cache: PixelCache):
+    """pixel_values of the uncached items: cached uint8 crops + freshly resized ones (added to the cache)."""
+    todo = [it for it in batch if it.cached is None]
+    if not todo:
+        return None
+    fresh = iter(decoded if decoded is not None else ())
+    arrays = []
+    for it in todo:
+        arr = it.pixels
+        if arr is None:
+            arr = next(fresh)
+            pixel_cache.put(it.sha1, arr)
+        arrays.append(arr)
+    return normalize_pixels(arrays, image_processor)
+
+
+def prefetch_pixels(batches, image_processor, num_workers: int, pixel_cache: PixelCache = None):
+    """
+    Yield (batch, pixel_values) with images decoded by num_workers processes;
+    pixel_values covers only the items without a cached embedding (None if all are cached).
+    At most 2 * num_workers batches are in flight, so decoding overlaps with
+    record parsing and model inference without buffering the whole dataset.
+    With a pixel_cache, workers only draft-decode the images missing from it and
+    every image is rescaled / normalized from its pre-resized uint8 crop.
+    """
+    if pixel_cache is None:
+        decode, args, finish = decode_images, (), lambda batch, out: out
+    else:
+        decode, args = load_resized_batch, (pixel_cache.size,)
+        finish = lambda batch, out: _from_pixel_cache(batch, out, image_processor, pixel_cache)
+
+    if num_workers <= 0:
+        for batch in batches:
+            paths = _to_decode(batch)
+            out = None
+            if paths:
+                out = decode_images(paths, image_processor) if pixel_cache is None else decode(paths, *args)
+            yield batch, finish(batch, out)
+        return
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_decode_worker,
+                             initargs=(image_processor,)) as pool:
+        inflight = deque()
+        for batch in batches:
+            paths = _to_decode(batch)
+            inflight.append((batch, pool.submit(decode, paths, *args) if paths else None))
+            if len(inflight) >= 2 * num_workers:
+                done, fut = inflight.popleft()
+                yield done, finish(done, fut.result() if fut else None)
+        while inflight:
+            done, fut = inflight.popleft()
+            yield done, finish(done, fut.result() if fut else None)
+
+
+def record_fields(rec: dict) -> tuple:
+    """(image id, description, caption) from the current annotation schema or the older lowercase keys."""
+    image_id = rec["image_id"] if "image_id" in rec else rec["Image_Id"]
+    desc = rec.get("Anomaly Label Description", rec.get("Anomaly_Label_Description")) or ""
+    caption = rec.get("caption", rec.get("Caption")) or ""
+    return image_id, desc, caption
+
+
 def compute_scores(
-    records: list,
+    records,
     images_root: Path,
     references: dict = None,
     device: str = "cuda",
     prefix: str = "A photo depicts",
     weight: float = 2.5,
+    batch_size: int = 32,
+    num_workers: int = None,
+    model_name: str = MODEL_ID,
+    cache_dir: Path = None,
+    clear_cache: bool = False,
+    backend: str = "fp32",
+    num_threads: int = None,
+    interop_threads: int = None,
+    checkpoint: ScoreCheckpoint = None,
+    pixel_cache_dir: Path = None,
 ):
-    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
-    proc  = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    """
+    CLIPScore (and RefCLIPScore against the record caption) for every record.
+    Images are decoded and preprocessed by `num_workers` processes while the
+    model runs; image and text features are computed `batch_size` records at
+    a time; text features come from a TextEmbeddingTable that encodes each
+    distinct candidate / reference string once. Records may be any iterable (e.g. annotation_io.iter_records) and
+    are consumed lazily.
+    With cache_dir, normalized image embeddings are looked up by image content
+    hash in a persistent EmbeddingCache and only missing images are decoded.
+    backend selects the inference variant (fp32 / int8 / torchscript / onnx,
+    see clip_backends.py); num_threads / interop_threads set the CPU thread pools.
+    With a checkpoint, records already in it (by position in `records`) are
+    skipped, new scores are appended to it periodically, and the returned maps
+    cover the checkpointed and the newly scored records.
+    With pixel_cache_dir, images are read as pre-resized crops from a
+    PixelCache (draft-mode JPEG decoding fills it on a miss).
+    """
+    engine = load_backend(backend, model_name, device, num_threads, interop_threads)
+    proc = engine.proc
+    if num_workers is None:
+        num_workers = min(4, os.cpu_count() or 1)
+
+    pixel_cache = None
+    if pixel_cache_dir is not None:
+        pixel_cache = PixelCache(pixel_cache_dir, processor_size(proc.image_processor))
+
+    cache = None
+    if cache_dir is not None:
+        fingerprint = EmbeddingCache.model_fingerprint(model_name, engine.fingerprint_parts())
+        # draft 解码的像素与完整解码略有差异，embedding 分开缓存
+        cache_id = f"{model_name}-{backend}" + ("-resized" if pixel_cache is not None else "")
+        cache = EmbeddingCache(cache_dir, cache_id, fingerprint)
+        if clear_cache:
+            cache.clear()
 
     clip_scores = {}
     ref_scores  = {}
 
-    for rec in tqdm(records, desc="Evaluating"):
-        rel_img = Path(rec["image_id"])
-        img_path = images_root.joinpath(rel_img).resolve()
-        # 打印每张图片的绝对路径
-        # print(f"→ Image ID: {rel_img}  → Resolved Path: {img_path}")
-
-        if not img_path.exists():
-            clip_scores[str(rel_img)] = None
-            ref_scores[str(rel_img)]  = None
-            continue
-
-        img = Image.open(img_path).convert("RGB")
-        cand_desc = rec.get("Anomaly Label Description", "").strip()
-        text_c = f"{prefix} {cand_desc}"
-        inputs = proc(text=[text_c], images=[img], return_tensors="pt", padding=True).to(device)
-
-        with torch.no_grad():
-            v = model.get_image_features(**{k: v for k, v in inputs.items() if k.startswith("pixel")})
-            c = model.get_text_features(**{k: v for k, v in inputs.items() if k.startswith("input")})
-        v = v / v.norm(p=2, dim=-1, keepdim=True)
-        c = c / c.norm(p=2, dim=-1, keepdim=True)
-
-        cos_ci = (v * c).sum().item()
-        s_ci = weight * max(cos_ci, 0.0)
-        clip_scores[str(rel_img)] = s_ci        
-
-        # 打印得分
-        # print(f"   clip_score: {clip_scores[str(rel_img)]:.4f}")
-        # RefCLIPScore 部分（若有提供 references_json）
-        # if references and str(rel_img) in references:
-        #     ref_sims = []
-        #     for ref in references[str(rel_img)]:
-        #         inp = proc(text=[f"{prefix} {ref}"], images=[img], return_tensors="pt", padding=True).to(device)
-        #         with torch.no_grad():
-        #             rv = model.get_image_features(**{k: v for k, v in inp.items() if k.startswith("pixel")})
-        #             rc = model.get_text_features(**{k: v for k, v in inp.items() if k.startswith("input")})
-        #         rv = rv / rv.norm(p=2, dim=-1, keepdim=True)
-        #         rc = rc / rc.norm(p=2, dim=-1, keepdim=True)
-        #         sim = max((rv * rc).sum().item(), 0.0)
-        #         ref_sims.append(weight * sim)
-        #     ref_scores[str(rel_img)] = sum(ref_sims) / len(ref_sims) if ref_sims else None
-        #     print(f"   ref_score: {ref_scores[str(rel_img)]:.4f}")
-        # else:
-        #     ref_scores[str(rel_img)] = None
-        ref_text = rec.get("caption", "").strip()
-        if ref_text:
-            # 用 CLIPProcessor 对文本各自 token 再提取特征
-            inp_ref = proc(text=[text_c, f"{prefix} {ref_text}"], images=None,
-                           return_tensors="pt", padding=True).to(device)
-            # Processor 返回 'input_ids' 和 'attention_mask'
-            t_feats = model.get_text_features(**{k:v for k,v in inp_ref.items() if k.startswith("input")})
-            # t_feats[0] 对应候选描述，t_feats[1] 对应参考描述
-            t_c, t_r = t_feats[0:1], t_feats[1:2]
-            t_c = t_c / t_c.norm(p=2, dim=-1, keepdim=True)
-            t_r = t_r / t_r.norm(p=2, dim=-1, keepdim=True)
-            cos_cr = (t_c * t_r).sum().item()
-            s_cr =  max(cos_cr, 0.0)
-
-            # 3. 按论文定义取二者的谐波平均
+    seen = 0
+
+    # 1. 待评分条目（惰性生成）；图片不存在的直接记为 None；已在 checkpoint 中的跳过
+    def scorable():
+        nonlocal seen
+        for index, rec in enumerate(records):
+            seen = index + 1
+            if checkpoint is not None and index in checkpoint:
+                continue
+            image_id, cand_desc, ref_text = record_fields(rec)
+            rel_img = Path(image_id)
+            img_path = images_root.joinpath(rel_img).resolve()
+            # 打印每张图片的绝对路径
+            # print(f"→ Image ID: {rel_img}  → Resolved Path: {img_path}")
+            if not img_path.exists():
+                clip_scores[str(rel_img)] = None
+                ref_scores[str(rel_img)]  = None
+                if checkpoint is not None:
+                    checkpoint.add(index, str(rel_img), None, None)
+                continue
+            cand_desc, ref_text = cand_desc.strip(), ref_text.strip()
+            item = ScoreItem(str(rel_img), img_path, f"{prefix} {cand_desc}",
+                             f"{prefix} {ref_text}" if ref_text else None, index=index)
+            if cache is not None:
+                sha1 = cache.content_hash(img_path)
+                item = item._replace(sha1=sha1, cached=cache.get(sha1))
+            if pixel_cache is not None and item.cached is None:
+                sha1 = item.sha1 or pixel_cache.content_hash(img_path)
+                item = item._replace(sha1=sha1, pixels=pixel_cache.get(sha1))
+            yield item
+
+    # 2. 子进程解码图片，与推理重叠
+    # 3. 文本特征：每个唯一文本只编码一次
+    texts = TextEmbeddingTable(engine)
+    batches = prefetch_pixels(iter_batches(scorable(), batch_size), proc.image_processor, num_workers, pixel_cache)
+    try:
+        for batch, pixel_values in tqdm.tqdm(batches, desc="Evaluating", unit="batch"):
+            v = image_features(engine, batch, pixel_values, cache)
+            score_batch(texts, batch, v, weight, clip_scores, ref_scores)
+            if checkpoint is not None:
+                for it in batch:
+                    checkpoint.add(it.index, it.key, clip_scores[it.key], ref_scores[it.key])
+                checkpoint.maybe_flush()
+        if checkpoint is not None:
+            checkpoint.finish(seen)
+    finally:
+        print(texts.report())
+        if cache is not None:
+            cache.flush()
+            print(cache.report())
+        if pixel_cache is not None:
+            pixel_cache.flush()
+            print(pixel_cache.report())
+        if checkpoint is not None:
+            # 中断时也保留已完成的评分，下次运行从这里继续
+            checkpoint.flush()
+
+    if checkpoint is not None:
+        return checkpoint.scores()
+    return clip_scores, ref_scores
+
+
+def image_features(engine, batch: list, pixel_values, cache=None):
+    """Normalized image features of a batch: cached rows + one forward pass for the rest."""
+    device = engine.device
+    todo = [j for j, it in enumerate(batch) if it.cached is None]
+    if not todo:
+        return torch.from_numpy(np.stack([it.cached for it in batch])).to(device)
+    new = engine.image_features(pixel_values).to(device)
+    if cache is not None:
+        for j, row in zip(todo, new.cpu().numpy()):
+            cache.put(batch[j].sha1, row)
+    if len(todo) == len(batch):
+        return new
+    v = torch.empty((len(batch), new.shape[-1]), dtype=new.dtype, device=device)
+    v[todo] = new
+    hit = [j for j, it in enumerate(batch) if it.cached is not None]
+    v[hit] = torch.from_numpy(np.stack([batch[j].cached for j in hit])).to(device, new.dtype)
+    return v
+
+
+class TextEmbeddingTable:
+    """
+    Unique text -> row of a matrix of normalized CLIP text features.
+    Each distinct string is encoded once, in batches, the first time it is
+    seen; cosines between candidate and reference texts are memoized per
+    unique (candidate, reference) pair.
+    """
+
+    def __init__(self, engine, batch_size: int = 256):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.index = {}
+        self.matrix = None
+        self.pair_cos = {}
+        self.lookups = 0
+        self.forward_passes = 0
+
+    def ids(self, texts: list) -> list:
+        """Row ids of texts, encoding the ones not seen before."""
+        self.lookups += len(texts)
+        new = list(dict.fromkeys(t for t in texts if t not in self.index))
+        for i in range(0, len(new), self.batch_size):
+            chunk = new[i:i + self.batch_size]
+            feats = self.engine.text_features(chunk).to(self.engine.device)
+            self.forward_passes += 1
+            base = 0 if self.matrix is None else len(self.matrix)
+            self.matrix = feats if self.matrix is None else torch.cat([self.matrix, feats])
+            for k, t in enumerate(chunk):
+                self.index[t] = base + k
+        return [self.index[t] for t in texts]
+
+    def cosines(self, pairs: list) -> list:
+        """Cosine of each (row a, row b) pair; new unique pairs are computed as one batch."""
+        new = list(dict.fromkeys(p for p in pairs if p not in self.pair_cos))
+        if new:
+            a = self.matrix[[p[0] for p in new]]
+            b = self.matrix[[p[1] for p in new]]
+            self.pair_cos.update(zip(new, (a * b).sum(dim=-1).tolist()))
+        return [self.pair_cos[p] for p in pairs]
+
+    def report(self) -> str:
+        return (f"text embeddings: {len(self.index)} unique texts, {self.forward_passes} forward passes "
+                f"for {self.lookups} lookups, {len(self.pair_cos)} unique candidate/reference pairs")
+
+
+def score_batch(texts: TextEmbeddingTable, batch: list, v, weight: float, clip_scores: dict, ref_scores: dict):
+    """CLIPScore / RefCLIPScore of a batch given its normalized image features v."""
+    c_ids = texts.ids([it.text for it in batch])
+    c = texts.matrix[c_ids]
+    cos_ci = (v * c.to(v.dtype)).sum(dim=-1).tolist()
+
+    # RefCLIPScore：候选描述与参考描述（caption）的文本相似度，按唯一文本对查表
+    ref_idx = [j for j, it in enumerate(batch) if it.ref_text]
+    cos_cr = {}
+    if ref_idx:
+        r_ids = texts.ids([batch[j].ref_text for j in ref_idx])
+        cos_cr = dict(zip(ref_idx, texts.cosines([(c_ids[j], r) for j, r in zip(ref_idx, r_ids)])))
+
+    for j, it in enumerate(batch):
+        s_ci = weight * max(cos_ci[j], 0.0)
+        clip_scores[it.key] = s_ci
+        if j in cos_cr:
+            s_cr = max(cos_cr[j], 0.0)
+            # 按论文定义取二者的谐波平均
             #    RefCLIPScore = HMean(s_ci, s_cr)
-            ref_scores[str(rel_img)] = float(hmean([s_ci, s_cr]))
+            ref_scores[it.key] = float(stats.hmean([s_ci, s_cr]))
         else:
-            ref_scores[str(rel_img)] = None
+            ref_scores[it.key] = None
 
+def model_files_fingerprint(model_name: str) -> list:
+    """(name, size, mtime_ns) of the files of a local model directory; [] for a hub model id."""
+    model_dir = Path(model_name)
+    if not model_dir.is_dir():
+        return []
+    return [(p.relative_to(model_dir).as_posix(), p.stat().st_size, p.stat().st_mtime_ns)
+            for p in sorted(model_dir.rglob("*")) if p.is_file()]
 
 
+def run_fingerprint(records_path: Path, model_name: str, backend: str, references_path: Path = None,
+                    pixel_cache: bool = False) -> str:
+    """
+    Identifies the input file content and scoring config a checkpoint belongs to:
+    records / references content, model id (+ local weight files), backend and
+    whether pixels come from the resized pixel cache (draft decoding) or a full decode.
+    """
+    return json_sha1([file_sha1(records_path), file_sha1(references_path) if references_path else None,
+                      model_name, model_files_fingerprint(model_name), backend,
+                      "resized" if pixel_cache else "full"])
+
+
+def write_results(records, images_root: Path, clip_scores: dict, ref_scores: dict, out_path: Path) -> int:
+    """Write clipscore_results.json (one entry per record, in input order); returns the record count."""
+    with JsonArrayWriter(out_path) as out:
+        for rec in records:
+            rel_img, desc, caption = record_fields(rec)
+            abs_path = images_root.joinpath(rel_img).resolve()
+            out.write({
+                "image_id":      rel_img,
+                "absolute_path": str(abs_path),
+                "clip_score":    clip_scores.get(rel_img),
+                "ref_clip_score":ref_scores.get(rel_img),  # 输出键名改为 ref_clip_score
+                "description":   desc,
+                "caption":       caption
+            })
+    return out.count
 
-    return clip_scores, ref_scores
 
 def main():
     parser = argparse.ArgumentParser(description="Compute CLIPScore (+ optional RefCLIPScore)")
     parser.add_argument(
         "records_json",
         type=Path,
-        help="records JSON 文件相对路径，如 data/annotation/records_fix_arm.json"
+        help="records JSON/JSONL 文件相对路径，如 data/annotation/records_fix_arm.json"
     )
     parser.add_argument(
         "--references_json",
@@ -113,6 +390,33 @@ def main():
         default=None,
         help="可选的参考描述 JSON 文件相对路径"
     )
+    parser.add_argument("--model", default=MODEL_ID, help="CLIP 模型名或本地路径")
+    parser.add_argument("--batch_size", type=int, default=32, help="每批评分的记录数")
+    parser.add_argument("--num_workers", type=int, default=None,
+                        help="图片解码/预处理子进程数（默认 min(4, CPU 数)）")
+    parser.add_argument("--cache_dir", type=Path, default=Path(".cache", "clipscore"),
+                        help="图片 embedding 缓存目录（相对项目根目录）；并发的各分片可共用同一目录（写入时加文件锁）")
+    parser.add_argument("--no_cache", action="store_true", help="不使用图片 embedding 缓存")
+    parser.add_argument("--clear_cache", action="store_true", help="清空当前模型的 embedding 缓存后再评分")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32",
+                        help="推理后端：fp32 / int8 / torchscript / onnx（精度对比见 clip_backends.py）")
+    parser.add_argument("--num_threads", type=int, default=None, help="intra-op 线程数")
+    parser.add_argument("--interop_threads", type=int, default=None, help="inter-op 线程数")
+    parser.add_argument("--pixel_cache_dir", type=Path, default=None,
+                        help="预缩放像素缓存目录（相对项目根目录，如 .cache/pixels，见 pixel_cache.py）")
+    parser.add_argument("--shard", default="0/1",
+                        help="只评分第 i 个分片（共 n 个，按 image id 哈希划分），格式 i/n")
+    parser.add_argument("--merge", type=int, default=None, metavar="N",
+                        help="合并 N 个已完成分片的 checkpoint，写出 --out 结果文件")
+    parser.add_argument("--checkpoint_dir", type=Path, default=Path(".cache", "clipscore_checkpoints"),
+                        help="分片 checkpoint 目录（相对项目根目录）")
+    parser.add_argument("--checkpoint_interval", type=float, default=30.0,
+                        help="每隔多少秒把已完成的评分追加到 checkpoint")
+    parser.add_argument("--resume", action="store_true",
+                        help="不分片运行时也写 checkpoint，中断后重新运行可从断点继续（分片运行总是启用）")
+    parser.add_argument("--no_checkpoint", action="store_true", help="分片运行也不写 checkpoint（中断后需从头开始）")
+    parser.add_argument("--out", type=Path, default=Path("clipscore_results.json"),
+                        help="结果文件（相对项目根目录）")
     args = parser.parse_args()
 
     project_root = Path(__file__).parent.parent.resolve()
@@ -132,31 +436,59 @@ def main():
     images_root = project_root
     # print(f"Images root directory: {images_root}")
 
-    records    = load_json(records_path)
     references = load_json(references_path) if references_path else None
+    if not records_path.exists():
+        raise FileNotFoundError(f"找不到 JSON 文件：{records_path}")
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    clip_scores, ref_scores = compute_scores(
-        records, images_root, references, device=device
-    )
+    shard = parse_shard(args.shard)
+    checkpoint_dir = project_root.joinpath(args.checkpoint_dir)
+    if args.merge is None and args.no_checkpoint and shard[1] > 1:
+        parser.error("--shard 需要 checkpoint 才能合并，不能与 --no_checkpoint 同时使用")
+    if args.resume and args.no_checkpoint:
+        parser.error("--resume 与 --no_checkpoint 不能同时使用")
+    if args.clear_cache and shard[1] > 1:
+        # 各分片共用缓存，某个分片清空会删掉其他分片正在读的行
+        parser.error("--clear_cache 不能与 --shard 同时使用，请先不分片运行一次 --clear_cache")
+    # 不分片的普通运行默认不写 checkpoint；分片或显式 --resume 时才启用
+    use_checkpoint = not args.no_checkpoint and (shard[1] > 1 or args.resume)
+    fingerprint = None if not use_checkpoint and args.merge is None else \
+        run_fingerprint(records_path, args.model, args.backend, references_path, args.pixel_cache_dir is not None)
+
+    if args.merge is not None:
+        # 合并各分片 checkpoint（要求全部完成）
+        paths = [checkpoint_path(checkpoint_dir, records_path, (i, args.merge)) for i in range(args.merge)]
+        clip_scores, ref_scores = merge_checkpoints(paths, fingerprint)
+    else:
+        checkpoint = None
+        if use_checkpoint:
+            checkpoint = ScoreCheckpoint(checkpoint_path(checkpoint_dir, records_path, shard), fingerprint,
+                                         shard, interval=args.checkpoint_interval)
+
+        # 边解析边评分（支持 .json / .jsonl），只取本分片的记录
+        def shard_records():
+            for rec in iter_records(records_path):
+                if shard[1] == 1 or shard_of(record_fields(rec)[0], shard[1]) == shard[0]:
+                    yield rec
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        clip_scores, ref_scores = compute_scores(
+            shard_records(), images_root, references, device=device,
+            batch_size=args.batch_size, num_workers=args.num_workers, model_name=args.model,
+            cache_dir=None if args.no_cache else project_root.joinpath(args.cache_dir),
+            clear_cache=args.clear_cache, backend=args.backend,
+            num_threads=args.num_threads, interop_threads=args.interop_threads,
+            checkpoint=checkpoint,
+            pixel_cache_dir=project_root.joinpath(args.pixel_cache_dir) if args.pixel_cache_dir else None,
+        )
+        if shard[1] > 1:
+            print(f"分片 {shard[0]}/{shard[1]} 完成：{checkpoint.path}")
+            print(f"全部分片完成后运行 --merge {shard[1]} 生成 {args.out}")
+            return
+
+    out_path = project_root.joinpath(args.out).resolve()
+    count = write_results(iter_records(records_path), images_root, clip_scores, ref_scores, out_path)
 
-    out = []
-    for rec in records:
-        rel_img  = rec["image_id"]
-        abs_path = images_root.joinpath(rel_img).resolve()
-        out.append({
-            "image_id":      rel_img,
-            "absolute_path": str(abs_path),
-            "clip_score":    clip_scores.get(rel_img),
-            "ref_clip_score":ref_scores.get(rel_img),  # 输出键名改为 ref_clip_score
-            "description":   rec.get("Anomaly Label Description", ""),
-            "caption":       rec.get("caption", "")
-        })
-
-    out_path = project_root.joinpath("clipscore_results.json").resolve()
-    out_path.write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    print(f"完成：处理 {len(records)} 条记录，结果保存在 {out_path}")
+    print(f"完成：处理 {count} 条记录，结果保存在 {out_path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,141 @@
+# scripts/count_cube.py
+"""
+Dense record-count cube shared by the dataset charts.
+
+CountCube holds an int64 array of shape
+    (arm, anomaly_type, point, view, distance, label)
+with the number of annotation records in every cell, plus the label of
+every index on every axis. It is built in one vectorized pass from the
+Dataset code arrays (np.ravel_multi_index + np.bincount) and cached as
+count_cube.npz next to the annotation files; the cache is reused while the
+source files keep the same size / mtime / sha1.
+
+Charts slice the cube instead of re-scanning records:
+    cube.table("anomaly_type", "point", types, points, arm="fix_arm")
+returns a 2D count array in the requested label order (absent labels -> 0),
+with every other axis summed after filtering.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+
+from build_manifest import fingerprint_file, json_sha1
+from dataset import Dataset
+
+AXES = ("arm", "anomaly_type", "point", "view", "distance", "label")
+CUBE_NAME = "count_cube.npz"
+CUBE_VERSION = 1
+
+
+class CountCube:
+    def __init__(self, counts: np.ndarray, labels: dict):
+        """counts: array with one dimension per AXES entry; labels: axis -> list of index labels."""
+        self.counts = counts
+        self.labels = {a: list(labels[a]) for a in AXES}
+        self._index = {a: {v: i for i, v in enumerate(self.labels[a])} for a in AXES}
+
+    @classmethod
+    def from_dataset(cls, ds: Dataset) -> "CountCube":
+        codes = [ds.codes[a] for a in AXES]
+        shape = tuple(len(ds.vocab[a]) for a in AXES)
+        flat = np.ravel_multi_index(codes, shape) if len(ds) else np.empty(0, dtype=np.int64)
+        counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+        return cls(counts, {a: ds.vocab[a] for a in AXES})
+
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def values(self, axis: str, **filters) -> list:
+        """Labels of an axis with a non-zero count under filters, in index order."""
+        sums = self.table(axis, **filters)
+        return [v for v, n in zip(self.labels[axis], sums.tolist()) if n]
+
+    def marginal(self, *axes) -> tuple:
+        """(counts summed over every axis not in axes, {axis: labels}); axes keep cube order."""
+        keep = [a for a in AXES if a in axes]
+        counts = self.counts.sum(axis=tuple(i for i, a in enumerate(AXES) if a not in keep))
+        return counts, {a: self.labels[a] for a in keep}
+
+    def relabel(self, axis: str, mapping: dict) -> "CountCube":
+        """Cube with labels of one axis renamed (e.g. {None: "normal"}); merged labels are summed."""
+        new_labels = list(dict.fromkeys(mapping.get(v, v) for v in self.labels[axis]))
+        pos = {v: i for i, v in enumerate(new_labels)}
+        target = np.array([pos[mapping.get(v, v)] for v in self.labels[axis]], dtype=np.intp)
+        ax = AXES.index(axis)
+        shape = list(self.counts.shape)
+        shape[ax] = len(new_labels)
+        counts = np.zeros(shape, dtype=self.counts.dtype)
+        np.add.at(counts, (slice(None),) * ax + (target,), self.counts)
+        labels = dict(self.labels)
+        labels[axis] = new_labels
+        return CountCube(counts, labels)
+
+    def _positions(self, axis: str, wanted) -> tuple:
+        """Indices of the wanted labels on axis (-1 for labels not in the cube)."""
+        return np.array([self._index[axis].get(v, -1) for v in wanted], dtype=np.intp)
+
+    def table(self, rows: str, cols: str = None, rows_order=None, cols_order=None, **filters) -> np.ndarray:
+        """
+        Counts by rows (and cols) axis, in rows_order / cols_order label order
+        (default: cube order), after restricting other axes with filters
+        (single label or list of labels) and summing everything else.
+        """
+        sub = self.counts
+        for axis, want in filters.items():
+            if axis not in AXES:
+                raise KeyError(f"Unknown cube axis: {axis} (expected one of {AXES})")
+            want = list(want) if isinstance(want, (list, tuple, set, frozenset)) else [want]
+            idx = [self._index[axis][v] for v in want if v in self._index[axis]]
+            sub = np.take(sub, idx, axis=AXES.index(axis))
+        keep = [rows] + ([cols] if cols else [])
+        sub = sub.sum(axis=tuple(i for i, a in enumerate(AXES) if a not in keep))
+        if cols and AXES.index(cols) < AXES.index(rows):
+            sub = sub.T
+        for k, (axis, order) in enumerate(((rows, rows_order), (cols, cols_order))):
+            if axis is None or order is None:
+                continue
+            pos = self._positions(axis, order)
+            sub = np.take(sub, np.maximum(pos, 0), axis=k)
+            sub[(slice(None),) * k + (pos < 0,)] = 0
+        return sub
+
+    def save(self, path: Path, fingerprint: str = ""):
+        meta = {"version": CUBE_VERSION, "axes": AXES, "labels": self.labels, "fingerprint": fingerprint}
+        with open(path, "wb") as f:
+            np.savez(f, counts=self.counts, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, path: Path):
+        """(cube, fingerprint) from an .npz written by save(), or (None, None) if unreadable / outdated."""
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                meta = json.loads(str(z["meta"]))
+                counts = z["counts"]
+        except (OSError, ValueError, KeyError):
+            return None, None
+        if meta.get("version") != CUBE_VERSION or tuple(meta.get("axes", ())) != AXES:
+            return None, None
+        return cls(counts, meta["labels"]), meta.get("fingerprint")
+
+
+def sources_fingerprint(paths, image_points: dict = None) -> str:
+    return json_sha1([[Path(p).name, fingerprint_file(Path(p))] for p in paths] + [sorted((image_points or {}).items())])
+
+
+def load_cube(*paths, cache_path: Path = None, image_points: dict = None) -> CountCube:
+    """
+    Count cube of the given annotation files (arm from CheckDev or the
+    records_<arm>.json file name), read from cache_path (default:
+    count_cube.npz next to the first file) when the sources are unchanged.
+    """
+    paths = [Path(p) for p in paths]
+    cache_path = Path(cache_path) if cache_path else paths[0].parent.joinpath(CUBE_NAME)
+    fingerprint = sources_fingerprint(paths, image_points)
+    if cache_path.exists():
+        cube, cached = CountCube.load(cache_path)
+        if cube is not None and cached == fingerprint:
+            return cube
+    cube = CountCube.from_dataset(Dataset.from_files(*paths, image_points=image_points))
+    cube.save(cache_path, fingerprint)
+    return cube
@@ -0,0 +1,213 @@
+# scripts/dataset.py
+"""
+In-memory indexed view over annotation records.
+
+Dataset keeps one inverted index per field (value -> sorted row ids) plus a
+dense code array per field, so that
+- query(step="step4", view=[...], label=True) intersects posting lists
+  (smallest first) instead of scanning all records, and
+- count_by("anomaly_type", "view") counts only the matched rows.
+Queries return RecordView objects that reference rows of the original
+record list; records are never copied.
+
+Both the current schema (Views, Anomaly_Type, Anomaly_Label, ...) and the
+older lowercase keys (views, anomaly_Type, anomaly_Label, image_id) are
+understood.
+"""
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+
+from annotation_io import iter_records
+
+POINT_REGEX = re.compile(r"/point(\d+)/")
+
+# index name -> record keys tried in order
+FIELD_KEYS = {
+    "step": ("step",),
+    "phase": ("phase",),
+    "operator": ("Operator", "operator"),
+    "view": ("Views", "views"),
+    "distance": ("Distance", "distance"),
+    "anomaly_type": ("Anomaly_Type", "anomaly_Type"),
+    "label": ("Anomaly_Label", "anomaly_Label"),
+    "location": ("Detection_Location", "detection_Location"),
+}
+INDEX_FIELDS = tuple(FIELD_KEYS) + ("arm", "point")
+
+
+def _get(rec: dict, keys):
+    for k in keys:
+        if k in rec:
+            return rec[k]
+    return None
+
+
+def image_id_of(rec: dict) -> str:
+    return _get(rec, ("Image_Id", "image_id"))
+
+
+def arm_of(rec: dict, default: str = None) -> str:
+    # CheckDev looks like "Realsense455 mounted on fix_arm"
+    dev = _get(rec, ("CheckDev", "checkDev"))
+    return dev.rsplit(" ", 1)[-1] if dev else default
+
+
+def arm_from_filename(path: Path) -> str:
+    """Arm named by a records_<arm>[_final].json file, or None."""
+    m = re.match(r"records_(.+?)(_final)?$", Path(path).stem)
+    return m.group(1) if m else None
+
+
+def load_image_points(manifest_path: Path) -> dict:
+    """Image_Id -> point number, from the source paths kept in build_manifest.json."""
+    manifest = json.loads(Path(manifest_path).read_text(encoding='utf-8'))
+    points = {}
+    for src, new in manifest.get("images", {}).items():
+        m = POINT_REGEX.search("/" + src)
+        if m:
+            points[new] = int(m.group(1))
+    return points
+
+
+class RecordView:
+    """A set of rows of a Dataset; iterating yields the original record dicts."""
+
+    def __init__(self, dataset: "Dataset", rows: np.ndarray):
+        self.dataset = dataset
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        records = self.dataset.records
+        for i in self.rows.tolist():
+            yield records[i]
+
+    def __getitem__(self, i: int) -> dict:
+        return self.dataset.records[int(self.rows[i])]
+
+    def query(self, **filters) -> "RecordView":
+        return self.dataset.query(_rows=self.rows, **filters)
+
+    def count_by(self, *fields) -> dict:
+        return self.dataset.count_by(*fields, _rows=self.rows)
+
+    def values(self, field: str) -> list:
+        return [v for v in self.count_by(field)]
+
+
+class Dataset:
+    def __init__(self, records: list, arm: str = None, image_points: dict = None):
+        """
+        records: list of annotation records (kept by reference)
+        arm: arm name used when a record has no CheckDev (older per-arm files)
+        image_points: optional Image_Id -> point map (see load_image_points);
+                      otherwise the point is parsed from "/pointN/" in the image id
+        """
+        self.records = records if isinstance(records, list) else list(records)
+        self.vocab = {}
+        self.codes = {}
+        self.postings = {}
+        columns = {f: [] for f in INDEX_FIELDS}
+        image_points = image_points or {}
+        arms = arm if isinstance(arm, list) else None
+        for i, rec in enumerate(self.records):
+            for f, keys in FIELD_KEYS.items():
+                columns[f].append(_get(rec, keys))
+            columns["arm"].append(arm_of(rec, arms[i] if arms else arm))
+            image_id = image_id_of(rec) or ""
+            point = image_points.get(image_id)
+            if point is None:
+                m = POINT_REGEX.search(image_id)
+                point = int(m.group(1)) if m else None
+            columns["point"].append(point)
+        columns["label"] = [None if v is None else bool(v) for v in columns["label"]]
+        for f, values in columns.items():
+            self._index(f, values)
+
+    @classmethod
+    def from_files(cls, *paths, image_points: dict = None, **filters) -> "Dataset":
+        """
+        Build from annotation files (.json / .jsonl / .cols). Records of files
+        without CheckDev get their arm from the file name (records_<arm>[_final].json).
+        """
+        records, arms = [], []
+        for path in paths:
+            arm = arm_from_filename(path)
+            for rec in iter_records(path, **filters):
+                records.append(rec)
+                arms.append(arm)
+        return cls(records, arm=arms, image_points=image_points)
+
+    def _index(self, field: str, values: list):
+        vocab = {}
+        codes = np.fromiter((vocab.setdefault(v, len(vocab)) for v in values),
+                            dtype=np.int32, count=len(values))
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(vocab) + 1))
+        self.vocab[field] = list(vocab)
+        self.codes[field] = codes
+        self.postings[field] = {v: order[bounds[c]:bounds[c + 1]] for v, c in vocab.items()}
+
+    def __len__(self):
+        return len(self.records)
+
+    def values(self, field: str) -> list:
+        """Distinct values of an indexed field, in first-seen order."""
+        return list(self.vocab[field])
+
+    def query(self, _rows: np.ndarray = None, **filters) -> RecordView:
+        """
+        Rows matching every filter; a filter value may be a single value or a
+        list/tuple/set of alternatives, e.g. query(arm="fix_arm", view=[...], label=True).
+        """
+        lists = []
+        for field, want in filters.items():
+            if field not in self.postings:
+                raise KeyError(f"Unknown index field: {field} (expected one of {INDEX_FIELDS})")
+            postings = self.postings[field]
+            if isinstance(want, (list, tuple, set, frozenset)):
+                parts = [postings[v] for v in want if v in postings]
+                rows = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+            else:
+                rows = postings.get(want, np.empty(0, dtype=np.int64))
+            lists.append(rows)
+        if _rows is not None:
+            lists.append(_rows)
+        if not lists:
+            return RecordView(self, np.arange(len(self.records)))
+        lists.sort(key=len)
+        rows = lists[0]
+        for other in lists[1:]:
+            if not len(rows):
+                break
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return RecordView(self, rows)
+
+    def count_by(self, *fields, _rows: np.ndarray = None, **filters) -> dict:
+        """
+        {value: count} for one field or {(v1, v2, ...): count} for several,
+        counted over the rows matching filters only.
+        """
+        if filters or _rows is None:
+            _rows = self.query(_rows=_rows, **filters).rows
+        if not len(_rows):
+            return {}
+        combined = np.zeros(len(_rows), dtype=np.int64)
+        sizes = [len(self.vocab[f]) for f in fields]
+        for f, size in zip(fields, sizes):
+            combined = combined * size + self.codes[f][_rows]
+        uniq, counts = np.unique(combined, return_counts=True)
+        out = {}
+        for key, n in zip(uniq.tolist(), counts.tolist()):
+            parts = []
+            for f, size in zip(reversed(fields), reversed(sizes)):
+                key, c = divmod(key, size)
+                parts.append(self.vocab[f][c])
+            parts.reverse()
+            out[parts[0] if len(fields) == 1 else tuple(parts)] = n
+        return out
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# scripts/detect_prompts.py
+"""
+Render the VLM anomaly-detection prompts (vad/app/prompt/detectionpromptv2.py)
+for every annotation record.
+
+Each record fills the template placeholders from its step fields
+(Operator, Obj, Start_Position, Dest_Position, Stage_Description,
+Detection_Content); the output is one JSONL line per record:
+
+    {"image_id", "template", "system", "prompt", "prefix_bytes", "suffix_bytes", "label"}
+
+Rendering goes through prompt_engine.PromptRenderer (shared prefix / suffix,
+per-metastep memo); prefix_bytes / suffix_bytes are the UTF-8 lengths of the
+start / end of "prompt" shared by every record. With the default layout the
+shared prefix is only the text before the first placeholder; use
+--context_first to move the "Additional Context" block into it (see
+prompt_engine).
+
+Usage:
+    python scripts/detect_prompts.py data/annotation/records_fix_arm_final.json --template level2 --out prompts.jsonl
+    python scripts/detect_prompts.py data/annotation/records_fix_arm_final.json --show 1
+"""
+import argparse
+from pathlib import Path
+
+from annotation_io import JsonlWriter, iter_records
+from dataset import image_id_of
+from prompt_engine import SYSTEM_PROMPT, TEMPLATES, PromptRenderer
+
+
+def iter_prompts(records, renderer: PromptRenderer):
+    for rec in records:
+        prompt = renderer.render(rec)
+        yield {
+            "image_id": image_id_of(rec),
+            "template": renderer.template,
+            "system": SYSTEM_PROMPT,
+            "prompt": prompt.text,
+            "prefix_bytes": prompt.prefix_bytes,
+            "suffix_bytes": prompt.suffix_bytes,
+            "label": rec.get("Anomaly_Label", rec.get("anomaly_Label")),
+        }
+
+
+class _NullWriter:
+    def __enter__(self):
+        return self
+
+    def write(self, rec: dict):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render VLM anomaly-detection prompts for annotation records")
+    parser.add_argument("records", type=Path, nargs="+", help="records 文件（.json / .jsonl / .cols）")
+    parser.add_argument("--template", choices=sorted(TEMPLATES), default="level2", help="提示词模板")
+    parser.add_argument("--out", type=Path, default=None, help="输出 .jsonl（不指定则只统计 / 预览）")
+    parser.add_argument("--show", type=int, default=0, help="打印前 N 条提示词")
+    parser.add_argument("--context_first", action="store_true",
+                        help="把 Additional Context 段落移到最前面，使共享前缀覆盖整段（会改变提示词文本）")
+    args = parser.parse_args()
+
+    renderer = PromptRenderer(args.template, args.context_first)
+
+    count = 0
+    with JsonlWriter(args.out) if args.out else _NullWriter() as writer:
+        for path in args.records:
+            for item in iter_prompts(iter_records(path), renderer):
+                if count < args.show:
+                    print(f"--- {item['image_id']} (label={item['label']})\n{item['prompt']}")
+                writer.write(item)
+                count += 1
+    print(f"{count} prompts rendered with template {args.template}" + (f" -> {args.out}" if args.out else ""))
+    print(renderer.report())
+
+
+if __name__ == "__main__":
+    main()
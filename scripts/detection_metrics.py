@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# scripts/detection_metrics.py
+"""
+Answer parsing and incremental confusion-matrix metrics for VLM detection runs.
+
+The detection templates ask for "1.Yes, ..." / "2.No, ..." answers (the
+commented-out variant in detectionpromptv2.py adds "3.None, I'm unable to
+determine ..."). What "Yes" means depends on the template:
+    v1, level0/1/2, abnormal    Yes = there is an anomaly
+    normal                      Yes = the picture follows the normal condition
+AnswerParser reads an answer (whole, or chunk by chunk while it streams in)
+and returns the verdict True = anomaly, False = normal, None = undetermined
+("3.None" or no recognizable answer), using TEMPLATE_POLARITY.
+
+DetectionMetrics keeps TP / FP / TN / FN / undetermined counts (positive
+class = anomaly) for any number of groupings at once, e.g. ("template",),
+("arm",), ("view",), ("distance",), ("anomaly_type",), ("template", "view").
+It is updated one result row at a time, so precision / recall / F1 /
+accuracy are available at any point of a run without a pass over the
+results file. Accuracy and F1 are over rows with a decided verdict;
+coverage is the share of rows with a decided verdict.
+
+Summaries of a results file written by vlm_eval.py:
+    python scripts/detection_metrics.py vlm_eval_results.jsonl --group_by template --group_by view
+"""
+import argparse
+import csv
+import re
+from pathlib import Path
+
+# template -> True when "Yes" means an anomaly
+TEMPLATE_POLARITY = {
+    "v1": True,
+    "level0": True,
+    "level1": True,
+    "level2": True,
+    "normal": False,
+    "abnormal": True,
+}
+GROUP_FIELDS = ("template", "arm", "view", "distance", "anomaly_type", "label")
+DEFAULT_GROUPINGS = [(), ("template",), ("arm",), ("view",), ("distance",), ("anomaly_type",)]
+
+# "1.Yes" / "2. No" / "**3.None**" / "1、Yes"：选项编号 + 回答词
+OPTION_REGEX = re.compile(r"(?<![\d.])([123])\s*[.．、:：)]\s*\**\s*(yes|no|none)(?![a-z])", re.I)
+ANSWER_REGEX = re.compile(r"answer\s*[:：]?\s*\**\s*(yes|no|none)(?![a-z])", re.I)
+LEADING_REGEX = re.compile(r"^\W*(yes|no|none)(?![a-z])", re.I)
+WORD_VERDICT = {"yes": "yes", "no": "no", "none": None}
+
+
+class AnswerParser:
+    """
+    Polarity-aware parser of one answer. feed(chunk) returns the verdict as
+    soon as it is decided (else None); finish() returns the final verdict.
+    """
+
+    def __init__(self, template: str = "level2", yes_means_anomaly: bool = None):
+        self.yes_means_anomaly = TEMPLATE_POLARITY.get(template, True) if yes_means_anomaly is None \
+            else yes_means_anomaly
+        self.buffer = ""
+        self.word = None        # "yes" / "no" / "none" once decided
+        self.decided = False
+
+    def _match(self, final: bool):
+        text = self.buffer
+        for regex in (OPTION_REGEX, ANSWER_REGEX, LEADING_REGEX):
+            m = regex.search(text)
+            # 流式输入时词尾必须已经出现（"1.No" 后面可能是 "ne"）
+            if m and (final or m.end() < len(text)):
+                return m.group(m.lastindex).lower()
+        return None
+
+    def _verdict(self):
+        if self.word is None or WORD_VERDICT[self.word] is None:
+            return None
+        return (self.word == "yes") == self.yes_means_anomaly
+
+    def feed(self, chunk: str):
+        if not self.decided and chunk:
+            self.buffer += chunk
+            word = self._match(final=False)
+            if word is not None:
+                self.word, self.decided = word, True
+        return self._verdict() if self.decided else None
+
+    def finish(self):
+        if not self.decided:
+            self.word = self._match(final=True)
+            self.decided = True
+        return self._verdict()
+
+
+def parse_answer(text: str, template: str = "level2"):
+    """Verdict of a complete answer: True = anomaly, False = normal, None = undetermined."""
+    parser = AnswerParser(template)
+    parser.feed(text or "")
+    return parser.finish()
+
+
+def _ratio(a, b):
+    return a / b if b else None
+
+
+class ConfusionCounts:
+    __slots__ = ("tp", "fp", "tn", "fn", "undetermined")
+
+    def __init__(self):
+        self.tp = self.fp = self.tn = self.fn = self.undetermined = 0
+
+    def add(self, label: bool, verdict):
+        if verdict is None:
+            self.undetermined += 1
+        elif verdict:
+            if label:
+                self.tp += 1
+            else:
+                self.fp += 1
+        elif label:
+            self.fn += 1
+        else:
+            self.tn += 1
+
+    def summary(self) -> dict:
+        decided = self.tp + self.fp + self.tn + self.fn
+        precision = _ratio(self.tp, self.tp + self.fp)
+        recall = _ratio(self.tp, self.tp + self.fn)
+        f1 = _ratio(2 * self.tp, 2 * self.tp + self.fp + self.fn)
+        return {"n": decided + self.undetermined, "tp": self.tp, "fp": self.fp, "tn": self.tn, "fn": self.fn,
+                "undetermined": self.undetermined, "precision": precision, "recall": recall, "f1": f1,
+                "accuracy": _ratio(self.tp + self.tn, decided),
+                "coverage": _ratio(decided, decided + self.undetermined)}
+
+
+class DetectionMetrics:
+    def __init__(self, groupings=DEFAULT_GROUPINGS):
+        self.groupings = [tuple(g) for g in groupings]
+        for g in self.groupings:
+            unknown = set(g) - set(GROUP_FIELDS)
+            if unknown:
+                raise KeyError(f"Unknown group field(s): {sorted(unknown)} (expected {GROUP_FIELDS})")
+        self.counts = {g: {} for g in self.groupings}
+        self.rows = 0
+        self.skipped = 0        # rows without a label or with a request error
+
+    def add(self, row: dict, verdict=None) -> object:
+        """
+        Add one result row (vlm_eval.py format); the verdict is parsed from
+        row["answer"] with the row's template unless given. Returns the verdict.
+        """
+        if row.get("error") is not None or row.get("label") is None:
+            self.skipped += 1
+            return None
+        if verdict is None:
+            verdict = parse_answer(row.get("answer"), row.get("template") or "level2")
+        label = bool(row["label"])
+        self.rows += 1
+        for g, table in self.counts.items():
+            key = tuple(row.get(f) for f in g)
+            counts = table.get(key)
+            if counts is None:
+                counts = table[key] = ConfusionCounts()
+            counts.add(label, verdict)
+        return verdict
+
+    def table(self, grouping: tuple) -> list:
+        """Rows {field: value, ..., "n", "tp", ..., "precision", "recall", "f1", "accuracy", "coverage"}."""
+        grouping = tuple(grouping)
+        out = []
+        for key in sorted(self.counts[grouping], key=lambda k: tuple(str(v) for v in k)):
+            row = dict(zip(grouping, key))
+            row.update(self.counts[grouping][key].summary())
+            out.append(row)
+        return out
+
+    def overall(self) -> dict:
+        total = ConfusionCounts()
+        for counts in self.counts[self.groupings[0]].values():
+            for name in ConfusionCounts.__slots__:
+                setattr(total, name, getattr(total, name) + getattr(counts, name))
+        return total.summary()
+
+    def live_line(self) -> str:
+        s = self.overall()
+
+        def fmt(v):
+            return "-" if v is None else f"{v:.3f}"
+
+        return (f"n={s['n']} acc={fmt(s['accuracy'])} P={fmt(s['precision'])} R={fmt(s['recall'])} "
+                f"F1={fmt(s['f1'])} undetermined={s['undetermined']}")
+
+
+def _fmt(v):
+    return "" if v is None else v
+
+
+def report(metrics: DetectionMetrics) -> str:
+    """Overall line plus one short table per grouping."""
+    lines = [f"detection metrics: {metrics.rows} rows scored, {metrics.skipped} skipped (no label or request error)",
+             "  overall: " + metrics.live_line()]
+    for g in metrics.groupings:
+        if not g:
+            continue
+        lines.append(f"  by {', '.join(g)}:")
+        for row in metrics.table(g):
+            name = " / ".join(str(row[f]) for f in g)
+            acc, f1, cov = (("-" if row[k] is None else f"{row[k]:.3f}") for k in ("accuracy", "f1", "coverage"))
+            lines.append(f"    {name:<40} n={row['n']:<5} acc={acc} F1={f1} coverage={cov}")
+    return "\n".join(lines)
+
+
+def write_table(path: Path, rows: list, grouping: tuple):
+    columns = list(grouping) + ["n", "tp", "fp", "tn", "fn", "undetermined",
+                                "precision", "recall", "f1", "accuracy", "coverage"]
+    with path.open("w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(columns)
+        for row in rows:
+            w.writerow([_fmt(row.get(c)) for c in columns])
+
+
+def table_name(grouping: tuple) -> str:
+    return "detection_by_" + ("_".join(grouping) or "all") + ".csv"
+
+
+def parse_grouping(spec: str) -> tuple:
+    spec = spec.strip()
+    return () if spec in ("", "all") else tuple(f.strip() for f in spec.split(",") if f.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precision / recall / F1 of VLM detection results (streamed)")
+    parser.add_argument("results", type=Path, nargs="+", help="vlm_eval.py 结果文件（.jsonl）")
+    parser.add_argument("--group_by", action="append", default=None, metavar="FIELDS",
+                        help=f"分组字段，逗号分隔，可多次指定；all 表示总体。可选字段：{', '.join(GROUP_FIELDS)}")
+    parser.add_argument("--out_dir", type=Path, default=None, help="把各分组结果写成 CSV")
+    args = parser.parse_args()
+
+    from annotation_io import iter_records
+    groupings = [parse_grouping(g) for g in args.group_by] if args.group_by else list(DEFAULT_GROUPINGS)
+    if () not in groupings:
+        groupings.insert(0, ())
+    metrics = DetectionMetrics(groupings)
+    for path in args.results:
+        for row in iter_records(path):
+            metrics.add(row)
+    print(report(metrics))
+    if args.out_dir:
+        args.out_dir.mkdir(parents=True, exist_ok=True)
+        for g in metrics.groupings:
+            write_table(args.out_dir.joinpath(table_name(g)), metrics.table(g), g)
+        print("CSV saved to", args.out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# scripts/embedding_cache.py
+"""
+Persistent cache of normalized CLIP image embeddings.
+
+Layout (one sub-directory per model id):
+    <cache_dir>/<model id>/index.json       fingerprint, dim, sha1 -> row, path -> (size, mtime_ns, sha1)
+    <cache_dir>/<model id>/embeddings.f32   float32 rows, read through np.memmap
+
+Embeddings are keyed by the sha1 of the image file content, so the same
+data/image/NNNN.jpg referenced by several records, or scored again in a
+later run, costs one lookup. The fingerprint covers the model id, its config
+and the image preprocessing; when it changes the cache is invalidated.
+
+Several processes may share one cache directory (e.g. compute_clipscore.py
+shards). Loading, flushing and clearing hold an exclusive lock on
+<dir>/lock (fcntl; no locking where fcntl is unavailable). flush() re-reads
+index.json under the lock, numbers the new rows from the actual length of the
+data file, merges the other writers' keys and replaces index.json atomically.
+An index whose row count does not match the data file size is repaired on
+load: rows appended after the last index write (a writer killed mid-flush)
+are cut off; a data file shorter than the index invalidates the cache.
+"""
+import contextlib
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+
+from build_manifest import file_sha1, json_sha1
+
+
+class EmbeddingCache:
+    dtype = np.float32
+    data_name = "embeddings.f32"
+    label = "image embedding cache"
+
+    def __init__(self, cache_dir: Path, model_id: str, fingerprint: str = ""):
+        self.dir = Path(cache_dir).joinpath(re.sub(r"[^\w.-]+", "__", model_id))
+        self.index_path = self.dir.joinpath("index.json")
+        self.data_path = self.dir.joinpath(self.data_name)
+        self.model_id = model_id
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._mm = None
+        self._pending = {}      # sha1 -> row not yet written to the data file
+
+        with self._locked():
+            index = self._load_index()
+            self.dim = index.get("dim")
+            self.keys = index.get("keys", {})
+            self.path_hashes = index.get("paths", {})
+            self._committed = len(self.keys)
+            if not index:
+                self._clear()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Exclusive lock on the cache directory, shared with other processes using it."""
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.dir.joinpath("lock"), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _data_rows(self, dim) -> int:
+        """Whole rows in the data file (trailing partial bytes ignored)."""
+        size = self.data_path.stat().st_size if self.data_path.exists() else 0
+        row_bytes = dim * np.dtype(self.dtype).itemsize if dim else 0
+        return size // row_bytes if row_bytes else 0
+
+    def _load_index(self) -> dict:
+        """index.json checked against the fingerprint and the data file ({} = start over); call with the lock held."""
+        index = {}
+        if self.index_path.exists():
+            try:
+                index = json.loads(self.index_path.read_text(encoding="utf-8"))
+            except ValueError:
+                print(f"[cache] unreadable index, invalidating {self.dir}")
+                return {}
+        if index and index.get("fingerprint") != self.fingerprint:
+            print(f"[cache] model changed, invalidating {self.dir}")
+            return {}
+        rows = len(index.get("keys", {}))
+        size = self.data_path.stat().st_size if self.data_path.exists() else 0
+        expected = rows * index["dim"] * np.dtype(self.dtype).itemsize if rows else 0
+        if size < expected or (rows and max(index["keys"].values()) >= rows):
+            print(f"[cache] index and {self.data_name} disagree, invalidating {self.dir}")
+            return {}
+        if size > expected:
+            # 写入者在更新索引前被中断：多出的行没有索引指向，截掉
+            with open(self.data_path, "r+b") as f:
+                f.truncate(expected)
+        return index
+
+    @staticmethod
+    def model_fingerprint(model_id: str, parts: list = ()) -> str:
+        """Hash of the model id plus anything the embeddings depend on (config, preprocessing, backend)."""
+        return json_sha1([model_id, *parts])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def content_hash(self, path: Path) -> str:
+        """sha1 of the file, re-read only when size/mtime changed since it was last hashed."""
+        st = path.stat()
+        known = self.path_hashes.get(str(path))
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        sha1 = file_sha1(path)
+        self.path_hashes[str(path)] = [st.st_size, st.st_mtime_ns, sha1]
+        return sha1
+
+    def _matrix(self) -> np.ndarray:
+        if self._mm is None or len(self._mm) < self._committed:
+            self._mm = np.memmap(self.data_path, dtype=self.dtype, mode="r", shape=(self._committed, self.dim))
+        return self._mm
+
+    def get(self, sha1: str):
+        """Cached embedding for an image hash, or None (counted as hit / miss)."""
+        vec = self._pending.get(sha1)
+        if vec is not None:
+            self.hits += 1
+            return vec
+        row = self.keys.get(sha1)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.array(self._matrix()[row])
+
+    def put(self, sha1: str, vec):
+        if sha1 in self.keys or sha1 in self._pending:
+            return
+        vec = np.asarray(vec, dtype=self.dtype).reshape(-1)
+        if self.dim is None:
+            self.dim = len(vec)
+        self._pending[sha1] = vec
+
+    def flush(self):
+        """Append pending rows to the data file and merge them into the on-disk index (under the lock)."""
+        with self._locked():
+            index = self._load_index()
+            keys = index.get("keys", {})
+            dim = index.get("dim") or self.dim
+            if not index:
+                self.data_path.unlink(missing_ok=True)
+            # 行号以数据文件的实际行数为准：其他进程可能在本进程加载索引之后追加过
+            start = self._data_rows(dim)
+            new = {sha1: vec for sha1, vec in self._pending.items() if sha1 not in keys}
+            if new:
+                with open(self.data_path, "ab") as f:
+                    f.write(np.stack(list(new.values())).astype(self.dtype).tobytes())
+                keys.update({sha1: start + k for k, sha1 in enumerate(new)})
+            paths = index.get("paths", {})
+            paths.update(self.path_hashes)
+            index = {"model_id": self.model_id, "fingerprint": self.fingerprint, "dim": dim,
+                     "keys": keys, "paths": paths}
+            tmp = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(index), encoding="utf-8")
+            os.replace(tmp, self.index_path)
+        self.dim, self.keys, self.path_hashes = dim, keys, paths
+        self._committed, self._pending, self._mm = len(keys), {}, None
+
+    def _clear(self):
+        self.keys, self.path_hashes, self._pending = {}, {}, {}
+        self.dim, self._committed, self._mm = None, 0, None
+        self.data_path.unlink(missing_ok=True)
+        self.index_path.unlink(missing_ok=True)
+
+    def clear(self):
+        """Drop every cached row of this model."""
+        with self._locked():
+            self._clear()
+
+    def report(self) -> str:
+        return f"{self.label}: {self.hits} hits, {self.misses} misses, {len(self)} entries ({self.dir})"
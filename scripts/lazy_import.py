@@ -0,0 +1,31 @@
+# scripts/lazy_import.py
+"""
+Deferred imports for heavy optional dependencies (torch, transformers,
+scipy, tqdm, matplotlib).
+
+    torch = lazy_import("torch")
+
+binds a module object whose real import runs on first attribute access
+(importlib.util.LazyLoader), so scripts can keep module-level names while
+`--help`, argument checks and code paths that never touch the dependency
+skip its import cost. A module that is already imported is returned as is;
+a missing module raises ImportError at the lazy_import() call, as a plain
+import would.
+"""
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
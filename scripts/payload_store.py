@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# scripts/payload_store.py
+"""
+Pre-encoded, resolution-tiered image payloads for VLM requests.
+
+Every VLM request needs its images as base64 data URLs. Instead of
+re-reading, downscaling and base64-encoding each JPEG for every prompt level
+and every rerun, the ingest stage encodes every image once per tier, in a
+process pool:
+    "448", "768", ...   long side scaled down to that size and re-encoded as
+                        JPEG at a fixed quality; images already within the
+                        size keep their original bytes (stored once)
+    "full"              the original JPEG bytes, unchanged
+and stores the ready-made "data:image/jpeg;base64,..." strings in one blob:
+
+    <store_dir>/index.json      quality, Image_Id -> source fingerprint and tier -> [offset, length, width, height]
+    <store_dir>/payloads.blob   data URLs back to back, read through mmap
+
+Request builders call store.data_url(image_id, tier, path), which slices the
+mmap and decodes the ASCII bytes, with no per-request encoding cost. With
+path given, the entry is only served while the file still has the size /
+mtime it was encoded from; an edited image is reported as stale (None) so
+the caller encodes it on the fly until the store is rebuilt. An entry is
+re-encoded when its source file changes (size / mtime, then sha1); the
+superseded bytes stay in the blob until the store is rebuilt with --rebuild.
+Reads are thread-safe (vlm_eval.py slices payloads from asyncio.to_thread
+workers): the blob is remapped under a lock when it has grown, and a mapping
+other threads may still be reading from is never closed, only dropped.
+
+Build the store for every image referenced by a records file:
+    python scripts/payload_store.py data/annotation/records_fix_arm_final.json --tiers 448 768 full --workers 8
+"""
+import argparse
+import base64
+import io
+import json
+import mmap
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+from build_manifest import fingerprint_file
+
+PAYLOAD_STORE_VERSION = 1
+DEFAULT_TIERS = ("448", "768", "full")
+DATA_URL_PREFIX = b"data:image/jpeg;base64,"
+
+
+def _original(path: Path) -> tuple:
+    data = Path(path).read_bytes()
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+    return DATA_URL_PREFIX + base64.b64encode(data), width, height
+
+
+def encode_tier(path: Path, tier: str, quality: int = 90) -> tuple:
+    """(data URL bytes, width, height) of one image at one tier; images already within the tier keep their bytes."""
+    if tier == "full":
+        return _original(path)
+    long_side = int(tier)
+    with Image.open(path) as img:
+        w, h = img.size
+        if max(w, h) <= long_side:
+            # 不放大，也不重新编码（避免二次压缩损失）
+            return _original(path)
+        scale = long_side / max(w, h)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        img.draft("RGB", size)
+        img = img.convert("RGB")
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True)
+    return DATA_URL_PREFIX + base64.b64encode(buf.getvalue()), size[0], size[1]
+
+
+def encode_tiers(path: Path, tiers, quality: int = 90) -> dict:
+    out = {}
+    for tier in tiers:
+        payload = encode_tier(path, tier, quality)
+        # 原图尺寸已在档位内时各档位字节相同，共用同一个对象，put() 只写一份
+        out[tier] = next((p for p in out.values() if p[0] == payload[0]), payload)
+    return out
+
+
+def _encode_batch(jobs: list, quality: int) -> list:
+    return [encode_tiers(path, tiers, quality) for path, tiers in jobs]
+
+
+class PayloadStore:
+    def __init__(self, store_dir: Path, quality: int = None):
+        """quality: JPEG quality of the resized tiers; None keeps the store's own (readers), default 90 for a new one."""
+        self.dir = Path(store_dir)
+        self.index_path = self.dir.joinpath("index.json")
+        self.blob_path = self.dir.joinpath("payloads.blob")
+        self.quality = quality
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0          # lookups refused because the source file changed since encoding
+        self._mm = None
+        self._mm_lock = threading.Lock()
+        self._pending = []      # data URL bytes not yet appended to the blob
+        self._pending_size = 0
+
+        index = {}
+        if self.index_path.exists():
+            index = json.loads(self.index_path.read_text(encoding="utf-8"))
+        if quality is None:
+            quality = index.get("quality", 90)
+            self.quality = quality
+        if index and (index.get("version") != PAYLOAD_STORE_VERSION or index.get("quality") != quality):
+            print(f"[payloads] quality / format changed, rebuilding {self.dir}")
+            index = {}
+        self.entries = index.get("entries", {})     # image_id -> {"source": fingerprint, "tiers": {tier: [...]}}
+        self._committed = index.get("blob_size", 0)
+        if not index:
+            self.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.close()
+        self.entries, self._pending, self._pending_size, self._committed = {}, [], 0, 0
+        self.blob_path.unlink(missing_ok=True)
+        self.index_path.unlink(missing_ok=True)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def missing(self, image_id: str, path: Path, tiers) -> list:
+        """Tiers of an image that are absent or encoded from an older version of the file."""
+        entry = self.entries.get(image_id)
+        if entry is None:
+            return list(tiers)
+        source = fingerprint_file(Path(path), entry["source"])
+        if source["sha1"] != entry["source"]["sha1"]:
+            del self.entries[image_id]
+            return list(tiers)
+        entry["source"] = source
+        return [t for t in tiers if t not in entry["tiers"]]
+
+    def put(self, image_id: str, path: Path, payloads: dict):
+        """Add the encoded tiers {tier: (data URL bytes, width, height)} of an image."""
+        entry = self.entries.get(image_id)
+        if entry is None:
+            entry = self.entries[image_id] = {"source": fingerprint_file(Path(path)), "tiers": {}}
+        written = {}    # id(data) -> offset, for tiers sharing one payload
+        for tier, (data, width, height) in payloads.items():
+            offset = written.get(id(data))
+            if offset is None:
+                offset = written[id(data)] = self._committed + self._pending_size
+                self._pending.append(data)
+                self._pending_size += len(data)
+            entry["tiers"][tier] = [offset, len(data), width, height]
+
+    def flush(self):
+        """Append pending payloads to the blob and rewrite the index."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if self._pending:
+            with open(self.blob_path, "ab") as f:
+                for data in self._pending:
+                    f.write(data)
+            self._committed += self._pending_size
+            self._pending, self._pending_size = [], 0
+        index = {"version": PAYLOAD_STORE_VERSION, "quality": self.quality, "blob_size": self._committed,
+                 "entries": self.entries}
+        self.index_path.write_text(json.dumps(index), encoding="utf-8")
+
+    def _blob(self):
+        mm = self._mm
+        if mm is None or len(mm) < self._committed:
+            with self._mm_lock:
+                if self._mm is None or len(self._mm) < self._committed:
+                    # 旧映射不关闭：其他线程可能正持有它的切片，切片释放后随对象回收
+                    with open(self.blob_path, "rb") as f:
+                        self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                mm = self._mm
+        return mm
+
+    def fresh(self, image_id: str, path: Path) -> bool:
+        """Whether the stored entry was encoded from the file currently at path (size / mtime)."""
+        entry = self.entries.get(image_id)
+        if entry is None:
+            return False
+        try:
+            st = Path(path).stat()
+        except OSError:
+            return False
+        return entry["source"]["size"] == st.st_size and entry["source"]["mtime_ns"] == st.st_mtime_ns
+
+    def get(self, image_id: str, tier: str, path: Path = None):
+        """
+        Payload slice (memoryview of the data URL bytes) of an image at a tier, or None.
+        With path, None also when the file changed since the entry was encoded.
+        """
+        entry = self.entries.get(image_id)
+        loc = entry["tiers"].get(tier) if entry else None
+        if loc is None or loc[0] + loc[1] > self._committed:
+            self.misses += 1
+            return None
+        if path is not None and not self.fresh(image_id, path):
+            self.stale += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return memoryview(self._blob())[loc[0]:loc[0] + loc[1]]
+
+    def data_url(self, image_id: str, tier: str, path: Path = None):
+        view = self.get(image_id, tier, path)
+        if view is None:
+            return None
+        try:
+            return str(view, "ascii")
+        finally:
+            view.release()
+
+    def report(self) -> str:
+        size = self._committed / (1024 * 1024)
+        stale = f" ({self.stale} stale)" if self.stale else ""
+        return (f"payload store: {self.hits} hits, {self.misses} misses{stale}, {len(self)} images, "
+                f"{size:.1f} MB blob, quality {self.quality} ({self.dir})")
+
+
+def build_payload_store(images: dict, store: PayloadStore, tiers=DEFAULT_TIERS, workers: int = None,
+                        chunk: int = 16, flush_every: int = 1024) -> int:
+    """
+    Encode the missing tiers of {image_id: path} with a process pool; returns the number of images encoded.
+    """
+    todo = []
+    for image_id, path in images.items():
+        if Path(path).exists():
+            need = store.missing(image_id, path, tiers)
+            if need:
+                todo.append((image_id, path, need))
+    if not todo:
+        store.flush()
+        return 0
+    from concurrent.futures import ProcessPoolExecutor
+    from tqdm import tqdm
+
+    batches = [todo[i:i + chunk] for i in range(0, len(todo), chunk)]
+    workers = workers or min(8, os.cpu_count() or 1)
+    since_flush = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [[(path, need) for _, path, need in batch] for batch in batches]
+        results = pool.map(_encode_batch, jobs, [store.quality] * len(jobs))
+        for batch, encoded in zip(batches, tqdm(results, total=len(batches), desc="Encoding", unit="batch")):
+            for (image_id, path, _), payloads in zip(batch, encoded):
+                store.put(image_id, path, payloads)
+            since_flush += len(batch)
+            if since_flush >= flush_every:
+                store.flush()
+                since_flush = 0
+    store.flush()
+    return len(todo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-encode tiered base64 image payloads for VLM requests")
+    parser.add_argument("records_json", type=Path, nargs="+", help="records 文件（相对项目根目录），编码其中引用的全部图片")
+    parser.add_argument("--tiers", nargs="+", default=list(DEFAULT_TIERS),
+                        help="长边像素数或 full（原始 JPEG），如 448 768 full")
+    parser.add_argument("--quality", type=int, default=90, help="缩放档位重新编码的 JPEG 质量")
+    parser.add_argument("--workers", type=int, default=None, help="编码进程数")
+    parser.add_argument("--store_dir", type=Path, default=Path(".cache", "payloads"), help="存储目录（相对项目根目录）")
+    parser.add_argument("--rebuild", action="store_true", help="清空后重建（回收被替换条目占用的空间）")
+    args = parser.parse_args()
+    for tier in args.tiers:
+        if tier != "full" and not tier.isdigit():
+            parser.error(f"invalid tier: {tier} (expected a long-side size in pixels or 'full')")
+
+    from annotation_io import iter_records
+    from dataset import image_id_of
+    project_root = Path(__file__).parent.parent.resolve()
+    images = {}
+    for records_path in args.records_json:
+        for rec in iter_records(project_root.joinpath(records_path)):
+            image_id = image_id_of(rec)
+            images.setdefault(image_id, project_root.joinpath(image_id))
+    store = PayloadStore(project_root.joinpath(args.store_dir), args.quality)
+    if args.rebuild:
+        store.clear()
+    added = build_payload_store(images, store, args.tiers, args.workers)
+    print(f"{len(images)} images referenced, {added} encoded")
+    print(store.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# scripts/pixel_cache.py
+"""
+Cache of pre-resized uint8 image tensors for CLIP-style model inputs.
+
+The captures are 640x480 JPEGs while CLIP only looks at a 224x224 center
+crop. load_resized() asks libjpeg for a reduced-resolution decode
+(Image.draft: DCT scaling by 1/2, 1/4 or 1/8, never below the target size),
+then resizes the shortest side to `size` (bicubic) and center-crops, i.e. the
+same geometry as CLIPImageProcessor. The resulting (size, size, 3) uint8
+arrays are stored in one append-only file, read back through np.memmap:
+
+    <cache_dir>/pixels-<size>/index.json    sha1 -> row, path -> (size, mtime_ns, sha1)
+    <cache_dir>/pixels-<size>/pixels.u8     rows of size*size*3 bytes (offset = row * row_bytes)
+
+Rows are keyed by image content hash, as in EmbeddingCache, which also
+provides the locking that lets several processes (e.g. concurrent
+compute_clipscore.py shards) fill one cache. Consumers only rescale /
+normalize the cached pixels (see normalize_pixels), so later runs pay no
+JPEG decode at all.
+
+Prebuild the cache for every image referenced by a records file:
+    python scripts/pixel_cache.py data/annotation/records_fix_arm_final.json --size 224 --workers 8
+"""
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from build_manifest import json_sha1
+from embedding_cache import EmbeddingCache
+
+PIXEL_CACHE_VERSION = 1
+
+
+def load_resized(path: Path, size: int = 224) -> np.ndarray:
+    """Draft-mode decode + shortest side -> size (bicubic) + center crop, as a (size, size, 3) uint8 array."""
+    with Image.open(path) as img:
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+    w, h = img.size
+    # 与 CLIPImageProcessor 一致：短边缩放到 size，长边按比例取整
+    if w <= h:
+        new_w, new_h = size, int(size * h / w)
+    else:
+        new_w, new_h = int(size * w / h), size
+    if (new_w, new_h) != (w, h):
+        img = img.resize((new_w, new_h), Image.BICUBIC)
+    left, top = (new_w - size) // 2, (new_h - size) // 2
+    img = img.crop((left, top, left + size, top + size))
+    return np.asarray(img, dtype=np.uint8)
+
+
+def load_resized_batch(paths: list, size: int = 224) -> np.ndarray:
+    return np.stack([load_resized(p, size) for p in paths]) if paths else np.empty((0, size, size, 3), np.uint8)
+
+
+def normalize_pixels(arrays, image_processor) -> np.ndarray:
+    """Rescale + normalize cached uint8 images into model pixel_values (B, 3, H, W) float32."""
+    return image_processor(images=list(arrays), do_resize=False, do_center_crop=False,
+                           return_tensors="np")["pixel_values"]
+
+
+def processor_size(image_processor) -> int:
+    """Crop size of a CLIP image processor (the pixel cache stores crops of this size)."""
+    return image_processor.crop_size["height"]
+
+
+class PixelCache(EmbeddingCache):
+    dtype = np.uint8
+    data_name = "pixels.u8"
+    label = "pixel cache"
+
+    def __init__(self, cache_dir: Path, size: int = 224):
+        self.size = size
+        self.shape = (size, size, 3)
+        super().__init__(cache_dir, f"pixels-{size}",
+                         json_sha1(["pixels", PIXEL_CACHE_VERSION, size, "draft", "bicubic", "center_crop"]))
+
+    def offset(self, sha1: str):
+        """Byte offset of an image's row in pixels.u8, or None."""
+        row = self.keys.get(sha1)
+        return None if row is None else row * int(np.prod(self.shape))
+
+    def get(self, sha1: str):
+        row = super().get(sha1)
+        return None if row is None else row.reshape(self.shape)
+
+
+def build_pixel_cache(paths, cache: PixelCache, workers: int = None, chunk: int = 16, flush_every: int = 1024) -> int:
+    """Decode every path not yet cached with a process pool; returns the number of images added."""
+    todo = {}
+    for p in paths:
+        p = Path(p)
+        if p.exists():
+            sha1 = cache.content_hash(p)
+            if sha1 not in cache.keys:
+                todo.setdefault(sha1, p)
+    if not todo:
+        cache.flush()
+        return 0
+    from concurrent.futures import ProcessPoolExecutor
+    from tqdm import tqdm
+
+    sha1s = list(todo)
+    batches = [[todo[s] for s in sha1s[i:i + chunk]] for i in range(0, len(sha1s), chunk)]
+    workers = workers or min(8, os.cpu_count() or 1)
+    added = since_flush = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(load_resized_batch, batches, [cache.size] * len(batches))
+        for i, arrays in enumerate(tqdm(results, total=len(batches), desc="Resizing", unit="batch")):
+            for sha1, arr in zip(sha1s[i * chunk:(i + 1) * chunk], arrays):
+                cache.put(sha1, arr)
+            added += len(arrays)
+            since_flush += len(arrays)
+            if since_flush >= flush_every:
+                cache.flush()
+                since_flush = 0
+    cache.flush()
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prebuild the pre-resized image tensor cache")
+    parser.add_argument("records_json", type=Path, help="records 文件（相对项目根目录），缓存其中引用的全部图片")
+    parser.add_argument("--size", type=int, default=224, help="输出边长（CLIP ViT-B/32 为 224）")
+    parser.add_argument("--workers", type=int, default=None, help="解码进程数")
+    parser.add_argument("--cache_dir", type=Path, default=Path(".cache", "pixels"), help="缓存目录（相对项目根目录）")
+    args = parser.parse_args()
+
+    from annotation_io import iter_records
+    project_root = Path(__file__).parent.parent.resolve()
+    paths = dict.fromkeys(project_root.joinpath(rec.get("Image_Id") or rec["image_id"]).resolve()
+                          for rec in iter_records(project_root.joinpath(args.records_json)))
+    cache = PixelCache(project_root.joinpath(args.cache_dir), args.size)
+    added = build_pixel_cache(paths, cache, args.workers)
+    print(f"{len(paths)} images referenced, {added} resized and added")
+    print(cache.report())
+
+
+if __name__ == "__main__":
+    main()
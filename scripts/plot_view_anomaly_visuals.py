@@ -6,11 +6,11 @@ Generate three plots:
 2. Radar chart: Distribution of 5 Anomaly Types across 14 views
 3. Bubble+Color Chart: Total abnormal count & mobile ratio by Point and Type
 """
-import json,re
 import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
-import pandas as pd
+
+from count_cube import load_cube
 
 # Consistent view order (14 possible views)
 VIEWS_ORDER = [
@@ -34,26 +34,25 @@ ALL_VIEWS = [
     "left-horizontal view", "front-horizontal view", "right-horizontal view","left 90° horizontal view", "right 90° horizontal view",
     "left-up view", "front-up view", "right-up view"     
 ]  # for heatmaps, same grouping: down->horizontal->up
-def load_records(fix_path: Path, mob_path: Path):
-    """Load fix and mobile records and return combined lists."""
-    fix = json.loads(fix_path.read_text(encoding='utf-8'))
-    mob = json.loads(mob_path.read_text(encoding='utf-8'))
-    return fix, mob
+FIX_ARM, MOBILE_ARM = 'fix_arm', 'mobile_arm'
+ARMS = [FIX_ARM, MOBILE_ARM]
+POINTS = list(range(1, 12))
+
+
+def load_counts(fix_path: Path, mob_path: Path):
+    """Count cube (arm × type × point × view × distance × label) of both arms, cached as count_cube.npz."""
+    return load_cube(fix_path, mob_path)
 
 
-def plot_combined_radar(fix, mob, out_path: Path):
+def plot_combined_radar(cube, out_path: Path):
     """Radar: combined abnormal vs normal counts per view"""
-    records = fix + mob
     # views = sorted({r['views'] for r in records})
-    views = [v for v in VIEWS_ORDER if any(r['views']==v for r in records)]
+    present = cube.values('view', arm=ARMS)
+    views = [v for v in VIEWS_ORDER if v in present]
     # Count
-    abn = {v:0 for v in views}
-    norm = {v:0 for v in views}
-    for r in records:
-        if r.get('anomaly_Label'):
-            abn[r['views']] += 1
-        else:
-            norm[r['views']] += 1
+    total = dict(zip(views, cube.table('view', rows_order=views, arm=ARMS).tolist()))
+    abn = dict(zip(views, cube.table('view', rows_order=views, arm=ARMS, label=True).tolist()))
+    norm = {v: total[v] - abn[v] for v in views}
     # Prepare
     labels = views
     angles = np.linspace(0, 2*np.pi, len(labels), endpoint=False).tolist()
@@ -75,9 +74,8 @@ def plot_combined_radar(fix, mob, out_path: Path):
     plt.close(fig)
 
 
-def plot_anomaly_types_radar(fix, mob, out_path: Path):
+def plot_anomaly_types_radar(cube, out_path: Path):
     """Radar: 5 anomaly types across 14 views"""
-    records = fix + mob
     # Define ordered 14 views
     # views = [
     #     "top-down view","left-down view","front-down view","right-down view",
@@ -86,17 +84,13 @@ def plot_anomaly_types_radar(fix, mob, out_path: Path):
     #     "left 90° downward view","right 90° downward view",
     #     "left 90° horizontal view","right 90° horizontal view"
     # ]
-    views = [v for v in VIEWS_ORDER if any(r['views']==v for r in records)]
+    present = cube.values('view', arm=ARMS)
+    views = [v for v in VIEWS_ORDER if v in present]
     # anomaly types
-    types = sorted({r['anomaly_Type'] for r in records if r.get('anomaly_Label')})
+    types = sorted(cube.values('anomaly_type', arm=ARMS, label=True))
     # Count per view per type
-    counts = {t:[0]*len(views) for t in types}
-    for r in records:
-        if r.get('anomaly_Label'):
-            v = r['views']
-            t = r['anomaly_Type']
-            if v in views and t in counts:
-                counts[t][views.index(v)] += 1
+    type_view = cube.table('anomaly_type', 'view', types, views, arm=ARMS, label=True)
+    counts = {t: row for t, row in zip(types, type_view.tolist())}
     #compute total per view
     # total = [sum(counts[t][i] for t in types) for i in range(len(views))]
     # Radar prep
@@ -126,27 +120,15 @@ def plot_anomaly_types_radar(fix, mob, out_path: Path):
     plt.close(fig)
 
 
-def plot_bubble_color(fix, mob, out_path: Path):
+def plot_bubble_color(cube, out_path: Path):
     """Bubble+Color: total abnormal count & mobile ratio by point and anomaly type"""
     # points and types
-    import re
-    pts = list(range(1,12))
-    types = sorted({r['anomaly_Type'] for r in fix+mob if r.get('anomaly_Label')})
-    # Matrices
-    fix_counts = {t:{p:0 for p in pts} for t in types}
-    mob_counts = {t:{p:0 for p in pts} for t in types}
-    for r in fix:
-        if r.get('anomaly_Label'):
-            m = re.search(r'/point(\d+)/', r['image_id'])
-            if m: fix_counts[r['anomaly_Type']][int(m.group(1))]+=1
-    for r in mob:
-        if r.get('anomaly_Label'):
-            m = re.search(r'/point(\d+)/', r['image_id'])
-            if m: mob_counts[r['anomaly_Type']][int(m.group(1))]+=1
-    # Flatten
+    pts = POINTS
+    types = sorted(cube.values('anomaly_type', arm=ARMS, label=True))
+    # Matrices, flattened type-major
     X,Y = np.meshgrid(pts, range(len(types)))
-    fvals = np.array([fix_counts[t][p] for t in types for p in pts])
-    mvals = np.array([mob_counts[t][p] for t in types for p in pts])
+    fvals = cube.table('anomaly_type', 'point', types, pts, arm=FIX_ARM, label=True).flatten()
+    mvals = cube.table('anomaly_type', 'point', types, pts, arm=MOBILE_ARM, label=True).flatten()
     total = fvals + mvals
     ratio = np.divide(mvals, total, out=np.zeros_like(mvals,float), where=total>0)
     # Plot
@@ -164,20 +146,16 @@ def plot_bubble_color(fix, mob, out_path: Path):
     fig.savefig(out_path, dpi=300)
     plt.close(fig)
 
-def plot_heatmap_ordered(fix, mob, out_path: Path):
+def view_point_counts(cube, arms):
+    """Abnormal (view, point) counts of the given arms, views in ALL_VIEWS order."""
+    present = cube.values('view', arm=arms, label=True)
+    views = [v for v in ALL_VIEWS if v in present]
+    return views, POINTS, cube.table('view', 'point', views, POINTS, arm=arms, label=True)
+
+
+def plot_heatmap_ordered(cube, out_path: Path):
     # Heatmap: Abnormal count by view and point, with grouped order down->horizontal->up
-    records = fix + mob
-    abn = [r for r in records if r.get('anomaly_Label')]
-    views = [v for v in ALL_VIEWS if any(r['views'] == v for r in abn)]
-    pts = list(range(1, 12))
-    data = []
-    for r in abn:
-        m = re.search(r'/point(\d+)/', r['image_id'])
-        if m:
-            data.append((r['views'], int(m.group(1))))
-    df = pd.DataFrame(data, columns=['view', 'point'])
-    pivot = df.pivot_table(index='view', columns='point', aggfunc='size', fill_value=0)
-    pivot = pivot.reindex(index=views, columns=pts, fill_value=0)
+    views, pts, pivot = view_point_counts(cube, ARMS)
     fig, ax = plt.subplots(figsize=(10, 6))
     im = ax.imshow(pivot, aspect='auto', cmap='Blues')
     ax.set_xticks(np.arange(len(pts)))
@@ -192,17 +170,10 @@ def plot_heatmap_ordered(fix, mob, out_path: Path):
     fig.tight_layout()
     fig.savefig(out_path, dpi=300)
     plt.close(fig)
-def plot_heatmap_split(fix, mob, out_path_fix: Path, out_path_mob: Path):
+def plot_heatmap_split(cube, out_path_fix: Path, out_path_mob: Path):
     """Generate two heatmaps: one for Fix Arm, one for Mobile Arm"""
-    for records, label, path in [(fix, 'Fix Arm', out_path_fix), (mob, 'Mobile Arm', out_path_mob)]:
-        abn = [r for r in records if r.get('anomaly_Label')]
-        views = [v for v in ALL_VIEWS if any(r['views'] == v for r in abn)]
-        pts = list(range(1, 12))
-        data = [(r['views'], int(re.search(r'/point(\d+)/',r['image_id']).group(1)))
-                for r in abn if re.search(r'/point(\d+)/',r['image_id'])]
-        df = pd.DataFrame(data, columns=['view','point'])
-        pivot = df.pivot_table(index='view', columns='point', aggfunc='size', fill_value=0)
-        pivot = pivot.reindex(index=views, columns=pts, fill_value=0)
+    for arm, label, path in [(FIX_ARM, 'Fix Arm', out_path_fix), (MOBILE_ARM, 'Mobile Arm', out_path_mob)]:
+        views, pts, pivot = view_point_counts(cube, arm)
         fig, ax = plt.subplots(figsize=(10, 6))
         im = ax.imshow(pivot, aspect='auto', cmap='Blues')
         ax.set_xticks(np.arange(len(pts)))
@@ -218,17 +189,18 @@ def plot_heatmap_split(fix, mob, out_path_fix: Path, out_path_mob: Path):
         fig.savefig(path, dpi=300)
         plt.close(fig)
 
-def plot_anomaly_types_radar_split(fix, mob, out_fix: Path, out_mob: Path):
+def plot_anomaly_types_radar_split(cube, out_fix: Path, out_mob: Path):
     """Generate two radar charts of anomaly types per view: one for Fix Arm, one for Mobile Arm"""
     # Prepare views and types
-    records_fix = [r for r in fix if r.get('anomaly_Label')]
-    records_mob = [r for r in mob if r.get('anomaly_Label')]
-    views = [v for v in VIEWS_ORDER if any(r['views']==v for r in records_fix+records_mob)]
-    types = sorted({r['anomaly_Type'] for r in records_fix+records_mob})
+    present = cube.values('view', arm=ARMS, label=True)
+    views = [v for v in VIEWS_ORDER if v in present]
+    types = sorted(cube.values('anomaly_type', arm=ARMS, label=True))
     angles = np.linspace(0, 2*np.pi, len(views), endpoint=False).tolist() + [0]
      # counts per type per view
-    cnt_fix={t:[sum(1 for r in records_fix if r['views']==v and r['anomaly_Type']==t) for v in views] for t in types}
-    cnt_mob={t:[sum(1 for r in records_mob if r['views']==v and r['anomaly_Type']==t) for v in views] for t in types}
+    tv_fix = cube.table('anomaly_type', 'view', types, views, arm=FIX_ARM, label=True).tolist()
+    tv_mob = cube.table('anomaly_type', 'view', types, views, arm=MOBILE_ARM, label=True).tolist()
+    cnt_fix = dict(zip(types, tv_fix))
+    cnt_mob = dict(zip(types, tv_mob))
     # plot fix
     fig,ax=plt.subplots(subplot_kw=dict(polar=True),figsize=(8,6))
     cmap=plt.get_cmap('tab10')
@@ -258,21 +230,21 @@ def main():
     plot = root.joinpath('data','plot')
     plot.mkdir(parents=True, exist_ok=True)
 
-    fix,mob = load_records(ann.joinpath('records_fix_arm.json'), ann.joinpath('records_mobile_arm.json'))
+    cube = load_counts(ann.joinpath('records_fix_arm.json'), ann.joinpath('records_mobile_arm.json'))
 
-    plot_combined_radar(fix, mob, plot.joinpath('combined_abn_norm_radar.png'))
-    plot_anomaly_types_radar(fix, mob, plot.joinpath('anomaly_types_views_radar.png'))
-    plot_bubble_color(fix, mob, plot.joinpath('bubble_color_point_type.png'))
-    plot_heatmap_ordered(fix, mob, plot.joinpath('heatmap_abn_view_point_ordered.png'))
+    plot_combined_radar(cube, plot.joinpath('combined_abn_norm_radar.png'))
+    plot_anomaly_types_radar(cube, plot.joinpath('anomaly_types_views_radar.png'))
+    plot_bubble_color(cube, plot.joinpath('bubble_color_point_type.png'))
+    plot_heatmap_ordered(cube, plot.joinpath('heatmap_abn_view_point_ordered.png'))
 # split heatmaps for Fix and Mobile
     plot_heatmap_split(
-        fix, mob,
+        cube,
         plot.joinpath('heatmap_fix_abn_view_point.png'),
         plot.joinpath('heatmap_mob_abn_view_point.png')
     )
     # after plot_heatmap_split(...)
     plot_anomaly_types_radar_split(
-        fix, mob,
+        cube,
         plot.joinpath('anomaly_types_views_radar_fix.png'),
         plot.joinpath('anomaly_types_views_radar_mob.png')
     )
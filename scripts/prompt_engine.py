@@ -0,0 +1,190 @@
+# scripts/prompt_engine.py
+"""
+Compiled rendering of the VLM detection prompt templates
+(vad/app/prompt/detectionpromptv2.py).
+
+CompiledTemplate splits a template once into
+    prefix    static text before the first placeholder (shared by every record)
+    variable  the span from the first to the last placeholder, filled per record
+    suffix    static text after the last placeholder (the "Additional Context" block)
+and Prompt keeps the three parts, so a batch of prompts shares one prefix /
+suffix string instead of holding thousands of copies. Prompt.prefix_bytes /
+Prompt.suffix_bytes are the UTF-8 byte lengths of the shared prefix / suffix.
+
+Prefix caching only helps with the shared prefix, and with the default layout
+that is just the ~150 bytes before the first placeholder: the large "Additional
+Context" block (~1.3k bytes) is in the shared *suffix*, after the per-record
+step details, so the default layout gives no meaningful prefix reuse.
+context_first=True moves the block in front of the step details, so the shared
+prefix covers it (~1.4k bytes). This changes the prompt the model sees (compare
+detection results before switching); the default layout renders exactly what
+TEMPLATES[name].format(...) gives. CompiledTemplate.context_bytes is the size
+of the block and PromptRenderer.report() says where it ended up.
+
+PromptRenderer renders whole annotation files, memoizing the variable
+section per metastep: records of the same step / phase with the same
+fields reuse the rendered section.
+
+    renderer = PromptRenderer("level2")
+    prompts = renderer.render_batch(iter_records(path))
+    prompts[0].text, prompts[0].prefix_bytes
+"""
+import functools
+import re
+import string
+import sys
+from pathlib import Path
+from typing import NamedTuple
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from vad.app.prompt import detectionpromptv2 as prompts  # noqa: E402
+
+SYSTEM_PROMPT = prompts.SYSTEM_PROMPT
+TEMPLATES = {
+    "v1": prompts.USER_PROMPT_TEMPLATE,
+    "level0": prompts.LEVEL0_PROMPT_TEMPLATE,
+    "level1": prompts.LEVEL1_PROMPT_TEMPLATE,
+    "level2": prompts.LEVEL2_PROMPT_TEMPLATE,
+    "normal": prompts.NORMAL_PROMPT_TEMPLATE,
+    "abnormal": prompts.ABNORMAL_PROMPT_TEMPLATE,
+}
+
+# placeholder -> record keys tried in order
+PROMPT_FIELDS = {
+    "operator": ("Operator", "operator"),
+    "obj": ("Obj", "obj"),
+    "start_position": ("Start_Position", "start_position"),
+    "dest_position": ("Dest_Position", "dest_position"),
+    "subtask": ("Stage_Description", "subtask"),
+    "inspection_instructions": ("Detection_Content", "detection_Content"),
+}
+
+# 各模板共用的流程说明段落（含其后的 "--if you don't know ..." 提示行）
+CONTEXT_REGEX = re.compile(r"Additional Context:\n.*?- The process then ends\.\n(--if[^\n]*\n)?", re.S)
+
+
+def prompt_fields(rec: dict) -> dict:
+    fields = {}
+    for name, keys in PROMPT_FIELDS.items():
+        fields[name] = next((rec[k] for k in keys if rec.get(k) is not None), "")
+    return fields
+
+
+class Prompt(NamedTuple):
+    prefix: str     # shared static text (same object for every prompt of a template)
+    variable: str   # per-record section
+    suffix: str     # shared static text
+
+    @property
+    def text(self) -> str:
+        return self.prefix + self.variable + self.suffix
+
+    @property
+    def prefix_bytes(self) -> int:
+        """UTF-8 byte offset where the record-specific part starts."""
+        return _utf8_len(self.prefix)
+
+    @property
+    def suffix_bytes(self) -> int:
+        """UTF-8 length of the shared static text after the record-specific part."""
+        return _utf8_len(self.suffix)
+
+
+@functools.lru_cache(maxsize=64)
+def _utf8_len(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+def _escape(literal: str) -> str:
+    return literal.replace("{", "{{").replace("}", "}}")
+
+
+class CompiledTemplate:
+    def __init__(self, template: str, name: str = "", context_first: bool = False):
+        self.name = name
+        self.context_first = context_first
+        context = ""
+        if context_first:
+            m = CONTEXT_REGEX.search(template)
+            if m is None:
+                raise ValueError(f"template {name!r} has no 'Additional Context' block to move")
+            context = m.group(0)
+            template = template[:m.start()] + template[m.end():]
+
+        segments = list(string.Formatter().parse(template))
+        fields = [i for i, (_, field, _, _) in enumerate(segments) if field is not None]
+        if not fields:
+            self.prefix, self.suffix, self._body, self.fields = template, "", "", ()
+        else:
+            first, last = fields[0], fields[-1]
+            self.prefix = segments[first][0]
+            self.suffix = "".join(lit for lit, _, _, _ in segments[last + 1:])
+            # first..last 之间重新拼成格式串（字面量中的花括号需转义）
+            body = []
+            for i in range(first, last + 1):
+                literal, field, spec, conv = segments[i]
+                if i > first:
+                    body.append(_escape(literal))
+                body.append("{" + field + (f"!{conv}" if conv else "") + (f":{spec}" if spec else "") + "}")
+            self._body = "".join(body)
+            self.fields = tuple(dict.fromkeys(segments[i][1] for i in fields))
+        if context:
+            self.prefix = context + "\n" + self.prefix
+        else:
+            m = CONTEXT_REGEX.search(template)
+            context = m.group(0) if m else ""
+        self.prefix_bytes = _utf8_len(self.prefix)
+        self.suffix_bytes = _utf8_len(self.suffix)
+        self.context_bytes = _utf8_len(context)     # "Additional Context" block, 0 if the template has none
+
+    def render_variable(self, fields: dict) -> str:
+        return self._body.format(**fields)
+
+    def render(self, fields: dict) -> Prompt:
+        return Prompt(self.prefix, self.render_variable(fields), self.suffix)
+
+
+class PromptRenderer:
+    """Render one template for many records, memoizing the variable section per metastep."""
+
+    def __init__(self, template: str = "level2", context_first: bool = False):
+        if template not in TEMPLATES:
+            raise KeyError(f"Unknown template: {template} (expected one of {sorted(TEMPLATES)})")
+        self.template = template
+        self.compiled = CompiledTemplate(TEMPLATES[template], template, context_first)
+        self._memo = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _step_key(self, rec: dict) -> tuple:
+        """(memo key, template fields) of a record."""
+        # 同一 metastep（step + phase）的记录字段相同；字段值也并入键，避免手改过的记录拿到错误内容
+        fields = prompt_fields(rec)
+        return (rec.get("step"), rec.get("phase")) + tuple(fields[f] for f in self.compiled.fields), fields
+
+    def render(self, rec: dict) -> Prompt:
+        key, fields = self._step_key(rec)
+        variable = self._memo.get(key)
+        if variable is None:
+            variable = self._memo[key] = self.compiled.render_variable(fields)
+            self.misses += 1
+        else:
+            self.hits += 1
+        return Prompt(self.compiled.prefix, variable, self.compiled.suffix)
+
+    def render_batch(self, records) -> list:
+        return [self.render(rec) for rec in records]
+
+    def report(self) -> str:
+        c = self.compiled
+        line = (f"template {self.template}: {len(self._memo)} distinct step sections, "
+                f"{self.hits} hits / {self.misses} misses, shared prefix {c.prefix_bytes} bytes / "
+                f"suffix {c.suffix_bytes} bytes")
+        if c.context_bytes and not c.context_first:
+            # 默认布局下流程说明段落在后缀中，前缀缓存几乎用不上
+            line += (f" (the {c.context_bytes}-byte context block is in the suffix, "
+                     f"no useful prefix reuse; see --context_first)")
+        return line
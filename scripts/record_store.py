@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# scripts/record_store.py
+"""
+Columnar, memory-mappable store for annotation records.
+
+A store is a directory (by convention <name>.cols/) holding:
+- meta.json             column order, row count and the vocabulary of every
+                        dictionary-encoded string column
+- <column>.npy          int32 codes into that column's vocabulary (-1 = null)
+- Anomaly_Label.npy     bool
+- grounding_bbox.npy    int32 (M, 4), all boxes of all records, contiguous
+- grounding_offsets.npy int64 (N + 1), boxes of record i are [off[i], off[i+1])
+- grounding_text_span.npy / grounding_category.npy   int32 codes per box
+
+Long strings repeated from metasteps_caption.json (Stage_Description,
+Detection_Content, Caption, ...) are stored once per distinct value.
+Converters go both ways, so the JSON schema of records_*_final.json is
+reproduced exactly by RecordStore.to_records().
+
+Usage:
+    python scripts/record_store.py data/annotation/annotation.json            # -> annotation.cols/
+    python scripts/record_store.py data/annotation/annotation.cols --to-json out.json
+"""
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+STORE_VERSION = 1
+BOOL_COLUMNS = {"Anomaly_Label"}
+GROUNDING_COLUMN = "Grounding"
+
+
+def _encode(values, vocab: dict) -> np.ndarray:
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, v in enumerate(values):
+        if v is None:
+            codes[i] = -1
+        else:
+            codes[i] = vocab.setdefault(v, len(vocab))
+    return codes
+
+
+def write_store(records, path: Path) -> Path:
+    """Convert an iterable of records (JSON schema) into a columnar store at path."""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    records = list(records)
+    columns = list(records[0].keys()) if records else []
+
+    vocabs = {}
+    for col in columns:
+        values = [rec.get(col) for rec in records]
+        if col in BOOL_COLUMNS:
+            np.save(path.joinpath(f"{col}.npy"), np.array([bool(v) for v in values], dtype=bool))
+        elif col == GROUNDING_COLUMN:
+            offsets = np.zeros(len(records) + 1, dtype=np.int64)
+            bboxes, spans, cats = [], [], []
+            for i, grounding in enumerate(values):
+                for g in grounding or []:
+                    bboxes.append(g["bbox"])
+                    spans.append(g.get("text_span"))
+                    cats.append(g.get("category"))
+                offsets[i + 1] = len(bboxes)
+            span_vocab, cat_vocab = {}, {}
+            np.save(path.joinpath("grounding_bbox.npy"), np.array(bboxes, dtype=np.int32).reshape(-1, 4))
+            np.save(path.joinpath("grounding_offsets.npy"), offsets)
+            np.save(path.joinpath("grounding_text_span.npy"), _encode(spans, span_vocab))
+            np.save(path.joinpath("grounding_category.npy"), _encode(cats, cat_vocab))
+            vocabs["grounding_text_span"] = list(span_vocab)
+            vocabs["grounding_category"] = list(cat_vocab)
+        else:
+            vocab = {}
+            np.save(path.joinpath(f"{col}.npy"), _encode(values, vocab))
+            vocabs[col] = list(vocab)
+
+    meta = {"version": STORE_VERSION, "rows": len(records), "columns": columns, "vocab": vocabs}
+    path.joinpath("meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+class RecordStore:
+    """Read-only view over a columnar store; arrays are memory-mapped by default."""
+
+    def __init__(self, path: Path, mmap: bool = True):
+        self.path = Path(path)
+        meta = json.loads(self.path.joinpath("meta.json").read_text(encoding="utf-8"))
+        if meta.get("version") != STORE_VERSION:
+            raise ValueError(f"不支持的 record store 版本：{self.path}")
+        self.rows = meta["rows"]
+        self.columns = meta["columns"]
+        self.vocab = meta["vocab"]
+        self._lookup = {}
+        mode = "r" if mmap else None
+        self.arrays = {}
+        for col in self.columns:
+            if col == GROUNDING_COLUMN:
+                for name in ("bbox", "offsets", "text_span", "category"):
+                    self.arrays[f"grounding_{name}"] = np.load(
+                        self.path.joinpath(f"grounding_{name}.npy"), mmap_mode=mode)
+            else:
+                self.arrays[col] = np.load(self.path.joinpath(f"{col}.npy"), mmap_mode=mode)
+
+    def __len__(self):
+        return self.rows
+
+    def codes(self, col: str) -> np.ndarray:
+        """Raw int32 codes (or bool values) of a column."""
+        return self.arrays[col]
+
+    def code_of(self, col: str, value) -> int:
+        """Code of value in a string column, -1 for None, -2 if absent."""
+        if value is None:
+            return -1
+        if col not in self._lookup:
+            self._lookup[col] = {v: i for i, v in enumerate(self.vocab[col])}
+        return self._lookup[col].get(value, -2)
+
+    def mask(self, col: str, values) -> np.ndarray:
+        """Boolean row mask of records whose col is one of values."""
+        codes = [self.code_of(col, v) for v in values]
+        return np.isin(self.arrays[col], codes)
+
+    def column(self, col: str) -> list:
+        """Decoded values of a column."""
+        arr = self.arrays[col]
+        if col in BOOL_COLUMNS:
+            return arr.tolist()
+        vocab = self.vocab[col]
+        return [vocab[c] if c >= 0 else None for c in arr.tolist()]
+
+    def grounding(self, i: int) -> list:
+        off = self.arrays["grounding_offsets"]
+        lo, hi = int(off[i]), int(off[i + 1])
+        spans, cats = self.vocab["grounding_text_span"], self.vocab["grounding_category"]
+        out = []
+        for bbox, s, c in zip(self.arrays["grounding_bbox"][lo:hi].tolist(),
+                              self.arrays["grounding_text_span"][lo:hi].tolist(),
+                              self.arrays["grounding_category"][lo:hi].tolist()):
+            out.append({"text_span": spans[s] if s >= 0 else None,
+                        "bbox": bbox,
+                        "category": cats[c] if c >= 0 else None})
+        return out
+
+    def record(self, i: int) -> dict:
+        rec = {}
+        for col in self.columns:
+            if col == GROUNDING_COLUMN:
+                rec[col] = self.grounding(i)
+            elif col in BOOL_COLUMNS:
+                rec[col] = bool(self.arrays[col][i])
+            else:
+                c = int(self.arrays[col][i])
+                rec[col] = self.vocab[col][c] if c >= 0 else None
+        return rec
+
+    def __getitem__(self, i: int) -> dict:
+        return self.record(i)
+
+    def iter_records(self, mask: np.ndarray = None):
+        rows = range(self.rows) if mask is None else np.flatnonzero(mask).tolist()
+        for i in rows:
+            yield self.record(i)
+
+    def to_records(self) -> list:
+        return list(self.iter_records())
+
+    def to_dataframe(self, columns=None):
+        """pandas DataFrame with categorical string columns (Grounding excluded)."""
+        import pandas as pd
+        data = {}
+        for col in columns or self.columns:
+            if col == GROUNDING_COLUMN:
+                continue
+            arr = np.asarray(self.arrays[col])
+            if col in BOOL_COLUMNS:
+                data[col] = arr
+            else:
+                data[col] = pd.Categorical.from_codes(arr, categories=pd.Index(self.vocab[col], dtype=object))
+        return pd.DataFrame(data)
+
+
+def load_store(path: Path, mmap: bool = True) -> RecordStore:
+    return RecordStore(path, mmap=mmap)
+
+
+def is_store(path: Path) -> bool:
+    return Path(path).joinpath("meta.json").is_file()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert annotation records between JSON and the columnar store")
+    parser.add_argument("src", type=Path, help="records .json/.jsonl file, or a .cols store directory")
+    parser.add_argument("dst", type=Path, nargs="?", default=None,
+                        help="output store directory (default: <src>.cols)")
+    parser.add_argument("--to-json", type=Path, default=None, help="convert a store back to a JSON array file")
+    args = parser.parse_args()
+
+    if args.to_json:
+        records = load_store(args.src).to_records()
+        args.to_json.write_text(json.dumps(records, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Wrote {len(records)} records to {args.to_json}")
+        return
+
+    from annotation_io import iter_records
+    dst = args.dst or args.src.with_suffix(".cols")
+    write_store(iter_records(args.src), dst)
+    print(f"Wrote {len(load_store(dst))} records to {dst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# scripts/render_charts.py
+"""
+Parallel, cache-aware driver for the dataset charts of viz_all_six_charts.py
+and plot_view_anomaly_visuals.py.
+
+Every chart is rendered by a process pool on the Agg backend from the shared
+count cube (count_cube.py). A chart's key is the sha1 of
+- the cube marginal it reads (counts + labels of its axes only),
+- its parameters and output file names,
+- the source of the module that draws it,
+and is kept in <out_dir>/render_manifest.json. Charts whose key is unchanged
+and whose PNGs exist are skipped; the rest are redrawn. A summary of rendered
+/ skipped / failed charts with per-chart wall time is printed at the end.
+
+Usage:
+    python scripts/render_charts.py --workers 4
+    python scripts/render_charts.py --force --only dual_heatmap radar_chart
+"""
+import os
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import argparse
+import hashlib
+import json
+import time
+import traceback
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+from build_manifest import json_sha1
+from count_cube import load_cube
+from lazy_import import lazy_import
+
+# matplotlib 及两个绘图脚本在真正生成图表任务时才加载（--help 不付出 pyplot 的导入开销）
+matplotlib = lazy_import("matplotlib")
+pv = lazy_import("plot_view_anomaly_visuals")
+six = lazy_import("viz_all_six_charts")
+
+RENDER_MANIFEST = "render_manifest.json"
+
+
+class Chart(NamedTuple):
+    name: str
+    func: Callable          # module-level chart function, called as func(cube, *params, *output paths)
+    axes: tuple             # count cube axes the chart reads
+    params: tuple = ()      # extra positional arguments before the output paths
+    outputs: tuple = ()     # output file names relative to the plot directory
+    cube: str = "raw"       # "raw" or "normal" (anomaly_type None relabelled to 'normal')
+
+
+def chart_jobs(cubes: dict) -> list:
+    """All charts of both plotting scripts, with the parameters their main() uses."""
+    types = sorted(cubes["normal"].values("anomaly_type", arm=six.FIX_ARM))
+    points = list(range(1, 12))
+    type_point = ("arm", "anomaly_type", "point")
+    return [
+        Chart("dual_heatmap", six.plot_dual_heatmap, type_point, (types, points), ("dual_heatmap.png",), "normal"),
+        Chart("bubble_fix_mobile", six.plot_bubble_fix_mobile, type_point, (types, points),
+              ("bubble_fix_mobile.png",), "normal"),
+        Chart("stacked_area", six.plot_stacked_area, type_point, (types, points), ("stacked_area.png",), "normal"),
+        Chart("radar_chart", six.plot_radar, ("arm", "anomaly_type"), (types,), ("radar_chart.png",), "normal"),
+        Chart("bubble_color", six.plot_bubble_color, type_point, (types, points), ("bubble_color.png",), "normal"),
+        Chart("treemap", six.plot_treemap, ("arm", "anomaly_type"), (types,), ("treemap.png",), "normal"),
+        Chart("combined_abn_norm_radar", pv.plot_combined_radar, ("arm", "view", "label"), (),
+              ("combined_abn_norm_radar.png",)),
+        Chart("anomaly_types_views_radar", pv.plot_anomaly_types_radar, ("arm", "anomaly_type", "view", "label"), (),
+              ("anomaly_types_views_radar.png",)),
+        Chart("bubble_color_point_type", pv.plot_bubble_color, ("arm", "anomaly_type", "point", "label"), (),
+              ("bubble_color_point_type.png",)),
+        Chart("heatmap_abn_view_point_ordered", pv.plot_heatmap_ordered, ("arm", "view", "point", "label"), (),
+              ("heatmap_abn_view_point_ordered.png",)),
+        Chart("heatmap_split", pv.plot_heatmap_split, ("arm", "view", "point", "label"), (),
+              ("heatmap_fix_abn_view_point.png", "heatmap_mob_abn_view_point.png")),
+        Chart("anomaly_types_views_radar_split", pv.plot_anomaly_types_radar_split,
+              ("arm", "anomaly_type", "view", "label"), (),
+              ("anomaly_types_views_radar_fix.png", "anomaly_types_views_radar_mob.png")),
+    ]
+
+
+_source_hashes = {}
+
+
+def _module_sha1(func) -> str:
+    path = Path(func.__code__.co_filename)
+    if path not in _source_hashes:
+        _source_hashes[path] = hashlib.sha1(path.read_bytes()).hexdigest()
+    return _source_hashes[path]
+
+
+def chart_key(chart: Chart, cubes: dict) -> str:
+    counts, labels = cubes[chart.cube].marginal(*chart.axes)
+    return json_sha1([
+        f"{chart.func.__module__}.{chart.func.__name__}", _module_sha1(chart.func),
+        hashlib.sha1(counts.astype("<i8").tobytes()).hexdigest(), list(counts.shape), labels,
+        list(chart.params), list(chart.outputs), matplotlib.__version__,
+    ])
+
+
+_worker_cubes = None
+
+
+def _init_worker(cubes: dict):
+    global _worker_cubes
+    _worker_cubes = cubes
+
+
+def _render(chart: Chart, out_dir: Path, cubes: dict = None) -> tuple:
+    """Draw one chart; returns (name, seconds, error or None)."""
+    import matplotlib.pyplot as plt
+    cubes = cubes or _worker_cubes
+    t0 = time.perf_counter()
+    try:
+        chart.func(cubes[chart.cube], *chart.params, *[out_dir.joinpath(o) for o in chart.outputs])
+        error = None
+    except Exception:
+        error = traceback.format_exc(limit=3)
+    finally:
+        plt.close("all")
+    return chart.name, time.perf_counter() - t0, error
+
+
+def render_charts(charts: list, cubes: dict, out_dir: Path, workers: int = None, force: bool = False) -> list:
+    """
+    Render the charts whose key changed (or all with force) in a process pool.
+    Returns summary rows {"chart", "status", "seconds"}.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir.joinpath(RENDER_MANIFEST)
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8")) if manifest_path.exists() else {}
+
+    keys = {c.name: chart_key(c, cubes) for c in charts}
+    todo, summary = [], {}
+    for c in charts:
+        fresh = manifest.get(c.name) == keys[c.name] and all(out_dir.joinpath(o).exists() for o in c.outputs)
+        if fresh and not force:
+            summary[c.name] = {"chart": c.name, "status": "skipped", "seconds": 0.0}
+        else:
+            todo.append(c)
+
+    by_name = {c.name: c for c in charts}
+
+    def record(name, seconds, error):
+        chart = by_name[name]
+        if error is not None:
+            status = "failed"
+            print(f"[WARN] {name} failed:\n{error}")
+            manifest.pop(name, None)
+        elif all(out_dir.joinpath(o).exists() for o in chart.outputs):
+            status = "rendered"
+            manifest[name] = keys[name]
+        else:
+            status = "no output"   # e.g. treemap without squarify
+            manifest.pop(name, None)
+        summary[name] = {"chart": name, "status": status, "seconds": seconds}
+
+    workers = workers if workers is not None else min(len(todo), os.cpu_count() or 1)
+    if todo and workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cubes,)) as pool:
+            for name, seconds, error in pool.map(_render, todo, [out_dir] * len(todo)):
+                record(name, seconds, error)
+    else:
+        for c in todo:
+            record(*_render(c, out_dir, cubes))
+
+    manifest_path.write_text(json.dumps(manifest, indent=1), encoding="utf-8")
+    return [summary[c.name] for c in charts]
+
+
+def print_summary(rows: list, wall: float):
+    width = max(len(r["chart"]) for r in rows) if rows else 10
+    for r in rows:
+        print(f"{r['chart']:<{width}}  {r['status']:<9}  {r['seconds']:6.2f}s")
+    counts = {}
+    for r in rows:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    print(", ".join(f"{n} {s}" for s, n in counts.items()) + f" in {wall:.2f}s wall time")
+
+
+def main():
+    root = Path(__file__).parent.parent
+    ann = root.joinpath("data", "annotation")
+    parser = argparse.ArgumentParser(description="Render all dataset charts in parallel, skipping unchanged ones")
+    parser.add_argument("--fix", type=Path, default=ann.joinpath("records_fix_arm.json"))
+    parser.add_argument("--mobile", type=Path, default=ann.joinpath("records_mobile_arm.json"))
+    parser.add_argument("--out_dir", type=Path, default=root.joinpath("data", "plot"))
+    parser.add_argument("--workers", type=int, default=None, help="渲染进程数（默认 CPU 数，1 为单进程）")
+    parser.add_argument("--force", action="store_true", help="忽略缓存，重绘全部图表")
+    parser.add_argument("--only", nargs="+", default=None, help="只处理这些图表（名称见 summary）")
+    args = parser.parse_args()
+
+    matplotlib.use("Agg")
+    t0 = time.perf_counter()
+    cube = load_cube(args.fix, args.mobile)
+    cubes = {"raw": cube, "normal": cube.relabel("anomaly_type", {None: "normal"})}
+    charts = chart_jobs(cubes)
+    if args.only:
+        unknown = set(args.only) - {c.name for c in charts}
+        if unknown:
+            parser.error(f"unknown chart(s): {', '.join(sorted(unknown))}")
+        charts = [c for c in charts if c.name in args.only]
+    rows = render_charts(charts, cubes, args.out_dir, args.workers, args.force)
+    print_summary(rows, time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    main()
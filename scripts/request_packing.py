@@ -0,0 +1,77 @@
+# scripts/request_packing.py
+"""
+Multi-image request packing for VLM detection runs.
+
+Records of the same step / phase / Detection_Location differ only in Views
+and Distance, so their rendered prompts are identical. pack_items() groups
+such records (same group key and same rendered prompt) into packs of up to
+`pack_size` images. Each pack is sent as one request: the shared prompt
+followed by packed_instruction(n), which asks for one answer line per
+image ("Image k: 1.Yes, ..." / "Image k: 2.No, ..."), and then the n
+images in order. split_packed_answer() maps the reply back to the images.
+
+Records are streamed: a group is emitted as soon as it has pack_size
+records. At most `max_open` partial packs are buffered; when a record opens
+one more, the least recently extended partial pack is emitted as it is, so
+memory stays within max_open * pack_size records whatever the number of
+groups. Records of one group are adjacent in the annotation files (at most
+one group is open at a time there), so this costs no packing; with
+interleaved input some packs are emitted before they are full.
+"""
+import re
+from collections import OrderedDict
+
+PACKED_INSTRUCTION = """
+You are given {n} images (Image 1 to Image {n}) of this inspection point, taken from different views and distances.
+Judge each image separately and answer in the format required above, one line per image, starting with its number:
+{lines}
+"""
+
+IMAGE_LINE_REGEX = re.compile(r"^\W*Image\s*#?(\d+)\**\s*[:：.)\]-]", re.I | re.M)
+
+
+def packed_instruction(n: int) -> str:
+    return PACKED_INSTRUCTION.format(n=n, lines="\n".join(f"Image {k}: ..." for k in range(1, n + 1)))
+
+
+def pack_key(item) -> tuple:
+    """Items with the same key share one rendered prompt and may go into one request."""
+    # prefix / suffix are fixed per template, so the variable section decides whether prompts are equal
+    return item.group + (item.template, item.prompt.variable)
+
+
+def pack_items(items, pack_size: int, max_open: int = 4):
+    """
+    Yield lists of up to pack_size items with the same pack_key, in order of completion;
+    at most max_open partial packs are held back at any time.
+    """
+    if pack_size <= 1:
+        for it in items:
+            yield [it]
+        return
+    open_packs = OrderedDict()      # key -> partial pack, least recently extended first
+    for it in items:
+        key = pack_key(it)
+        pack = open_packs.get(key)
+        if pack is None:
+            if len(open_packs) >= max(1, max_open):
+                yield open_packs.popitem(last=False)[1]
+            pack = open_packs[key] = []
+        else:
+            open_packs.move_to_end(key)
+        pack.append(it)
+        if len(pack) >= pack_size:
+            del open_packs[key]
+            yield pack
+    yield from open_packs.values()
+
+
+def split_packed_answer(text: str, n: int) -> list:
+    """Per-image answer text (without the "Image k:" label) for images 1..n; None where an image has no line."""
+    answers = [None] * n
+    matches = list(IMAGE_LINE_REGEX.finditer(text or ""))
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        k = int(m.group(1))
+        if 1 <= k <= n and answers[k - 1] is None:
+            answers[k - 1] = text[m.end():nxt.start() if nxt else len(text)].strip()
+    return answers
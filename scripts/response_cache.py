@@ -0,0 +1,178 @@
+# scripts/response_cache.py
+"""
+Persistent cache of VLM responses, in one SQLite file.
+
+    <cache_dir>/responses.sqlite
+        responses   key -> model, prompt_sha1, image_sha1s, params, response (JSON), size, created, last_used, hits
+        images      path -> (size, mtime_ns, sha1), so unchanged images are not re-hashed
+
+A response is keyed by request_key(model, prompt_sha1, image_sha1s, params):
+the model id, the sha1 of the system + rendered user prompt, the content
+sha1 of every attached image and the decoding parameters (max_tokens,
+temperature, ...). Changing one template or one step's fields changes only
+the prompt hashes of the affected records, so an ablation rerun only sends
+the requests whose inputs changed.
+
+The database runs in WAL mode with a busy timeout, so several eval
+processes can share one cache; every put commits its own short
+transaction. One connection is shared by the event loop and the worker
+threads that hash images (image_hash runs in asyncio.to_thread), guarded by
+a lock. With max_entries / max_mb set, the least recently used
+responses are evicted (checked every `evict_every` puts and on close).
+Hit / miss / write / eviction counts of the session are in .stats.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from build_manifest import file_sha1, json_sha1
+
+CACHE_NAME = "responses.sqlite"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_sha1 TEXT NOT NULL,
+    image_sha1s TEXT NOT NULL,
+    params TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL
+);
+"""
+
+
+def prompt_sha1(system: str, prompt: str) -> str:
+    h = hashlib.sha1(system.encode("utf-8"))
+    h.update(b"\0")
+    h.update(prompt.encode("utf-8"))
+    return h.hexdigest()
+
+
+def request_key(model: str, prompt_hash: str, image_sha1s: list, params: dict) -> str:
+    return json_sha1([model, prompt_hash, list(image_sha1s), params])
+
+
+class ResponseCache:
+    def __init__(self, cache_dir: Path, max_entries: int = None, max_mb: float = None,
+                 evict_every: int = 256, timeout: float = 30.0):
+        self.path = Path(cache_dir).joinpath(CACHE_NAME)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        self.evict_every = evict_every
+        self.db = sqlite3.connect(str(self.path), timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0}
+        self._image_hashes = {}
+        self._since_evict = 0
+        self._entries = None    # entry count at close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.db is not None:
+            self.evict()
+            self._entries = len(self)
+            self.db.close()
+            self.db = None
+
+    def image_hash(self, path: Path) -> str:
+        """Content sha1 of an image, re-read only when its size / mtime changed."""
+        path = str(path)
+        st = Path(path).stat()
+        known = self._image_hashes.get(path)
+        if known is None:
+            with self._lock:
+                known = self.db.execute("SELECT size, mtime_ns, sha1 FROM images WHERE path = ?", (path,)).fetchone()
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            self._image_hashes[path] = known
+            return known[2]
+        sha1 = file_sha1(Path(path))
+        known = self._image_hashes[path] = (st.st_size, st.st_mtime_ns, sha1)
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)", (path, *known))
+        return sha1
+
+    def get(self, key: str):
+        """Cached response dict, or None (counted as hit / miss)."""
+        with self._lock:
+            row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self.db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, response: dict, model: str, prompt_hash: str, image_sha1s: list, params: dict):
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, prompt_sha1, image_sha1s, params, response, size,"
+                " created, last_used, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, model, prompt_hash, json.dumps(list(image_sha1s)), json.dumps(params, sort_keys=True),
+                 data, len(data.encode("utf-8")), now, now))
+        self.stats["writes"] += 1
+        self._since_evict += 1
+        if self._since_evict >= self.evict_every:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop least recently used responses until the entry / size bounds hold; returns the number dropped."""
+        self._since_evict = 0
+        if not self.max_entries and not self.max_bytes:
+            return 0
+        with self._lock:
+            return self._evict()
+
+    def _evict(self) -> int:
+        count, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        drop = max(0, count - self.max_entries) if self.max_entries else 0
+        if self.max_bytes and total > self.max_bytes:
+            # 按 last_used 从旧到新累计，找到需要删除的条数
+            excess = total - self.max_bytes
+            freed = n = 0
+            for (size,) in self.db.execute("SELECT size FROM responses ORDER BY last_used"):
+                if freed >= excess:
+                    break
+                freed += size
+                n += 1
+            drop = max(drop, n)
+        if drop:
+            self.db.execute("DELETE FROM responses WHERE key IN "
+                            "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (drop,))
+            self.stats["evicted"] += drop
+        return drop
+
+    def __len__(self):
+        if self.db is None:
+            return self._entries or 0
+        return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def report(self) -> str:
+        s = self.stats
+        lookups = s["hits"] + s["misses"]
+        rate = f" ({s['hits'] / lookups:.0%} hit rate)" if lookups else ""
+        return (f"response cache: {s['hits']} hits, {s['misses']} misses{rate}, {s['writes']} written, "
+                f"{s['evicted']} evicted, {len(self)} entries ({self.path})")
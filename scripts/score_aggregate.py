@@ -0,0 +1,177 @@
+# scripts/score_aggregate.py
+"""
+One-pass streaming aggregation of CLIPScore results.
+
+ScoreAggregator joins score entries ({"image_id", "clip_score",
+"ref_clip_score", ...}, as written by compute_clipscore.py) to annotation
+metadata by Image_Id and keeps count / sum / mean / variance of every metric
+for any number of groupings (e.g. ("distance", "view"), ("arm", "step")) at
+the same time. Score files are streamed in chunks of `chunk_size` entries;
+each chunk is reduced per group with np.bincount and merged into the running
+statistics (Chan et al. parallel variance), so memory stays proportional to
+the number of groups, not the number of scores.
+
+An image can appear in several annotation records (same capture reused by
+several steps); compute_clipscore.py writes one entry per record in record
+order, so the k-th score entry of an image is joined to the k-th annotation
+record of that image.
+
+Group fields: arm, step, phase, view, distance, anomaly_type, label,
+location (from the annotation) and source (stem of the score file).
+"""
+from pathlib import Path
+
+import numpy as np
+
+from annotation_io import iter_records
+from dataset import FIELD_KEYS, _get, arm_from_filename, arm_of, image_id_of
+
+META_FIELDS = ("arm",) + tuple(FIELD_KEYS)
+FIELDS = META_FIELDS + ("source",)
+METRICS = ("clip_score", "ref_clip_score")
+
+
+class GroupStats:
+    """Online count / sum / mean / M2 per group key, updated one chunk at a time."""
+
+    def __init__(self):
+        self.stats = {}     # key tuple -> [count, total, mean, m2]
+
+    def update(self, keys: list, inv: np.ndarray, values: np.ndarray):
+        """
+        keys: group keys of this chunk; inv: (n,) index into keys per value;
+        values: (n,) float, NaN = missing.
+        """
+        valid = ~np.isnan(values)
+        if not valid.any():
+            return
+        inv, values = inv[valid], values[valid]
+        n = np.bincount(inv, minlength=len(keys)).astype(np.float64)
+        total = np.bincount(inv, weights=values, minlength=len(keys))
+        mean = np.divide(total, n, out=np.zeros_like(total), where=n > 0)
+        m2 = np.bincount(inv, weights=(values - mean[inv]) ** 2, minlength=len(keys))
+        for key, nb, tb, mb, m2b in zip(keys, n.tolist(), total.tolist(), mean.tolist(), m2.tolist()):
+            if not nb:
+                continue
+            acc = self.stats.get(key)
+            if acc is None:
+                self.stats[key] = [nb, tb, mb, m2b]
+                continue
+            na, ta, ma, m2a = acc
+            count = na + nb
+            delta = mb - ma
+            acc[0] = count
+            acc[1] = ta + tb
+            acc[2] = ma + delta * nb / count
+            acc[3] = m2a + m2b + delta * delta * na * nb / count
+
+    def summary(self, key: tuple) -> dict:
+        count, total, mean, m2 = self.stats[key]
+        var = m2 / (count - 1) if count > 1 else None
+        return {"count": int(count), "sum": total, "mean": mean, "var": var,
+                "std": None if var is None else var ** 0.5}
+
+
+class ScoreAggregator:
+    def __init__(self, annotation_paths, groupings, metrics=METRICS, chunk_size: int = 1 << 16):
+        """
+        annotation_paths: records files (.json / .jsonl / .cols) providing the metadata
+        groupings: iterable of field tuples, e.g. [("distance", "view"), ("arm",), ()]
+        """
+        self.groupings = [tuple(g) for g in groupings]
+        for g in self.groupings:
+            unknown = set(g) - set(FIELDS)
+            if unknown:
+                raise KeyError(f"Unknown group field(s): {sorted(unknown)} (expected {FIELDS})")
+        self.metrics = tuple(metrics)
+        self.chunk_size = chunk_size
+        self.vocab = {f: {None: 0} for f in FIELDS}
+        self.stats = {(g, m): GroupStats() for g in self.groupings for m in self.metrics}
+        self.scores = 0
+        self.unmatched = 0
+        self._load_metadata(annotation_paths)
+
+    def _code(self, field: str, value) -> int:
+        vocab = self.vocab[field]
+        code = vocab.get(value)
+        if code is None:
+            code = vocab[value] = len(vocab)
+        return code
+
+    def _load_metadata(self, paths):
+        # Image_Id -> row ids into self.meta, in annotation order
+        self.rows_of = {}
+        rows = []
+        for path in paths:
+            arm = arm_from_filename(path)
+            for rec in iter_records(path):
+                values = [arm_of(rec, arm)] + [_get(rec, keys) for keys in FIELD_KEYS.values()]
+                label = values[META_FIELDS.index("label")]
+                if label is not None:
+                    values[META_FIELDS.index("label")] = bool(label)
+                self.rows_of.setdefault(image_id_of(rec), []).append(len(rows))
+                rows.append([self._code(f, v) for f, v in zip(META_FIELDS, values)])
+        # last row: all-None metadata for scores without a matching annotation
+        rows.append([0] * len(META_FIELDS))
+        self.meta = np.array(rows, dtype=np.int32).reshape(-1, len(META_FIELDS))
+
+    def add_scores(self, path: Path, source: str = None):
+        """Stream one score file (.json array or .jsonl) into the accumulators."""
+        path = Path(path)
+        source_code = self._code("source", source or path.stem)
+        seen = {}
+        none_row = len(self.meta) - 1
+        rows, values = [], []
+        for entry in iter_records(path):
+            image_id = entry.get("image_id", entry.get("Image_Id"))
+            k = seen.get(image_id, 0)
+            seen[image_id] = k + 1
+            candidates = self.rows_of.get(image_id)
+            if candidates and k < len(candidates):
+                rows.append(candidates[k])
+            else:
+                rows.append(none_row)
+                self.unmatched += 1
+            values.append([entry.get(m) for m in self.metrics])
+            if len(rows) >= self.chunk_size:
+                self._reduce(rows, values, source_code)
+                rows, values = [], []
+        if rows:
+            self._reduce(rows, values, source_code)
+
+    def _reduce(self, rows: list, values: list, source_code: int):
+        self.scores += len(rows)
+        meta = self.meta[np.asarray(rows, dtype=np.int64)]
+        keys = np.concatenate([meta, np.full((len(rows), 1), source_code, dtype=np.int32)], axis=1)
+        vals = np.array(values, dtype=np.float64)   # None -> nan
+        cols = {f: i for i, f in enumerate(FIELDS)}
+        for g in self.groupings:
+            # 各字段编码按混合进制合成一个 int64 键，一次 np.unique 得到本块的分组
+            sizes = [len(self.vocab[f]) for f in g]
+            combined = np.zeros(len(rows), dtype=np.int64)
+            for f, size in zip(g, sizes):
+                combined = combined * size + keys[:, cols[f]]
+            uniq, inv = np.unique(combined, return_inverse=True)
+            parts = np.unravel_index(uniq, sizes) if g else ()
+            gkeys = list(zip(*(p.tolist() for p in parts))) if g else [()]
+            for j, m in enumerate(self.metrics):
+                self.stats[(g, m)].update(gkeys, inv.reshape(-1), vals[:, j])
+
+    def table(self, grouping: tuple) -> list:
+        """Rows {field: value, ..., "<metric>_count"/"_sum"/"_mean"/"_var"/"_std": ...} of one grouping."""
+        grouping = tuple(grouping)
+        decode = {f: list(self.vocab[f]) for f in grouping}
+        keys = sorted(set().union(*(self.stats[(grouping, m)].stats for m in self.metrics)))
+        out = []
+        for key in keys:
+            row = {f: decode[f][c] for f, c in zip(grouping, key)}
+            for m in self.metrics:
+                stats = self.stats[(grouping, m)]
+                summary = stats.summary(key) if key in stats.stats else {"count": 0}
+                for name in ("count", "sum", "mean", "var", "std"):
+                    row[f"{m}_{name}"] = summary.get(name)
+            out.append(row)
+        return out
+
+    def tables(self) -> dict:
+        return {g: self.table(g) for g in self.groupings}
@@ -0,0 +1,183 @@
+# scripts/score_checkpoint.py
+"""
+Shard assignment and append-only checkpoints for resumable CLIPScore runs.
+
+A run over records file R with --shard i/n scores only the records whose
+image id hashes to shard i (crc32 % n), so every record of one image id lands
+in the same shard. Completed scores are appended to
+
+    <checkpoint_dir>/<R stem>.shard-<i>-of-<n>.jsonl
+
+    {"fingerprint": ..., "shard": "i/n"}                                  header
+    {"i": 17, "key": "data/image/0018.jpg", "clip_score": ..., "ref_clip_score": ...}
+    ...
+    {"complete": true, "records": N}                                      written when the shard finishes
+
+"i" is the position of the record within the shard. A restarted run skips
+the positions already present; a torn last line (process killed mid-write)
+is dropped. The fingerprint covers the records and references file content,
+the model (local weight files included), backend and pixel path (resized
+pixel cache vs full decode), so a checkpoint from a different input or
+configuration is discarded. compute_clipscore.py only checkpoints sharded
+runs (--shard i/n with n > 1) and unsharded runs started with --resume.
+merge_checkpoints() combines the complete shards into the image id -> score
+maps compute_clipscore.py writes clipscore_results.json from.
+"""
+import json
+import os
+import re
+import time
+import zlib
+from pathlib import Path
+
+
+def parse_shard(spec: str) -> tuple:
+    """"i/n" -> (i, n) with 0 <= i < n."""
+    m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec or "")
+    if not m:
+        raise ValueError(f"--shard 格式应为 i/n，例如 0/4：{spec!r}")
+    i, n = int(m.group(1)), int(m.group(2))
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f"分片编号越界：{spec!r}（需要 0 <= i < n）")
+    return i, n
+
+
+def shard_of(key: str, n: int) -> int:
+    return zlib.crc32(key.encode("utf-8")) % n
+
+
+def checkpoint_path(checkpoint_dir: Path, records_path: Path, shard: tuple) -> Path:
+    i, n = shard
+    return Path(checkpoint_dir).joinpath(f"{Path(records_path).stem}.shard-{i}-of-{n}.jsonl")
+
+
+class ScoreCheckpoint:
+    def __init__(self, path: Path, fingerprint: str, shard: tuple = (0, 1), interval: float = 30.0,
+                 readonly: bool = False):
+        """
+        path: checkpoint .jsonl file (created if missing)
+        fingerprint: identifies the input + scoring config; a mismatch restarts the shard
+        interval: seconds between automatic flushes (see maybe_flush)
+        readonly: raise instead of restarting a missing / stale checkpoint (used by merge)
+        """
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.shard = shard
+        self.interval = interval
+        self.readonly = readonly
+        self.entries = {}       # position in shard -> (key, clip_score, ref_clip_score)
+        self.complete = False
+        self.resumed = 0
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._load()
+
+    def _header(self) -> dict:
+        return {"fingerprint": self.fingerprint, "shard": f"{self.shard[0]}/{self.shard[1]}"}
+
+    def _load(self):
+        if not self.path.exists():
+            if self.readonly:
+                raise FileNotFoundError(f"找不到 checkpoint：{self.path}")
+            self._reset()
+            return
+        with self.path.open("rb") as f:
+            lines = f.readlines()
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        if header != self._header():
+            if self.readonly:
+                raise ValueError(f"checkpoint 与当前输入/配置不一致，需要重新评分：{self.path}")
+            if lines:
+                print(f"[checkpoint] input or config changed, restarting {self.path}")
+            self._reset()
+            return
+        good = len(lines[0])
+        for line in lines[1:]:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                break  # torn write at the end
+            if not line.endswith(b"\n"):
+                break
+            if row.get("complete"):
+                self.complete = True
+            else:
+                self.entries[row["i"]] = (row["key"], row["clip_score"], row["ref_clip_score"])
+            good += len(line)
+        if good < sum(len(line) for line in lines) and not self.readonly:
+            with self.path.open("r+b") as f:
+                f.truncate(good)
+        self.resumed = len(self.entries)
+        if self.resumed and not self.readonly:
+            print(f"[checkpoint] resuming {self.path.name}: {self.resumed} records already scored")
+
+    def _reset(self):
+        self.entries, self.complete = {}, False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self._header()) + "\n", encoding="utf-8")
+
+    def __contains__(self, index: int) -> bool:
+        return index in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, index: int, key: str, clip_score, ref_clip_score):
+        self.entries[index] = (key, clip_score, ref_clip_score)
+        self._pending.append({"i": index, "key": key, "clip_score": clip_score,
+                              "ref_clip_score": ref_clip_score})
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def _append(self, rows: list):
+        with self.path.open("a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def flush(self):
+        """Append the scores added since the last flush."""
+        if self._pending:
+            self._append(self._pending)
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def finish(self, total: int):
+        """Flush and mark the shard complete after all of its `total` records were scored."""
+        self.flush()
+        if not self.complete:
+            self._append([{"complete": True, "records": total}])
+            self.complete = True
+
+    def scores(self) -> tuple:
+        """(clip_scores, ref_scores) keyed by image id; the last record of an id wins, as in a single pass."""
+        clip_scores, ref_scores = {}, {}
+        for index in sorted(self.entries):
+            key, clip, ref = self.entries[index]
+            clip_scores[key] = clip
+            ref_scores[key] = ref
+        return clip_scores, ref_scores
+
+
+def merge_checkpoints(paths: list, fingerprint: str) -> tuple:
+    """
+    Combine the shard checkpoints (one per shard, all complete) into
+    (clip_scores, ref_scores). Raises if a shard is missing, stale or unfinished.
+    """
+    clip_scores, ref_scores = {}, {}
+    n = len(paths)
+    for i, path in enumerate(paths):
+        ckpt = ScoreCheckpoint(path, fingerprint, shard=(i, n), readonly=True)
+        if not ckpt.complete:
+            raise RuntimeError(f"分片 {i}/{n} 尚未完成（已评分 {len(ckpt)} 条）：{path}")
+        clip, ref = ckpt.scores()
+        clip_scores.update(clip)
+        ref_scores.update(ref)
+    return clip_scores, ref_scores
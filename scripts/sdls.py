@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# scripts/sdls.py
+"""
+Single entry point for the dataset scripts.
+
+    python scripts/sdls.py annotate --incremental        auto_annotation_final.py
+    python scripts/sdls.py score data/annotation/...     compute_clipscore.py
+    python scripts/sdls.py report --group_by arm,step    clipscore_full_report.py
+    python scripts/sdls.py plot --workers 4              render_charts.py
+    python scripts/sdls.py detect records.json --show 1  detect_prompts.py
+    python scripts/sdls.py eval records.json --stub      vlm_eval.py
+    python scripts/sdls.py payloads records.json         payload_store.py
+    python scripts/sdls.py bench --scales 1 10           benchmark.py
+    python scripts/sdls.py tree --scale 10               capture_tree.py
+    python scripts/sdls.py imports [--max_ms 500]        import-time report
+
+Only the module of the chosen subcommand is imported, and the heavy
+dependencies of those modules (torch, transformers, scipy, tqdm,
+matplotlib) are themselves deferred with lazy_import until real work
+starts, so `--help` and argument errors return immediately. Everything
+after the subcommand name is passed to the script's own argument parser.
+
+`imports` runs `python -X importtime -c "import <module>"` in a fresh
+interpreter for each subcommand module and prints its total import time and
+slowest direct imports; with --max_ms it exits non-zero when a module goes
+over budget, so startup regressions show up in CI logs.
+"""
+import argparse
+import importlib
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).parent.resolve()
+
+# subcommand -> (module in scripts/, help)
+COMMANDS = {
+    "annotate": ("auto_annotation_final", "build annotation records from data/anomalyDataset_label"),
+    "score": ("compute_clipscore", "compute CLIPScore / RefCLIPScore for a records file"),
+    "report": ("clipscore_full_report", "grouped CLIPScore statistics and distance x view pivots"),
+    "plot": ("render_charts", "render the dataset charts (parallel, cached)"),
+    "detect": ("detect_prompts", "render the VLM anomaly-detection prompts for records"),
+    "eval": ("vlm_eval", "run the detection prompts against an OpenAI-compatible VLM endpoint"),
+    "payloads": ("payload_store", "pre-encode tiered base64 image payloads for eval"),
+    "bench": ("benchmark", "time each pipeline stage offline and compare against a baseline"),
+    "tree": ("capture_tree", "generate a synthetic capture tree at N times the dataset size"),
+}
+
+IMPORTTIME_REGEX = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def run_command(name: str, argv: list):
+    module_name, _ = COMMANDS[name]
+    if str(SCRIPTS_DIR) not in sys.path:
+        sys.path.insert(0, str(SCRIPTS_DIR))
+    module = importlib.import_module(module_name)
+    sys.argv = [f"sdls {name}"] + list(argv)
+    return module.main()
+
+
+def import_profile(module_name: str, python: str = sys.executable) -> dict:
+    """
+    Import time of one module in a fresh interpreter:
+    {"module", "total_ms", "children": [(name, cumulative_ms), ...]} (direct imports, slowest first).
+    """
+    proc = subprocess.run([python, "-X", "importtime", "-c", f"import {module_name}"],
+                          cwd=SCRIPTS_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module_name} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    entries = []   # (depth, name, cumulative us), in the order the imports finished
+    for line in proc.stderr.splitlines():
+        m = IMPORTTIME_REGEX.match(line)
+        if m:
+            entries.append((len(m.group(3)) // 2, m.group(4), int(m.group(2))))
+    # the module's own line comes last; its subtree is every line back to the previous top-level import
+    end = max(i for i, (depth, name, _) in enumerate(entries) if depth == 0 and name == module_name)
+    start = end
+    while start > 0 and entries[start - 1][0] > 0:
+        start -= 1
+    children = [(name, us / 1000) for depth, name, us in entries[start:end] if depth == 1]
+    return {"module": module_name, "total_ms": entries[end][2] / 1000,
+            "children": sorted(children, key=lambda c: -c[1])}
+
+
+def import_report(modules: list, top: int = 5, max_ms: float = None) -> tuple:
+    """Print the import profile of each module; returns (profiles, modules over max_ms)."""
+    profiles, over = [], []
+    for module_name in modules:
+        prof = import_profile(module_name)
+        profiles.append(prof)
+        flag = ""
+        if max_ms is not None and prof["total_ms"] > max_ms:
+            over.append(module_name)
+            flag = f"  > {max_ms:g} ms"
+        print(f"{module_name:<24} {prof['total_ms']:9.1f} ms{flag}")
+        for name, ms in prof["children"][:top]:
+            print(f"    {name:<28} {ms:9.1f} ms")
+    return profiles, over
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="SDLS anomaly dataset tools",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="subcommands:\n" + "\n".join(f"  {name:<10}{help_}" for name, (_, help_) in COMMANDS.items())
+        + "\n  imports   import-time report of the subcommand modules\n\n"
+          "run `sdls.py <subcommand> --help` for the options of a subcommand")
+    parser.add_argument("command", choices=list(COMMANDS) + ["imports"], metavar="subcommand")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.command != "imports":
+        return run_command(args.command, args.args)
+
+    sub = argparse.ArgumentParser(prog="sdls imports", description="Import time of each subcommand module")
+    sub.add_argument("modules", nargs="*", default=None,
+                     help="要测量的模块（默认：sdls 及全部子命令模块）")
+    sub.add_argument("--top", type=int, default=5, help="每个模块显示最慢的 N 个直接导入")
+    sub.add_argument("--max_ms", type=float, default=None, help="导入时间预算（毫秒），超出时返回非零退出码")
+    sub.add_argument("--json", type=Path, default=None, help="另存为 JSON（便于对比历史结果）")
+    opts = sub.parse_args(args.args)
+
+    modules = opts.modules or ["sdls"] + [m for m, _ in COMMANDS.values()]
+    profiles, over = import_report(modules, opts.top, opts.max_ms)
+    if opts.json:
+        opts.json.write_text(json.dumps(profiles, indent=1), encoding="utf-8")
+    if over:
+        print(f"[WARN] over the {opts.max_ms:g} ms import budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,13 +9,13 @@ Generate six visualizations for anomaly data:
 5. Bubble+Color Chart (Total size, Mobile ratio)
 6. Treemap (Mosaic)
 """
-import json
 from pathlib import Path
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.patches import Patch
 
+from count_cube import load_cube
+
 # Optional treemap library
 try:
     import squarify
@@ -23,21 +23,24 @@ except ImportError:
     squarify = None
 
 
-def load_df(json_path: Path) -> pd.DataFrame:
-    data = json.loads(json_path.read_text(encoding='utf-8'))
-    df = pd.DataFrame(data)
-    df['anomaly_Type'] = df['anomaly_Type'].fillna('normal')
-    df['point'] = df['image_id'].str.extract(r'/point(\d+)/')[0].astype(int)
-    return df
+FIX_ARM, MOBILE_ARM = 'fix_arm', 'mobile_arm'
+
+
+def load_cube_for(fix_path: Path, mob_path: Path):
+    """Count cube of both arms; records without an anomaly type count as 'normal'."""
+    return load_cube(fix_path, mob_path).relabel('anomaly_type', {None: 'normal'})
 
 
-def plot_dual_heatmap(df_fix, df_mob, types, points, out_path: Path):
-    pivot_fix = df_fix.pivot_table(index='anomaly_Type', columns='point', aggfunc='size', fill_value=0)
-    pivot_fix = pivot_fix.reindex(index=types, columns=points, fill_value=0)
-    pivot_mob = df_mob.pivot_table(index='anomaly_Type', columns='point', aggfunc='size', fill_value=0)
-    pivot_mob = pivot_mob.reindex(index=types, columns=points, fill_value=0)
+def type_point_counts(cube, arm, types, points):
+    """(type, point) count matrix of one arm."""
+    return cube.table('anomaly_type', 'point', types, points, arm=arm)
 
-    vmax = max(pivot_fix.values.max(), pivot_mob.values.max())
+
+def plot_dual_heatmap(cube, types, points, out_path: Path):
+    pivot_fix = type_point_counts(cube, FIX_ARM, types, points)
+    pivot_mob = type_point_counts(cube, MOBILE_ARM, types, points)
+
+    vmax = max(pivot_fix.max(), pivot_mob.max())
     fig, axes = plt.subplots(1, 2, figsize=(14, 6), sharey=True)
     for ax, data, title in zip(axes, [pivot_fix, pivot_mob], ['Fix Arm', 'Mobile Arm']):
         im = ax.imshow(data, aspect='auto', cmap='Blues', vmin=0, vmax=vmax)
@@ -58,15 +61,13 @@ def plot_dual_heatmap(df_fix, df_mob, types, points, out_path: Path):
     plt.close(fig)
 
 
-def plot_bubble_fix_mobile(df_fix, df_mob, types, points, out_path: Path):
-    pivot_fix = df_fix.pivot_table(index='anomaly_Type', columns='point', aggfunc='size', fill_value=0)
-    pivot_fix = pivot_fix.reindex(index=types, columns=points, fill_value=0)
-    pivot_mob = df_mob.pivot_table(index='anomaly_Type', columns='point', aggfunc='size', fill_value=0)
-    pivot_mob = pivot_mob.reindex(index=types, columns=points, fill_value=0)
+def plot_bubble_fix_mobile(cube, types, points, out_path: Path):
+    pivot_fix = type_point_counts(cube, FIX_ARM, types, points)
+    pivot_mob = type_point_counts(cube, MOBILE_ARM, types, points)
 
     X, Y = np.meshgrid(points, np.arange(len(types)))
-    fix_vals = pivot_fix.values.flatten()
-    mob_vals = pivot_mob.values.flatten()
+    fix_vals = pivot_fix.flatten()
+    mob_vals = pivot_mob.flatten()
     sizes = fix_vals * 20
 
     fig, ax = plt.subplots(figsize=(12, 6))
@@ -83,15 +84,13 @@ def plot_bubble_fix_mobile(df_fix, df_mob, types, points, out_path: Path):
     plt.close(fig)
 
 
-def plot_stacked_area(df_fix, df_mob, types, points, out_path: Path):
-    pivot_fix = df_fix.pivot_table(index='anomaly_Type', columns='point', aggfunc='size', fill_value=0)
-    pivot_fix = pivot_fix.reindex(index=types, columns=points, fill_value=0).T
-    pivot_mob = df_mob.pivot_table(index='anomaly_Type', columns='point', aggfunc='size', fill_value=0)
-    pivot_mob = pivot_mob.reindex(index=types, columns=points, fill_value=0).T
+def plot_stacked_area(cube, types, points, out_path: Path):
+    pivot_fix = type_point_counts(cube, FIX_ARM, types, points)
+    pivot_mob = type_point_counts(cube, MOBILE_ARM, types, points)
 
     fig, ax = plt.subplots(figsize=(14, 6))
-    ax.stackplot(points, [pivot_fix[typ] for typ in types], labels=[f'Fix {typ}' for typ in types], cmap='tab20', alpha=0.8)
-    ax.stackplot(points, [pivot_mob[typ] for typ in types], labels=[f'Mobile {typ}' for typ in types], cmap='tab20', alpha=0.4)
+    ax.stackplot(points, list(pivot_fix), labels=[f'Fix {typ}' for typ in types], cmap='tab20', alpha=0.8)
+    ax.stackplot(points, list(pivot_mob), labels=[f'Mobile {typ}' for typ in types], cmap='tab20', alpha=0.4)
     ax.set_xticks(points)
     ax.set_xlabel('Point')
     ax.set_ylabel('Count')
@@ -102,9 +101,9 @@ def plot_stacked_area(df_fix, df_mob, types, points, out_path: Path):
     plt.close(fig)
 
 
-def plot_radar(df_fix, df_mob, types, out_path: Path):
-    fix_counts = df_fix['anomaly_Type'].value_counts().reindex(types, fill_value=0).values
-    mob_counts = df_mob['anomaly_Type'].value_counts().reindex(types, fill_value=0).values
+def plot_radar(cube, types, out_path: Path):
+    fix_counts = cube.table('anomaly_type', rows_order=types, arm=FIX_ARM)
+    mob_counts = cube.table('anomaly_type', rows_order=types, arm=MOBILE_ARM)
     angles = np.linspace(0, 2*np.pi, len(types), endpoint=False).tolist()
     angles += angles[:1]
     fix_plot = np.concatenate((fix_counts, [fix_counts[0]]))
@@ -125,15 +124,10 @@ def plot_radar(df_fix, df_mob, types, out_path: Path):
     plt.close(fig)
 
 
-def plot_bubble_color(df_fix, df_mob, types, points, out_path: Path):
-    pivot_fix = df_fix.pivot_table(index='point', columns='anomaly_Type', aggfunc='size', fill_value=0)
-    pivot_fix = pivot_fix.reindex(columns=types, index=points, fill_value=0)
-    pivot_mob = df_mob.pivot_table(index='point', columns='anomaly_Type', aggfunc='size', fill_value=0)
-    pivot_mob = pivot_mob.reindex(columns=types, index=points, fill_value=0)
-
+def plot_bubble_color(cube, types, points, out_path: Path):
     X, Y = np.meshgrid(points, np.arange(len(types)))
-    fix_vals = pivot_fix.values.T.flatten()
-    mob_vals = pivot_mob.values.T.flatten()
+    fix_vals = type_point_counts(cube, FIX_ARM, types, points).flatten()
+    mob_vals = type_point_counts(cube, MOBILE_ARM, types, points).flatten()
     total_vals = fix_vals + mob_vals
     ratio = np.divide(mob_vals, total_vals, out=np.zeros_like(mob_vals, float), where=total_vals>0)
 
@@ -151,12 +145,12 @@ def plot_bubble_color(df_fix, df_mob, types, points, out_path: Path):
     plt.close(fig)
 
 
-def plot_treemap(df_fix, df_mob, types, out_path: Path):
+def plot_treemap(cube, types, out_path: Path):
     if squarify is None:
         print('squarify not available; skipping treemap')
         return
-    fix_counts = df_fix['anomaly_Type'].value_counts().reindex(types, fill_value=0).values
-    mob_counts = df_mob['anomaly_Type'].value_counts().reindex(types, fill_value=0).values
+    fix_counts = cube.table('anomaly_type', rows_order=types, arm=FIX_ARM)
+    mob_counts = cube.table('anomaly_type', rows_order=types, arm=MOBILE_ARM)
     labels, sizes, colors = [], [], []
     base_colors = plt.cm.Set3(np.linspace(0,1,len(types)))
     for i, t in enumerate(types):
@@ -184,17 +178,17 @@ def main():
     plot = root.joinpath('data', 'plot')
     plot.mkdir(parents=True, exist_ok=True)
 
-    df_fix = load_df(ann.joinpath('records_fix_arm.json'))
-    df_mob = load_df(ann.joinpath('records_mobile_arm.json'))
-    types = sorted(df_fix['anomaly_Type'].unique())
+    # 一次构建（或从 count_cube.npz 读取）计数立方体，所有图表都在其上切片
+    cube = load_cube_for(ann.joinpath('records_fix_arm.json'), ann.joinpath('records_mobile_arm.json'))
+    types = sorted(cube.values('anomaly_type', arm=FIX_ARM))
     points = list(range(1,12))
 
-    plot_dual_heatmap(df_fix, df_mob, types, points, plot.joinpath('dual_heatmap.png'))
-    plot_bubble_fix_mobile(df_fix, df_mob, types, points, plot.joinpath('bubble_fix_mobile.png'))
-    plot_stacked_area(df_fix, df_mob, types, points, plot.joinpath('stacked_area.png'))
-    plot_radar(df_fix, df_mob, types, plot.joinpath('radar_chart.png'))
-    plot_bubble_color(df_fix, df_mob, types, points, plot.joinpath('bubble_color.png'))
-    plot_treemap(df_fix, df_mob, types, plot.joinpath('treemap.png'))
+    plot_dual_heatmap(cube, types, points, plot.joinpath('dual_heatmap.png'))
+    plot_bubble_fix_mobile(cube, types, points, plot.joinpath('bubble_fix_mobile.png'))
+    plot_stacked_area(cube, types, points, plot.joinpath('stacked_area.png'))
+    plot_radar(cube, types, plot.joinpath('radar_chart.png'))
+    plot_bubble_color(cube, types, points, plot.joinpath('bubble_color.png'))
+    plot_treemap(cube, types, plot.joinpath('treemap.png'))
 
 if __name__=='__main__':
     main()
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+# scripts/vlm_eval.py
+"""
+Asynchronous evaluation of the detection prompts against an
+OpenAI-compatible VLM endpoint (/v1/chat/completions).
+
+Every annotation record is paired with its image and the prompt of the
+chosen template (prompt_engine.PromptRenderer). Requests go through one
+pooled aiohttp session:
+- bounded concurrency: `--concurrency` worker coroutines share the
+  connection pool (limit = concurrency);
+- rate limiting: a token bucket of `--rate` requests/s with `--burst`
+  capacity, taken before every attempt (retries included);
+- retries: connection errors, timeouts, 429 and 5xx are retried up to
+  `--retries` times with exponential backoff + jitter (Retry-After wins
+  when the server sends one); a 200 reply that is not a chat completion
+  (invalid JSON, no choices, null content) is an error of its request and
+  is not retried; any error only fails the rows of its own request;
+- latency: wall time of the successful attempt and of the whole request;
+- packing: with --pack_size > 1, records of one step / phase /
+  Detection_Location share one request with several images and the
+  per-image verdicts are mapped back to each record (request_packing.py);
+- images: data URLs are sliced from the pre-encoded payload store
+  (payload_store.py, --payload_store / --tier) instead of being read and
+  base64-encoded per request;
+- response cache: successful responses are stored in a SQLite cache
+  (response_cache.py) keyed by model, prompt hash, image hash and decoding
+  params (packed responses only when every image got its answer line); a
+  rerun only sends the requests whose inputs changed;
+- metrics: every answer is parsed with the template's polarity as it
+  arrives and added to a confusion-matrix accumulator
+  (detection_metrics.py); a live summary is printed every
+  `--metrics_every` records and per template / arm / view / distance /
+  anomaly type tables at the end (CSV with --metrics_dir).
+
+Results are streamed to a .jsonl file, one line per record in completion
+order ("i" is the record index):
+    {"i", "image_id", "template", "label", "arm", "view", "distance", "anomaly_type", "answer", "verdict",
+     "latency_s", "total_s", "attempts", "usage", "error", "cached", "pack", "pack_size"}
+"verdict" is the parsed answer: true = anomaly, false = normal, null =
+undetermined (or request error).
+"pack" is the index of the first record of the request; for packed
+requests "answer" is the record's own line and "usage" is only set on the
+first record of the pack.
+
+Offline throughput test against the bundled stub (vlm_stub_server.py),
+started on a free port inside the same process:
+    python scripts/vlm_eval.py data/annotation/records_fix_arm_final.json --stub --concurrency 32
+Real endpoint (API key from --api_key or OPENAI_API_KEY):
+    python scripts/vlm_eval.py data/annotation/records_fix_arm_final.json \\
+        --base_url https://api.openai.com/v1 --model gpt-4o --template level2 --rate 5
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import os
+import random
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from annotation_io import JsonlWriter, iter_records
+from dataset import FIELD_KEYS, _get, arm_of, image_id_of
+from detection_metrics import DEFAULT_GROUPINGS, DetectionMetrics, report, table_name, write_table
+from payload_store import PayloadStore, encode_tier
+from prompt_engine import SYSTEM_PROMPT, TEMPLATES, Prompt, PromptRenderer
+from request_packing import pack_items, packed_instruction, split_packed_answer
+from response_cache import ResponseCache, prompt_sha1, request_key
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class EvalItem(NamedTuple):
+    index: int              # position of the record in the input
+    image_id: str
+    image_path: Path
+    prompt: Prompt
+    template: str           # template name the prompt was rendered with
+    label: object           # Anomaly_Label of the record (None if absent)
+    group: tuple = ()       # (step, phase, Detection_Location), the packing group
+    meta: dict = None       # arm / view / distance / anomaly_type, the metric groupings
+
+
+class RequestError(Exception):
+    def __init__(self, message: str, status: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def build_items(records, renderer: PromptRenderer, images_root: Path = PROJECT_ROOT, start: int = 0):
+    for i, rec in enumerate(records, start):
+        image_id = image_id_of(rec)
+        meta = {"arm": arm_of(rec), "view": _get(rec, FIELD_KEYS["view"]),
+                "distance": _get(rec, FIELD_KEYS["distance"]), "anomaly_type": _get(rec, FIELD_KEYS["anomaly_type"])}
+        yield EvalItem(i, image_id, images_root.joinpath(image_id), renderer.render(rec), renderer.template,
+                       _get(rec, FIELD_KEYS["label"]),
+                       (rec.get("step"), rec.get("phase"), _get(rec, FIELD_KEYS["location"])), meta)
+
+
+def completion_text(body) -> str:
+    """choices[0].message.content of a chat completion body; RequestError when the body has another shape."""
+    try:
+        content = body["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        raise RequestError(f"malformed response, no choices[0].message.content: {str(body)[:200]}", 200) from None
+    if not isinstance(content, str):
+        raise RequestError(f"malformed response, message content is {type(content).__name__}", 200)
+    return content
+
+
+def image_data_url(path: Path) -> str:
+    return "data:image/jpeg;base64," + base64.b64encode(Path(path).read_bytes()).decode("ascii")
+
+
+class ImagePayloads:
+    """
+    Image data URLs at one tier: sliced from a PayloadStore when the image is in it and
+    unchanged since it was encoded, otherwise encoded on the fly ("full" = original bytes).
+    """
+
+    def __init__(self, tier: str = "full", store: PayloadStore = None, quality: int = 90):
+        self.tier = tier
+        self.store = store
+        self.quality = store.quality if store is not None else quality
+
+    def url(self, item: EvalItem) -> str:
+        if self.store is not None:
+            # 原图改过（size / mtime 不符）时不用旧的编码结果，与响应缓存按当前文件内容计算的键一致
+            url = self.store.data_url(item.image_id, self.tier, item.image_path)
+            if url is not None:
+                return url
+        if self.tier == "full":
+            return image_data_url(item.image_path)
+        return encode_tier(item.image_path, self.tier, self.quality)[0].decode("ascii")
+
+    def cache_id(self, image_sha1: str) -> str:
+        """Response-cache identity of an image as sent (content hash + tier / quality when re-encoded)."""
+        return image_sha1 if self.tier == "full" else f"{image_sha1}@{self.tier}q{self.quality}"
+
+
+def build_messages(prompt_text: str, image_urls: list, system: str = SYSTEM_PROMPT) -> list:
+    content = [{"type": "text", "text": prompt_text}]
+    content += [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]
+    return [{"role": "system", "content": system}, {"role": "user", "content": content}]
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, at most `burst` stored."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, n: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+
+class VLMClient:
+    """Pooled OpenAI-compatible chat client with rate limiting and retries. Use as `async with`."""
+
+    def __init__(self, base_url: str, model: str, api_key: str = None, concurrency: int = 8,
+                 rate: float = None, burst: float = None, retries: int = 4, backoff: float = 0.5,
+                 max_backoff: float = 30.0, timeout: float = 120.0, params: dict = None):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.params = dict(params or {})
+        self.session = None
+        self.stats = {"requests": 0, "attempts": 0, "retries": 0, "failed": 0}
+
+    async def __aenter__(self):
+        try:
+            import aiohttp
+        except ImportError as e:
+            raise ImportError("vlm_eval requires `pip install aiohttp`") from e
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        self.session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        self.session = None
+
+    def payload(self, messages: list) -> dict:
+        return {"model": self.model, "messages": messages, **self.params}
+
+    async def _post(self, payload: dict) -> dict:
+        import aiohttp
+        try:
+            async with self.session.post(self.url, json=payload) as resp:
+                if resp.status != 200:
+                    retry_after = resp.headers.get("Retry-After")
+                    try:
+                        retry_after = float(retry_after) if retry_after else None
+                    except ValueError:
+                        retry_after = None
+                    text = (await resp.text())[:200]
+                    raise RequestError(f"HTTP {resp.status}: {text}", resp.status, retry_after)
+                try:
+                    return await resp.json(content_type=None)
+                except ValueError as e:
+                    raise RequestError(f"malformed response, invalid JSON: {e}", resp.status) from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise RequestError(f"{type(e).__name__}: {e}") from e
+
+    def _retryable(self, err: RequestError) -> bool:
+        return err.status is None or err.status in RETRY_STATUS
+
+    async def complete(self, messages: list) -> dict:
+        """
+        Send one chat request (with retries).
+        Returns {"answer", "usage", "latency_s", "total_s", "attempts"}; raises RequestError when out of retries.
+        """
+        payload = self.payload(messages)
+        self.stats["requests"] += 1
+        t_start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            self.stats["attempts"] += 1
+            t0 = time.perf_counter()
+            try:
+                body = await self._post(payload)
+            except RequestError as err:
+                if attempt >= self.retries or not self._retryable(err):
+                    self.stats["failed"] += 1
+                    raise
+                self.stats["retries"] += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+                await asyncio.sleep(max(delay, err.retry_after or 0.0))
+                continue
+            t1 = time.perf_counter()
+            try:
+                answer = completion_text(body)
+            except RequestError:
+                self.stats["failed"] += 1
+                raise
+            return {"answer": answer, "usage": body.get("usage"),
+                    "latency_s": t1 - t0, "total_s": t1 - t_start, "attempts": attempt + 1}
+
+
+def _split_result(pack: list, result: dict, rows: list):
+    """Fill the rows of a pack from one response (per-image answers for packed requests)."""
+    if len(pack) == 1:
+        rows[0].update(result)
+        return
+    answers = split_packed_answer(result["answer"], len(pack))
+    for k, (row, answer) in enumerate(zip(rows, answers)):
+        row.update(result, answer=answer, usage=result.get("usage") if k == 0 else None)
+        if answer is None:
+            row["error"] = f"no answer for image {k + 1} of {len(pack)} in the packed response"
+
+
+async def evaluate_pack(client: VLMClient, pack: list, cache: ResponseCache = None,
+                        payloads: ImagePayloads = None) -> list:
+    """Send one request for a pack of items sharing a prompt; returns one row per item."""
+    payloads = payloads or ImagePayloads()
+    rows = [{"i": it.index, "image_id": it.image_id, "template": it.template, "label": it.label, **(it.meta or {}),
+             "answer": None, "verdict": None, "latency_s": None, "total_s": None, "attempts": 0, "usage": None, "error": None,
+             "cached": False, "pack": pack[0].index, "pack_size": len(pack)} for it in pack]
+    text = pack[0].prompt.text
+    if len(pack) > 1:
+        text += packed_instruction(len(pack))
+    try:
+        key = None
+        if cache is not None:
+            # 冷缓存时要整文件计算 sha1，放到线程里，避免阻塞其他 worker
+            image_sha1s = await asyncio.to_thread(
+                lambda: [payloads.cache_id(cache.image_hash(it.image_path)) for it in pack])
+            p_hash = prompt_sha1(SYSTEM_PROMPT, text)
+            key = request_key(client.model, p_hash, image_sha1s, client.params)
+            cached = cache.get(key)
+            if cached is not None:
+                _split_result(pack, dict(cached, cached=True), rows)
+                return rows
+        urls = await asyncio.to_thread(lambda: [payloads.url(it) for it in pack])
+        result = await client.complete(build_messages(text, urls))
+        _split_result(pack, result, rows)
+        # 打包回答里缺了某张图的行就不缓存，否则重跑会一直复用这个坏回答
+        if key is not None and all(row["error"] is None for row in rows):
+            cache.put(key, result, client.model, p_hash, image_sha1s, client.params)
+    except (RequestError, OSError) as e:
+        for row in rows:
+            row["error"] = str(e)
+    except Exception as e:
+        # 意外错误只记到本请求的行上，worker 不能退出（否则 run_eval 会卡在 queue.put）
+        for row in rows:
+            row["error"] = f"{type(e).__name__}: {e}"
+    return rows
+
+
+async def run_eval(packs, client: VLMClient, on_result=None, progress_every: int = 100,
+                   cache: ResponseCache = None, payloads: ImagePayloads = None) -> list:
+    """
+    Evaluate packs (lists of items, see request_packing.pack_items) with client.concurrency workers;
+    on_result(row) is called for every record as its request finishes.
+    Returns the latencies (seconds) of the successful requests sent in this run (cache hits excluded).
+    """
+    queue = asyncio.Queue(maxsize=client.concurrency * 2)
+    latencies, done = [], [0]
+
+    async def worker():
+        while True:
+            pack = await queue.get()
+            if pack is None:
+                return
+            rows = await evaluate_pack(client, pack, cache, payloads)
+            if rows[0]["latency_s"] is not None and not rows[0]["cached"]:
+                latencies.append(rows[0]["latency_s"])
+            if on_result is not None:
+                for row in rows:
+                    on_result(row)
+            done[0] += 1
+            if progress_every and done[0] % progress_every == 0:
+                print(f"  {done[0]} requests done")
+
+    async def produce():
+        for pack in packs:
+            await queue.put(pack)
+        for _ in workers:
+            await queue.put(None)
+
+    workers = [asyncio.create_task(worker()) for _ in range(client.concurrency)]
+    producer = asyncio.create_task(produce())
+    try:
+        # worker 异常（如 on_result 写文件失败）直接抛出，而不是让 producer 永远等在满队列上
+        await asyncio.gather(producer, *workers)
+    finally:
+        for task in (producer, *workers):
+            task.cancel()
+    return latencies
+
+
+def latency_summary(latencies: list, wall: float, records: int, requests: int, cached: int = 0) -> str:
+    head = f"{records} records in {requests} requests" + (f" ({cached} from cache)" if cached else "")
+    if not latencies:
+        return f"{head}, none sent" + (" successfully" if requests > cached else "") + f" in {wall:.2f}s"
+    ordered = sorted(latencies)
+
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return (f"{head}, {len(latencies)} sent ok in {wall:.2f}s = {requests / wall:.1f} req/s, "
+            f"{records / wall:.1f} records/s; latency p50 {pct(0.5) * 1000:.0f} ms, "
+            f"p95 {pct(0.95) * 1000:.0f} ms, max {ordered[-1] * 1000:.0f} ms")
+
+
+async def _main(args):
+    renderer = PromptRenderer(args.template, args.context_first)
+    records = (rec for path in args.records for rec in iter_records(PROJECT_ROOT.joinpath(path)))
+    items = build_items(itertools.islice(records, args.limit), renderer)
+
+    stub_runner = None
+    base_url = args.base_url
+    if args.stub:
+        from vlm_stub_server import StubVLM, start_stub
+        stub_runner, base_url = await start_stub(StubVLM(latency=args.stub_latency, error_rate=args.stub_error_rate,
+                                                         malformed_rate=args.stub_malformed_rate))
+        print(f"stub VLM listening on {base_url}")
+
+    params = {"max_tokens": args.max_tokens, "temperature": args.temperature}
+    client = VLMClient(base_url, args.model, args.api_key or os.environ.get("OPENAI_API_KEY"),
+                       concurrency=args.concurrency, rate=args.rate, burst=args.burst, retries=args.retries,
+                       backoff=args.backoff, timeout=args.timeout, params=params)
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(PROJECT_ROOT.joinpath(args.cache_dir), args.cache_max_entries, args.cache_max_mb)
+    store = PayloadStore(PROJECT_ROOT.joinpath(args.payload_store)) if args.payload_store else None
+    payloads = ImagePayloads(args.tier, store)
+    out_path = PROJECT_ROOT.joinpath(args.out)
+    metrics = DetectionMetrics(DEFAULT_GROUPINGS)
+    t0 = time.perf_counter()
+    try:
+        with JsonlWriter(out_path) as writer:
+            def on_result(row):
+                row["verdict"] = metrics.add(row)
+                writer.write(row)
+                if args.metrics_every and writer.count % args.metrics_every == 0:
+                    print(f"  [{writer.count} records] {metrics.live_line()}")
+
+            async with client:
+                latencies = await run_eval(pack_items(items, args.pack_size), client, on_result,
+                                           cache=cache, payloads=payloads)
+        cached = cache.stats["hits"] if cache is not None else 0
+        requests = client.stats["requests"] + cached
+    finally:
+        if stub_runner is not None:
+            await stub_runner.cleanup()
+        if cache is not None:
+            cache.close()
+        if store is not None:
+            store.close()
+    wall = time.perf_counter() - t0
+    print(latency_summary(latencies, wall, writer.count, requests, cached))
+    print(f"attempts {client.stats['attempts']}, retries {client.stats['retries']}, "
+          f"failed {client.stats['failed']}; results -> {out_path}")
+    print(renderer.report())
+    if cache is not None:
+        print(cache.report())
+    if store is not None:
+        print(store.report())
+    print(report(metrics))
+    if args.metrics_dir:
+        metrics_dir = PROJECT_ROOT.joinpath(args.metrics_dir)
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        for g in metrics.groupings:
+            write_table(metrics_dir.joinpath(table_name(g)), metrics.table(g), g)
+        print("metrics CSV saved to", metrics_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async VLM anomaly-detection evaluation (OpenAI-compatible API)")
+    parser.add_argument("records", type=Path, nargs="+", help="records 文件（相对项目根目录）")
+    parser.add_argument("--template", choices=sorted(TEMPLATES), default="level2", help="提示词模板")
+    parser.add_argument("--context_first", action="store_true", help="Additional Context 段落前置（见 prompt_engine）")
+    parser.add_argument("--base_url", default="http://127.0.0.1:8000/v1", help="OpenAI 兼容接口地址")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--api_key", default=None, help="默认读取环境变量 OPENAI_API_KEY")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行的请求数（连接池大小）")
+    parser.add_argument("--rate", type=float, default=None, help="每秒最多发出的请求数（令牌桶，含重试）")
+    parser.add_argument("--burst", type=float, default=None, help="令牌桶容量（默认 max(1, rate)）")
+    parser.add_argument("--retries", type=int, default=4, help="失败重试次数（连接错误 / 超时 / 429 / 5xx）")
+    parser.add_argument("--backoff", type=float, default=0.5, help="首次重试等待秒数，之后指数增长")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单次请求超时（秒）")
+    parser.add_argument("--max_tokens", type=int, default=512)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--limit", type=int, default=None, help="只评测前 N 条记录")
+    parser.add_argument("--pack_size", type=int, default=1,
+                        help="每个请求最多打包的图片数：同一 step / phase / Detection_Location 的记录共用一个提示词"
+                             "（见 request_packing.py），1 为每条记录单独请求")
+    parser.add_argument("--out", type=Path, default=Path("vlm_eval_results.jsonl"), help="结果 .jsonl（相对项目根目录）")
+    parser.add_argument("--cache_dir", type=Path, default=Path(".cache", "vlm_responses"),
+                        help="响应缓存目录（相对项目根目录，SQLite）")
+    parser.add_argument("--no_cache", action="store_true", help="不读写响应缓存")
+    parser.add_argument("--cache_max_entries", type=int, default=None, help="缓存最多保留的响应条数（LRU 淘汰）")
+    parser.add_argument("--cache_max_mb", type=float, default=None, help="缓存响应的总大小上限（MB，LRU 淘汰）")
+    parser.add_argument("--tier", default="full",
+                        help="图片档位：full（原始 JPEG）或长边像素数，如 448 / 768（见 payload_store.py）")
+    parser.add_argument("--payload_store", type=Path, default=None,
+                        help="预编码图片存储目录（相对项目根目录，如 .cache/payloads），缺失的图片现场编码")
+    parser.add_argument("--metrics_every", type=int, default=200, help="每完成 N 条记录打印一次实时指标，0 关闭")
+    parser.add_argument("--metrics_dir", type=Path, default=None,
+                        help="把各分组的 precision / recall / F1 写成 CSV 的目录（相对项目根目录）")
+    parser.add_argument("--stub", action="store_true", help="在本进程内启动 vlm_stub_server 并对其评测（离线吞吐测试）")
+    parser.add_argument("--stub_latency", type=float, default=0.05, help="stub 每个请求的延迟（秒）")
+    parser.add_argument("--stub_error_rate", type=float, default=0.0, help="stub 返回 500 的比例")
+    parser.add_argument("--stub_malformed_rate", type=float, default=0.0, help="stub 返回 200 但响应体不合法的比例")
+    args = parser.parse_args()
+    if args.tier != "full" and not args.tier.isdigit():
+        parser.error(f"invalid --tier: {args.tier} (expected a long-side size in pixels or 'full')")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
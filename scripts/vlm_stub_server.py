@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# scripts/vlm_stub_server.py
+"""
+Local stand-in for an OpenAI-compatible VLM endpoint, for offline
+throughput tests of vlm_eval.py.
+
+POST /v1/chat/completions answers every request with a canned reply in the
+format the detection prompts ask for:
+    1.Yes, there is an anomaly in this picture. (stub analysis)
+    2.No, there is no anomaly in this picture. (stub analysis)
+The choice is a stable hash of the request messages, so reruns get the same
+answers; requests with several images get one "Image k: ..." line per
+image. Latency, error rate and a server-side rate limit (HTTP 429 with
+Retry-After) can be set to exercise the runner's concurrency, retry and
+backoff paths; malformed_rate answers HTTP 200 with a body that is not a
+valid completion (no "choices", empty "choices" or null content, in turn).
+GET /stats returns request / error counters.
+
+Usage:
+    python scripts/vlm_stub_server.py --port 8000 --latency 0.2 --jitter 0.1 --error_rate 0.02
+    python scripts/vlm_eval.py records.json --base_url http://127.0.0.1:8000/v1
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+
+YES_ANSWER = "1.Yes, there is an anomaly in this picture."
+NO_ANSWER = "2.No, there is no anomaly in this picture."
+# HTTP 200 但不是合法的 chat completion
+MALFORMED_BODIES = (
+    {"object": "chat.completion"},
+    {"object": "chat.completion", "choices": []},
+    {"object": "chat.completion", "choices": [{"index": 0, "message": {"role": "assistant", "content": None}}]},
+)
+
+
+class StubVLM:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0,
+                 max_rps: float = None, yes_ratio: float = 0.5, seed: int = 0, malformed_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.max_rps = max_rps
+        self.yes_ratio = yes_ratio
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "completed": 0, "errors": 0, "rate_limited": 0, "malformed": 0, "images": 0}
+        self._window = []   # arrival times within the last second (rate limit)
+
+    def answer(self, messages: list, images: int = 1) -> str:
+        """One canned answer, or one "Image k: ..." line per image for multi-image requests."""
+        digest = zlib.crc32(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        lines = []
+        for k in range(max(1, images)):
+            yes = (zlib.crc32(str(k).encode(), digest) % 1000) < self.yes_ratio * 1000
+            lines.append((YES_ANSWER if yes else NO_ANSWER) + " (stub analysis)")
+        if images <= 1:
+            return lines[0]
+        return "\n".join(f"Image {k}: {line}" for k, line in enumerate(lines, 1))
+
+    def _rate_limited(self) -> bool:
+        if not self.max_rps:
+            return False
+        now = time.monotonic()
+        self._window = [t for t in self._window if now - t < 1.0]
+        if len(self._window) >= self.max_rps:
+            return True
+        self._window.append(now)
+        return False
+
+    async def chat_completions(self, request):
+        from aiohttp import web
+        self.stats["requests"] += 1
+        if self._rate_limited():
+            self.stats["rate_limited"] += 1
+            return web.json_response({"error": {"message": "rate limit exceeded"}}, status=429,
+                                     headers={"Retry-After": "1"})
+        body = await request.json()
+        messages = body.get("messages", [])
+        images = sum(1 for m in messages if isinstance(m.get("content"), list)
+                     for part in m["content"] if part.get("type") == "image_url")
+        self.stats["images"] += images
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if self.rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": {"message": "stub internal error"}}, status=500)
+        if self.rng.random() < self.malformed_rate:
+            self.stats["malformed"] += 1
+            return web.json_response(MALFORMED_BODIES[self.stats["malformed"] % len(MALFORMED_BODIES)])
+
+        text = self.answer(messages, images)
+        prompt_chars = sum(len(json.dumps(m.get("content"), ensure_ascii=False)) for m in messages)
+        self.stats["completed"] += 1
+        return web.json_response({
+            "id": f"stub-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(text) // 4,
+                      "total_tokens": (prompt_chars + len(text)) // 4},
+        })
+
+    async def get_stats(self, request):
+        from aiohttp import web
+        return web.json_response(self.stats)
+
+    def app(self):
+        from aiohttp import web
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+
+async def start_stub(stub: StubVLM, host: str = "127.0.0.1", port: int = 0):
+    """Start the stub on the running loop; returns (runner, base_url). Stop with `await runner.cleanup()`."""
+    from aiohttp import web
+    runner = web.AppRunner(stub.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub VLM server with canned Yes/No answers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.05, help="每个请求的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的均匀抖动幅度（秒）")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="返回 HTTP 500 的比例")
+    parser.add_argument("--max_rps", type=float, default=None, help="每秒最多接受的请求数，超出返回 429")
+    parser.add_argument("--malformed_rate", type=float, default=0.0, help="返回 200 但响应体不合法（缺 choices 等）的比例")
+    parser.add_argument("--yes_ratio", type=float, default=0.5, help="回答 1.Yes 的比例")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        from aiohttp import web
+    except ImportError as e:
+        raise ImportError("the stub server requires `pip install aiohttp`") from e
+    stub = StubVLM(args.latency, args.jitter, args.error_rate, args.max_rps, args.yes_ratio, args.seed,
+                   args.malformed_rate)
+    web.run_app(stub.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
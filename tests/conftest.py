@@ -0,0 +1,8 @@
+# tests/conftest.py
+# scripts/ 下的脚本互相直接 import（python scripts/xxx.py 的运行方式），测试时同样把它放进 sys.path
+import sys
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).parent.parent.joinpath("scripts").resolve()
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
@@ -0,0 +1,51 @@
+# tests/test_clip_backends.py
+# 用 benchmark.tiny_clip 生成的随机初始化小 CLIP（无需下载）比较各推理后端与 fp32 的得分
+import importlib.util
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from PIL import Image  # noqa: E402
+
+from clip_backends import BACKENDS, max_deviation, parity_check  # noqa: E402
+
+EXACT = 1e-4       # torchscript / onnx 与 fp32 是同一计算图，只有浮点误差
+INT8 = 0.1         # 动态量化的得分偏差上限（CLIPScore 取值 0 ~ 2.5）
+
+
+@pytest.fixture(scope="module")
+def parity(tmp_path_factory):
+    from benchmark import tiny_clip
+    root = tmp_path_factory.mktemp("parity")
+    model = tiny_clip(root.joinpath("tiny_clip"))
+    records = []
+    for k in range(6):
+        Image.new("RGB", (40 + 4 * k, 30), (40 * k, 100, 200 - 30 * k)).save(root.joinpath(f"{k}.jpg"))
+        records.append({"image_id": f"{k}.jpg", "Anomaly Label Description": f"object {k} on the workbench",
+                        "caption": f"workbench {k}" if k % 3 else ""})
+    records.append({"image_id": "missing.jpg", "Anomaly Label Description": "no image", "caption": "no image"})
+    has_onnx = all(importlib.util.find_spec(m) for m in ("onnx", "onnxruntime"))
+    backends = [b for b in BACKENDS if b != "fp32" and (b != "onnx" or has_onnx)]
+    rows = parity_check(records, root, backends, model_name=str(model), batch_size=4, num_workers=0)
+    return {row["backend"]: row for row in rows}
+
+
+def test_reference_row(parity):
+    assert "max_clip_score_dev" not in parity["fp32"]
+
+
+@pytest.mark.parametrize("backend, tolerance", [("torchscript", EXACT), ("onnx", EXACT), ("int8", INT8)])
+def test_backend_matches_fp32(parity, backend, tolerance):
+    if backend not in parity:
+        pytest.skip(f"{backend} backend unavailable")
+    row = parity[backend]
+    assert row["max_clip_score_dev"] <= tolerance
+    assert row["max_ref_clip_score_dev"] <= tolerance
+
+
+def test_max_deviation_skips_missing_scores():
+    ref = {"a": 1.0, "b": None, "c": 0.5}
+    assert max_deviation(ref, {"a": 0.75, "b": 2.0, "c": None}) == pytest.approx(0.25)
+    assert max_deviation(ref, {}) == 0.0
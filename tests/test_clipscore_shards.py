@@ -0,0 +1,63 @@
+# tests/test_clipscore_shards.py
+# 两个分片并发运行、共用同一个 embedding / 像素缓存目录，再从缓存重跑并合并，结果应与不分片、不用缓存的运行一致
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from PIL import Image  # noqa: E402
+
+SCRIPT = Path(__file__).parent.parent.joinpath("scripts", "compute_clipscore.py")
+
+
+def run_all(commands):
+    procs = [subprocess.Popen([sys.executable, str(SCRIPT), *cmd], stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, text=True) for cmd in commands]
+    for proc in procs:
+        out, _ = proc.communicate(timeout=600)
+        assert proc.returncode == 0, out
+
+
+def scores(path):
+    return {(row["image_id"], row["description"]): (row["clip_score"], row["ref_clip_score"])
+            for row in json.loads(path.read_text(encoding="utf-8"))}
+
+
+def test_concurrent_shards_share_cache(tmp_path):
+    from benchmark import tiny_clip
+
+    model = tiny_clip(tmp_path.joinpath("tiny_clip"))
+    records = []
+    for k in range(24):
+        image = tmp_path.joinpath(f"{k}.jpg")
+        if k < 22:
+            Image.new("RGB", (40 + 2 * k, 32), (10 * k, 255 - 10 * k, 90)).save(image)
+        records.append({"image_id": str(image), "Anomaly Label Description": f"tube {k}",
+                        "caption": f"rack {k % 5}"})
+    records_path = tmp_path.joinpath("records.json")
+    records_path.write_text(json.dumps(records), encoding="utf-8")
+
+    common = [str(records_path), "--model", str(model), "--batch_size", "4", "--num_workers", "0"]
+    cached = ["--cache_dir", str(tmp_path.joinpath("cache")), "--pixel_cache_dir", str(tmp_path.joinpath("pixels"))]
+    reference = tmp_path.joinpath("reference.json")
+    run_all([common + ["--no_cache", "--out", str(reference)]])
+
+    for run in range(2):     # 第一轮写缓存，第二轮全部从共用缓存读取
+        checkpoints = ["--checkpoint_dir", str(tmp_path.joinpath(f"checkpoints-{run}"))]
+        run_all([common + cached + checkpoints + ["--shard", f"{i}/2"] for i in range(2)])
+        merged = tmp_path.joinpath(f"merged-{run}.json")
+        run_all([common + cached + checkpoints + ["--merge", "2", "--out", str(merged)]])
+
+        want, got = scores(reference), scores(merged)
+        assert got.keys() == want.keys()
+        for key, (clip, ref) in want.items():
+            if clip is None:
+                assert got[key] == (None, None)
+            else:
+                assert got[key][0] == pytest.approx(clip, abs=1e-5)
+                assert got[key][1] == pytest.approx(ref, abs=1e-5)
@@ -0,0 +1,116 @@
+# tests/test_detection_metrics.py
+import pytest
+
+from detection_metrics import TEMPLATE_POLARITY, AnswerParser, ConfusionCounts, DetectionMetrics, parse_answer
+
+
+@pytest.mark.parametrize("template", sorted(TEMPLATE_POLARITY))
+def test_polarity(template):
+    anomaly_on_yes = TEMPLATE_POLARITY[template]
+    assert parse_answer("1.Yes, the container is missing.", template) is anomaly_on_yes
+    assert parse_answer("2.No, everything is in place.", template) is (not anomaly_on_yes)
+
+
+def test_normal_template_inverts_yes():
+    assert TEMPLATE_POLARITY["normal"] is False
+    assert parse_answer("1.Yes, the picture follows the normal condition.", "normal") is False
+    assert parse_answer("2.No, the tube is not in the rack.", "normal") is True
+
+
+@pytest.mark.parametrize("text", ["3.None, I'm unable to determine the answer.", "**3. None**", "Answer: none",
+                                  "The image is too blurry.", "", None])
+def test_undetermined(text):
+    assert parse_answer(text, "level2") is None
+    assert parse_answer(text, "normal") is None
+
+
+@pytest.mark.parametrize("text, verdict", [
+    ("1、Yes", True),
+    ("**2. No**, nothing wrong", False),
+    ("Answer: yes", True),
+    ("No. The cap is on the tube.", False),
+    ("Step 1.2 was skipped. 2.No", False),     # 编号前是数字 / 点号时不算选项
+])
+def test_answer_formats(text, verdict):
+    assert parse_answer(text, "level2") is verdict
+
+
+def test_streaming_waits_for_word_end():
+    parser = AnswerParser("level2")
+    # "1.No" 可能是 "1.None" 的前缀，词尾出现之前不能下结论
+    assert parser.feed("1.No") is None
+    assert not parser.decided
+    assert parser.feed("ne, I'm unable to determine") is None
+    assert parser.decided and parser.word == "none"
+    assert parser.finish() is None
+
+
+def test_streaming_decides_once_word_ends():
+    parser = AnswerParser("level2")
+    assert parser.feed("2.N") is None
+    assert parser.feed("o") is None
+    assert parser.feed(", the mold") is False
+    assert parser.decided
+    # 已决定后的内容不再影响结论
+    assert parser.feed(" 1.Yes") is False
+    assert parser.finish() is False
+
+
+def test_finish_decides_word_at_end_of_stream():
+    parser = AnswerParser("abnormal")
+    assert parser.feed("1.Yes") is None
+    assert parser.finish() is True
+
+
+def test_confusion_counts_arithmetic():
+    counts = ConfusionCounts()
+    for label, verdict, n in [(True, True, 6), (False, True, 2), (False, False, 9), (True, False, 3),
+                              (True, None, 4)]:
+        for _ in range(n):
+            counts.add(label, verdict)
+    s = counts.summary()
+    assert (s["tp"], s["fp"], s["tn"], s["fn"], s["undetermined"], s["n"]) == (6, 2, 9, 3, 4, 24)
+    assert s["precision"] == pytest.approx(6 / 8)
+    assert s["recall"] == pytest.approx(6 / 9)
+    assert s["f1"] == pytest.approx(2 * 6 / (2 * 6 + 2 + 3))
+    assert s["f1"] == pytest.approx(2 * s["precision"] * s["recall"] / (s["precision"] + s["recall"]))
+    assert s["accuracy"] == pytest.approx(15 / 20)
+    assert s["coverage"] == pytest.approx(20 / 24)
+
+
+def test_empty_ratios_are_none():
+    counts = ConfusionCounts()
+    counts.add(False, False)
+    s = counts.summary()
+    assert s["precision"] is None and s["recall"] is None and s["f1"] is None
+    assert s["accuracy"] == 1.0
+
+
+def test_detection_metrics_groupings():
+    metrics = DetectionMetrics([(), ("template",), ("view",)])
+    rows = [
+        {"template": "level2", "view": "top", "label": True, "answer": "1.Yes"},        # TP
+        {"template": "level2", "view": "side", "label": False, "answer": "1.Yes"},      # FP
+        {"template": "normal", "view": "top", "label": False, "answer": "1.Yes"},       # TN (normal 模板)
+        {"template": "normal", "view": "top", "label": True, "answer": "1.Yes"},        # FN
+        {"template": "level2", "view": "top", "label": True, "answer": "3.None"},       # undetermined
+        {"template": "level2", "view": "top", "label": None, "answer": "1.Yes"},        # 无标签，跳过
+        {"template": "level2", "view": "top", "label": True, "answer": None, "error": "HTTP 500"},
+    ]
+    verdicts = [metrics.add(row) for row in rows]
+    assert verdicts == [True, True, False, False, None, None, None]
+    assert (metrics.rows, metrics.skipped) == (5, 2)
+
+    overall = metrics.overall()
+    assert (overall["tp"], overall["fp"], overall["tn"], overall["fn"], overall["undetermined"]) == (1, 1, 1, 1, 1)
+    assert overall["f1"] == pytest.approx(0.5)
+
+    by_template = {row["template"]: row for row in metrics.table(("template",))}
+    assert (by_template["level2"]["tp"], by_template["level2"]["fp"], by_template["level2"]["undetermined"]) == (1, 1, 1)
+    assert (by_template["normal"]["tn"], by_template["normal"]["fn"]) == (1, 1)
+    assert {row["view"]: row["n"] for row in metrics.table(("view",))} == {"side": 1, "top": 4}
+
+
+def test_unknown_group_field():
+    with pytest.raises(KeyError):
+        DetectionMetrics([("camera",)])
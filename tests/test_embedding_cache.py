@@ -0,0 +1,106 @@
+# tests/test_embedding_cache.py
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache
+
+DIM = 8
+
+
+def vec(value):
+    return np.full(DIM, value, dtype=np.float32)
+
+
+def cache(path, fingerprint="fp"):
+    return EmbeddingCache(path, "model", fingerprint)
+
+
+def test_round_trip(tmp_path):
+    c = cache(tmp_path)
+    c.put("a", vec(1))
+    assert c.get("a")[0] == 1          # 尚未写盘的行
+    c.flush()
+    assert cache(tmp_path).get("a")[0] == 1
+    assert (c.hits, c.misses) == (1, 0)
+
+
+def test_interleaved_writers_keep_their_rows(tmp_path):
+    # 两个进程加载同一个（空）缓存后各自写入：行号不能重复，索引不能互相覆盖
+    first, second = cache(tmp_path), cache(tmp_path)
+    first.put("imgA", vec(1))
+    second.put("imgB", vec(2))
+    second.put("imgC", vec(3))
+    first.flush()
+    second.flush()
+    first.put("imgD", vec(4))
+    first.flush()
+    reader = cache(tmp_path)
+    assert len(reader) == 4
+    assert {k: reader.get(k)[0] for k in ("imgA", "imgB", "imgC", "imgD")} == {"imgA": 1, "imgB": 2, "imgC": 3,
+                                                                                "imgD": 4}
+    assert sorted(reader.keys.values()) == [0, 1, 2, 3]
+    # flush 时合并了其他进程已写入的行
+    assert second.get("imgA")[0] == 1
+
+
+def _writer(args):
+    path, worker = args
+    c = cache(path)
+    for j in range(40):
+        c.put(f"{worker}-{j}", vec(worker * 1000 + j))
+        if j % 7 == 0:
+            c.flush()
+    c.flush()
+
+
+def test_concurrent_processes(tmp_path):
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        pool.map(_writer, [(tmp_path, w) for w in range(6)])
+    c = cache(tmp_path)
+    assert len(c) == 6 * 40
+    assert all(c.get(f"{w}-{j}")[0] == w * 1000 + j for w in range(6) for j in range(40))
+    assert c.data_path.stat().st_size == len(c) * DIM * 4
+
+
+def test_rows_appended_without_index_are_dropped(tmp_path):
+    c = cache(tmp_path)
+    c.put("a", vec(1))
+    c.flush()
+    with open(c.data_path, "ab") as f:
+        f.write(vec(9).tobytes()[:12])      # 写数据后、写索引前被中断
+    reloaded = cache(tmp_path)
+    assert reloaded.data_path.stat().st_size == DIM * 4
+    reloaded.put("b", vec(2))
+    reloaded.flush()
+    assert cache(tmp_path).get("b")[0] == 2
+
+
+def test_data_shorter_than_index_invalidates(tmp_path, capsys):
+    c = cache(tmp_path)
+    c.put("a", vec(1))
+    c.put("b", vec(2))
+    c.flush()
+    with open(c.data_path, "r+b") as f:
+        f.truncate(DIM * 4)
+    assert len(cache(tmp_path)) == 0
+    assert "disagree" in capsys.readouterr().out
+
+
+def test_fingerprint_change_invalidates(tmp_path):
+    c = cache(tmp_path)
+    c.put("a", vec(1))
+    c.flush()
+    other = cache(tmp_path, "fp2")
+    assert len(other) == 0 and not other.data_path.exists()
+
+
+@pytest.mark.parametrize("clear", [False, True])
+def test_clear(tmp_path, clear):
+    c = cache(tmp_path)
+    c.put("a", vec(1))
+    c.flush()
+    if clear:
+        c.clear()
+    assert len(cache(tmp_path)) == (0 if clear else 1)
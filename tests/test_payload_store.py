@@ -0,0 +1,60 @@
+# tests/test_payload_store.py
+import os
+import threading
+
+from PIL import Image
+
+from payload_store import DATA_URL_PREFIX, PayloadStore, build_payload_store, encode_tier
+
+
+def payload(k):
+    return DATA_URL_PREFIX + (b"%06d" % k) * 200
+
+
+def test_round_trip_and_source_check(tmp_path):
+    image = tmp_path.joinpath("a.jpg")
+    Image.new("RGB", (64, 48), (120, 30, 30)).save(image)
+    store = PayloadStore(tmp_path.joinpath("store"))
+    assert build_payload_store({"a.jpg": image}, store, tiers=("32", "full"), workers=1) == 1
+    reader = PayloadStore(tmp_path.joinpath("store"))
+    assert reader.data_url("a.jpg", "32", image) == encode_tier(image, "32")[0].decode("ascii")
+    assert reader.data_url("a.jpg", "full", image) == encode_tier(image, "full")[0].decode("ascii")
+    Image.new("RGB", (64, 48), (30, 120, 30)).save(image)
+    os.utime(image, ns=(1, 1))
+    assert reader.data_url("a.jpg", "32", image) is None
+    assert reader.data_url("a.jpg", "32") is not None        # 不给路径时不检查源文件
+    assert reader.stale == 1
+
+
+def test_concurrent_reads_while_the_blob_grows(tmp_path):
+    source = tmp_path.joinpath("source.jpg")
+    source.write_bytes(b"jpeg")
+    store = PayloadStore(tmp_path.joinpath("store"))
+    store.put("0", source, {"full": (payload(0), 1, 1)})
+    store.flush()
+    errors, stop = [], threading.Event()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                for image_id in list(store.entries):
+                    url = store.data_url(image_id, "full")
+                    if url is not None and url.encode("ascii") != payload(int(image_id)):
+                        errors.append(f"wrong payload for {image_id}")
+        except Exception as e:      # BufferError / ValueError from a closed mmap
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        # 写入方不断追加并 flush，读者随之重新映射
+        for k in range(1, 60):
+            store.put(str(k), source, {"full": (payload(k), 1, 1)})
+            store.flush()
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    assert errors == []
+    assert all(store.data_url(str(k), "full").encode("ascii") == payload(k) for k in range(60))
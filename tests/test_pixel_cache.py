@@ -0,0 +1,40 @@
+# tests/test_pixel_cache.py
+import numpy as np
+from PIL import Image
+
+from pixel_cache import PixelCache, build_pixel_cache, load_resized
+
+SIZE = 16
+
+
+def crop(value):
+    return np.full((SIZE, SIZE, 3), value, dtype=np.uint8)
+
+
+def test_interleaved_writers_keep_their_crops(tmp_path):
+    first, second = PixelCache(tmp_path, SIZE), PixelCache(tmp_path, SIZE)
+    first.put("imgA", crop(10))
+    second.put("imgB", crop(20))
+    first.flush()
+    second.flush()
+    second.put("imgC", crop(30))
+    second.flush()
+    reader = PixelCache(tmp_path, SIZE)
+    assert [int(reader.get(k)[0, 0, 0]) for k in ("imgA", "imgB", "imgC")] == [10, 20, 30]
+    row_bytes = SIZE * SIZE * 3
+    assert sorted(reader.offset(k) for k in ("imgA", "imgB", "imgC")) == [0, row_bytes, 2 * row_bytes]
+    assert reader.data_path.stat().st_size == 3 * row_bytes
+
+
+def test_build_matches_load_resized(tmp_path):
+    paths = []
+    for k in range(3):
+        path = tmp_path.joinpath(f"{k}.jpg")
+        Image.new("RGB", (48 + 8 * k, 36), (60 * k, 90, 30)).save(path)
+        paths.append(path)
+    cache = PixelCache(tmp_path.joinpath("cache"), SIZE)
+    assert build_pixel_cache(paths + paths[:1], cache, workers=1) == 3
+    reader = PixelCache(tmp_path.joinpath("cache"), SIZE)
+    for path in paths:
+        np.testing.assert_array_equal(reader.get(reader.content_hash(path)), load_resized(path, SIZE))
+    assert build_pixel_cache(paths, reader, workers=1) == 0
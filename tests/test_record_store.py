@@ -0,0 +1,66 @@
+# tests/test_record_store.py
+import json
+from pathlib import Path
+
+import numpy as np
+
+from record_store import RecordStore, is_store, load_store, write_store
+
+PROJECT_ROOT = Path(__file__).parent.parent
+RECORDS = PROJECT_ROOT.joinpath("data", "annotation", "records_fix_arm_final.json")
+
+
+def sample_records():
+    return [
+        {"Image_Id": "data/image/0001.jpg", "step": "step1", "Anomaly_Label": False, "Anomaly_Type": None,
+         "Caption": "A test tube in the rack.",
+         "Grounding": [{"text_span": "test tube", "bbox": [1, 2, 30, 40], "category": "object"},
+                       {"text_span": "Normal region", "bbox": [0, 0, 64, 48], "category": "Normal"}]},
+        {"Image_Id": "data/image/0002.jpg", "step": "step1", "Anomaly_Label": True, "Anomaly_Type": "Missing",
+         "Caption": "检测区域内没有试管。", "Grounding": []},
+        {"Image_Id": "data/image/0003.jpg", "step": None, "Anomaly_Label": True, "Anomaly_Type": "Missing",
+         "Caption": "A test tube in the rack.",
+         "Grounding": [{"text_span": None, "bbox": [5, 5, 6, 6], "category": "Missing"}]},
+    ]
+
+
+def test_round_trip(tmp_path):
+    records = sample_records()
+    path = write_store(records, tmp_path.joinpath("sample.cols"))
+    assert is_store(path)
+    for mmap in (True, False):
+        store = load_store(path, mmap=mmap)
+        assert len(store) == 3
+        assert store.to_records() == records
+        assert json.dumps(store.to_records(), ensure_ascii=False) == json.dumps(records, ensure_ascii=False)
+
+
+def test_repeated_strings_stored_once(tmp_path):
+    store = RecordStore(write_store(sample_records(), tmp_path.joinpath("sample.cols")))
+    assert store.vocab["Caption"] == ["A test tube in the rack.", "检测区域内没有试管。"]
+    assert store.codes("Anomaly_Type").tolist() == [-1, 0, 0]
+    assert store.column("step") == ["step1", "step1", None]
+
+
+def test_mask_and_grounding(tmp_path):
+    store = RecordStore(write_store(sample_records(), tmp_path.joinpath("sample.cols")))
+    mask = store.mask("Anomaly_Type", ["Missing"])
+    assert mask.tolist() == [False, True, True]
+    assert [r["Image_Id"] for r in store.iter_records(mask)] == ["data/image/0002.jpg", "data/image/0003.jpg"]
+    assert store.code_of("Anomaly_Type", "Transformer Failure") == -2
+    assert store.arrays["grounding_offsets"].tolist() == [0, 2, 2, 3]
+    assert store.grounding(1) == []
+    assert store.arrays["grounding_bbox"].dtype == np.int32
+
+
+def test_round_trip_bundled_records(tmp_path):
+    records = json.loads(RECORDS.read_text(encoding="utf-8"))
+    store = load_store(write_store(records, tmp_path.joinpath("fix_arm.cols")))
+    assert len(store) == len(records)
+    assert store.to_records() == records
+
+
+def test_empty(tmp_path):
+    store = load_store(write_store([], tmp_path.joinpath("empty.cols")))
+    assert len(store) == 0
+    assert store.to_records() == []
@@ -0,0 +1,99 @@
+# tests/test_request_packing.py
+from typing import NamedTuple
+
+import pytest
+
+from detection_metrics import parse_answer
+from request_packing import pack_items, pack_key, packed_instruction, split_packed_answer
+
+
+def test_split_plain_lines():
+    text = "Image 1: 1.Yes, the cap is missing.\nImage 2: 2.No, the cap is on.\nImage 3: 3.None, too dark."
+    assert split_packed_answer(text, 3) == ["1.Yes, the cap is missing.", "2.No, the cap is on.", "3.None, too dark."]
+
+
+@pytest.mark.parametrize("text", [
+    "**Image 1:** 1.Yes\n**Image 2:** 2.No",
+    "- Image #1) 1.Yes\n- Image #2) 2.No",
+    "image 1 - 1.Yes\nIMAGE 2. 2.No",
+    "Image 1： 1.Yes\nImage 2： 2.No",
+])
+def test_split_label_formats(text):
+    answers = split_packed_answer(text, 2)
+    assert [parse_answer(a) for a in answers] == [True, False]
+
+
+def test_split_multiline_answer_and_preamble():
+    text = "Here are my answers.\n\nImage 2: 2.No,\nthe tube is in the rack.\n\nImage 1: 1.Yes,\nno cap."
+    assert split_packed_answer(text, 2) == ["1.Yes,\nno cap.", "2.No,\nthe tube is in the rack."]
+
+
+def test_split_missing_extra_and_repeated_lines():
+    text = "Image 1: 1.Yes\nImage 1: 2.No\nImage 4: 2.No\nImage 0: 2.No"
+    # 只取每张图的第一行；编号越界的行忽略；没有出现的图为 None
+    assert split_packed_answer(text, 3) == ["1.Yes", None, None]
+
+
+@pytest.mark.parametrize("text", ["", None, "1.Yes, there is an anomaly."])
+def test_split_without_image_lines(text):
+    assert split_packed_answer(text, 2) == [None, None]
+
+
+def test_mentions_inside_a_line_are_not_labels():
+    text = "Image 1: 1.Yes, unlike Image 2: it shows no cap.\nImage 2: 2.No"
+    assert split_packed_answer(text, 2) == ["1.Yes, unlike Image 2: it shows no cap.", "2.No"]
+
+
+def test_packed_instruction_lists_every_image():
+    text = packed_instruction(3)
+    assert "Image 1 to Image 3" in text
+    assert split_packed_answer(text, 3) == ["...", "...", "..."]
+
+
+class Item(NamedTuple):
+    index: int
+    group: tuple
+    template: str
+    prompt: object
+
+
+class Prompt(NamedTuple):
+    variable: str
+
+
+def test_pack_items_groups_by_prompt():
+    items = [Item(i, ("step1", "pre", loc), "level2", Prompt(loc)) for i, loc in enumerate("aabaaab")]
+    packs = [[it.index for it in pack] for pack in pack_items(items, 3)]
+    assert packs == [[0, 1, 3], [4, 5], [2, 6]]     # 凑满的先发，余下的按最近追加的先后
+    assert [[it.index for it in pack] for pack in pack_items(items, 1)] == [[i] for i in range(7)]
+
+
+def test_pack_items_memory_bound():
+    # 2000 个互不相同的分组、每组只有一条记录：缓冲的部分包不能随分组数增长
+    held = []
+
+    def items():
+        for i in range(2000):
+            held.append(i)
+            yield Item(i, ("step1", "pre", f"loc{i}"), "level2", Prompt(f"loc{i}"))
+
+    emitted = 0
+    for pack in pack_items(items(), 4, max_open=3):
+        emitted += len(pack)
+        assert len(held) - emitted <= 3 * 4
+    assert emitted == 2000
+
+
+def test_pack_items_grouped_input_packs_fully():
+    locs = [f"loc{g}" for g in range(50) for _ in range(7)]
+    items = [Item(i, ("step1", "pre", loc), "level2", Prompt(loc)) for i, loc in enumerate(locs)]
+    packs = list(pack_items(items, 4, max_open=1))
+    assert [len(p) for p in packs] == [4, 3] * 50
+    assert all(len({pack_key(it) for it in pack}) == 1 for pack in packs)
+
+
+def test_pack_items_interleaved_groups_evict_oldest():
+    items = [Item(i, ("step1", "pre", loc), "level2", Prompt(loc)) for i, loc in enumerate("abcba")]
+    packs = [[it.index for it in pack] for pack in pack_items(items, 2, max_open=2)]
+    # c 打开第三个包时，最久未追加的 a 先发出；b 仍在缓冲中，之后凑满
+    assert packs == [[0], [1, 3], [2], [4]]
@@ -0,0 +1,135 @@
+# tests/test_response_cache.py
+import asyncio
+import os
+
+import pytest
+
+from response_cache import ResponseCache, prompt_sha1, request_key
+
+PARAMS = {"max_tokens": 512, "temperature": 0.0}
+
+
+def key(model="gpt-4o", prompt="p", images=("a", "b"), params=PARAMS):
+    return request_key(model, prompt_sha1("system", prompt), list(images), params)
+
+
+def test_request_key_stable():
+    assert key() == key()
+    assert key(params={"temperature": 0.0, "max_tokens": 512}) == key()     # 参数顺序无关
+
+
+@pytest.mark.parametrize("changed", [
+    dict(model="gpt-4o-mini"),
+    dict(prompt="p2"),
+    dict(images=("a",)),
+    dict(images=("b", "a")),
+    dict(params={"max_tokens": 256, "temperature": 0.0}),
+])
+def test_request_key_changes(changed):
+    assert key(**changed) != key()
+
+
+def test_prompt_sha1_separates_system_and_prompt():
+    assert prompt_sha1("ab", "c") != prompt_sha1("a", "bc")
+
+
+def put(cache, k, answer="1.Yes"):
+    cache.put(k, {"answer": answer}, "gpt-4o", "p", ["a"], PARAMS)
+
+
+def test_get_put_and_persistence(tmp_path):
+    with ResponseCache(tmp_path) as cache:
+        assert cache.get("k1") is None
+        put(cache, "k1", "2.No")
+        assert cache.get("k1") == {"answer": "2.No"}
+        assert cache.stats == {"hits": 1, "misses": 1, "writes": 1, "evicted": 0}
+    with ResponseCache(tmp_path) as cache:
+        assert cache.get("k1") == {"answer": "2.No"}
+        assert len(cache) == 1
+
+
+def test_lru_eviction_by_entries(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr("response_cache.time.time", lambda: float(next(clock)))
+    with ResponseCache(tmp_path, max_entries=3, evict_every=1000) as cache:
+        for k in ("k1", "k2", "k3", "k4"):
+            put(cache, k)
+        cache.get("k1")         # k1 最近被用过，k2 是最久未用的
+        assert cache.evict() == 1
+        assert cache.get("k2") is None
+        assert all(cache.get(k) is not None for k in ("k1", "k3", "k4"))
+        assert cache.stats["evicted"] == 1
+
+
+def test_eviction_every_n_puts_and_on_close(tmp_path):
+    cache = ResponseCache(tmp_path, max_entries=2, evict_every=3)
+    for k in ("k1", "k2", "k3"):
+        put(cache, k)
+    assert len(cache) == 2
+    put(cache, "k4")
+    assert len(cache) == 3
+    cache.close()
+    assert len(cache) == 2
+
+
+def test_eviction_by_size(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr("response_cache.time.time", lambda: float(next(clock)))
+    with ResponseCache(tmp_path, max_mb=1e-3, evict_every=1000) as cache:   # 约 1 KB
+        for i in range(10):
+            put(cache, f"k{i}", "x" * 200)
+        cache.evict()
+        size = cache.db.execute("SELECT SUM(size) FROM responses").fetchone()[0]
+        assert size <= cache.max_bytes
+        assert cache.get("k9") is not None and cache.get("k0") is None
+
+
+def test_image_hash_follows_file_changes(tmp_path):
+    image = tmp_path.joinpath("a.jpg")
+    image.write_bytes(b"one")
+    with ResponseCache(tmp_path.joinpath("cache")) as cache:
+        first = cache.image_hash(image)
+        assert cache.image_hash(image) == first
+        image.write_bytes(b"two")
+        os.utime(image, ns=(1, 1))
+        assert cache.image_hash(image) != first
+    with ResponseCache(tmp_path.joinpath("cache")) as cache:
+        assert cache.db.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 1
+
+
+def test_partial_packed_answer_not_cached(tmp_path):
+    from prompt_engine import Prompt
+    from vlm_eval import EvalItem, evaluate_pack
+
+    class FakeClient:
+        model = "stub"
+        params = PARAMS
+
+        def __init__(self, answer):
+            self.answer = answer
+            self.sent = 0
+
+        async def complete(self, messages):
+            self.sent += 1
+            return {"answer": self.answer, "usage": None, "latency_s": 0.01, "total_s": 0.01, "attempts": 1}
+
+    pack = []
+    for k in range(3):
+        image = tmp_path.joinpath(f"{k}.jpg")
+        image.write_bytes(b"jpeg %d" % k)
+        pack.append(EvalItem(k, f"{k}.jpg", image, Prompt("a", "b", "c"), "level2", True))
+
+    async def run(client, cache):
+        return [await evaluate_pack(client, pack, cache) for _ in range(2)]
+
+    with ResponseCache(tmp_path.joinpath("cache")) as cache:
+        partial = FakeClient("Image 1: 1.Yes\nImage 2: 2.No")
+        rows = asyncio.run(run(partial, cache))[-1]
+        assert partial.sent == 2 and len(cache) == 0
+        assert [row["error"] is None for row in rows] == [True, True, False]
+
+        full = FakeClient("Image 1: 1.Yes\nImage 2: 2.No\nImage 3: 1.Yes")
+        rows = asyncio.run(run(full, cache))[-1]
+        assert full.sent == 1 and len(cache) == 1
+        assert all(row["cached"] for row in rows)
+        assert [row["answer"] for row in rows] == ["1.Yes", "2.No", "1.Yes"]
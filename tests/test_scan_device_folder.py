@@ -0,0 +1,74 @@
+# tests/test_scan_device_folder.py
+from auto_annotation_final import FILENAME_REGEX, IMAGE_SUFFIXES, scan_device_folder
+
+
+def reference_groups(device_folder):
+    """Groups of a walk that resolves every txt reference on the spot by re-scanning the referenced folder."""
+    groups = {}
+    for path in device_folder.rglob("*"):
+        if path.suffix.lower() not in IMAGE_SUFFIXES and path.suffix != ".txt":
+            continue
+        seg = next((p for p in path.parts if p.startswith("step") and ("-pre" in p or "-post" in p)), None)
+        if not seg:
+            continue
+        step, phase = seg.split("-", 1)
+        category = path.parts[path.parts.index(seg) + 1]
+        if path.suffix.lower() in IMAGE_SUFFIXES:
+            m = FILENAME_REGEX.match(path.stem)
+            groups.setdefault((step, phase, category, int(m.group("idx")) if m else None), []).append(path)
+        elif path.suffix == ".txt":
+            parts = path.stem.split("-")
+            if len(parts) < 5:
+                continue
+            idx0, ref_step, ref_phase, ref_cat, ref_idx = parts[:5]
+            key = (step, phase, category, int(idx0) if idx0.isdigit() else None)
+            ref_folder = path.parent.parent.parent.joinpath(f"{ref_step}-{ref_phase}", ref_cat)
+            if ref_folder.exists():
+                for img in ref_folder.rglob(f"{ref_idx}_*.*"):
+                    if img.suffix.lower() in IMAGE_SUFFIXES:
+                        groups.setdefault(key, []).append(img)
+    return groups
+
+
+def touch(path, text=""):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+def make_tree(device):
+    point = device.joinpath("point1")
+    touch(point.joinpath("step1-pre", "normal", "1_near_1.jpg"))
+    touch(point.joinpath("step1-pre", "normal", "1_far_2.jpg"))
+    touch(point.joinpath("step1-pre", "normal", "label", "1_near_1.xml"))
+    # 引用可解析：同一点位下 step1-pre/normal 的 1_*.jpg
+    touch(point.joinpath("step2-post", "normal", "4-step1-pre-normal-1.txt"))
+    # 引用的文件夹不存在 / 编号不存在：不应产生分组
+    touch(point.joinpath("step2-post", "normal", "2-step9-pre-normal-1.txt"))
+    touch(point.joinpath("step2-post", "abnormal", "5-step1-pre-normal-7.txt"))
+    # 引用不可解析，但该分组自己有图片
+    touch(point.joinpath("step1-pre", "abnormal", "3-step9-post-abnormal-1.txt"))
+    touch(point.joinpath("step1-pre", "abnormal", "3_far_2.jpg"))
+    # 其他点位的同名编号不能被引用到
+    touch(device.joinpath("point2", "step1-pre", "normal", "1_near_3.jpg"))
+
+
+def test_unresolved_txt_refs_create_no_group(tmp_path):
+    device = tmp_path.joinpath("fix_arm")
+    make_tree(device)
+    groups = scan_device_folder(device)["groups"]
+    point = device.joinpath("point1")
+    assert ("step2", "post", "normal", 2) not in groups
+    assert ("step2", "post", "abnormal", 5) not in groups
+    assert groups[("step1", "pre", "abnormal", 3)] == [point.joinpath("step1-pre", "abnormal", "3_far_2.jpg")]
+    assert sorted(groups[("step2", "post", "normal", 4)]) == sorted(
+        point.joinpath("step1-pre", "normal", name) for name in ("1_near_1.jpg", "1_far_2.jpg"))
+    assert all(groups.values())
+
+
+def test_matches_reference_walk(tmp_path):
+    device = tmp_path.joinpath("fix_arm")
+    make_tree(device)
+    groups = scan_device_folder(device)["groups"]
+    reference = reference_groups(device)
+    assert list(groups) == list(reference)      # 键的顺序也一致
+    assert groups == reference
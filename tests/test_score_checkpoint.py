@@ -0,0 +1,158 @@
+# tests/test_score_checkpoint.py
+import json
+
+import pytest
+
+from score_checkpoint import ScoreCheckpoint, checkpoint_path, merge_checkpoints, parse_shard, shard_of
+
+FINGERPRINT = "fp-1"
+
+
+def fake_score(key: str) -> tuple:
+    return len(key) / 10, (len(key) % 7) / 10
+
+
+def keys():
+    # 同一图片可能对应多条记录（txt 引用），最后一条的得分生效
+    return [f"data/image/{i % 40:04d}.jpg" for i in range(100)]
+
+
+def score_shard(path, shard, records):
+    ckpt = ScoreCheckpoint(path, FINGERPRINT, shard)
+    pos = 0
+    for key in records:
+        if shard_of(key, shard[1]) == shard[0]:
+            if pos not in ckpt:
+                ckpt.add(pos, key, *fake_score(key))
+            pos += 1
+    ckpt.finish(pos)
+    return ckpt
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    assert parse_shard(" 0 / 1 ") == (0, 1)
+    for spec in ("4/4", "1/0", "a/b", "", None):
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+
+def test_torn_last_line_is_truncated(tmp_path):
+    path = tmp_path.joinpath("recs.shard-0-of-1.jsonl")
+    ckpt = ScoreCheckpoint(path, FINGERPRINT)
+    for i in range(3):
+        ckpt.add(i, f"k{i}", 0.5 + i, None)
+    ckpt.flush()
+    intact = path.read_bytes()
+    with path.open("ab") as f:
+        f.write(b'{"i": 3, "key": "k3", "clip_sc')     # 写到一半被杀掉
+
+    resumed = ScoreCheckpoint(path, FINGERPRINT)
+    assert resumed.resumed == 3
+    assert sorted(resumed.entries) == [0, 1, 2]
+    assert path.read_bytes() == intact
+    resumed.add(3, "k3", 3.5, None)
+    resumed.finish(4)
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [row.get("i") for row in lines[1:]] == [0, 1, 2, 3, None]
+    assert lines[-1] == {"complete": True, "records": 4}
+
+
+def test_complete_line_without_newline_is_dropped(tmp_path):
+    path = tmp_path.joinpath("recs.shard-0-of-1.jsonl")
+    ckpt = ScoreCheckpoint(path, FINGERPRINT)
+    ckpt.add(0, "k0", 1.0, 1.0)
+    ckpt.flush()
+    with path.open("ab") as f:
+        f.write(b'{"i": 1, "key": "k1", "clip_score": 2.0, "ref_clip_score": 2.0}')
+    assert sorted(ScoreCheckpoint(path, FINGERPRINT).entries) == [0]
+
+
+def test_fingerprint_change_restarts(tmp_path, capsys):
+    path = tmp_path.joinpath("recs.shard-0-of-1.jsonl")
+    ckpt = ScoreCheckpoint(path, FINGERPRINT)
+    ckpt.add(0, "k0", 1.0, 1.0)
+    ckpt.finish(1)
+    restarted = ScoreCheckpoint(path, "fp-2")
+    assert len(restarted) == 0 and not restarted.complete
+    assert "restarting" in capsys.readouterr().out
+    with pytest.raises(ValueError):
+        ScoreCheckpoint(path, FINGERPRINT, readonly=True)
+
+
+@pytest.mark.parametrize("n", [1, 3, 4])
+def test_merge_equals_single_pass(tmp_path, n):
+    records = keys()
+    single = ({}, {})
+    for key in records:
+        single[0][key], single[1][key] = fake_score(key)
+
+    paths = [checkpoint_path(tmp_path, "recs.json", (i, n)) for i in range(n)]
+    for i, path in enumerate(paths):
+        score_shard(path, (i, n), records)
+    assert merge_checkpoints(paths, FINGERPRINT) == single
+
+
+def test_resumed_shard_merges_the_same(tmp_path):
+    records = keys()
+    paths = [checkpoint_path(tmp_path, "recs.json", (i, 2)) for i in range(2)]
+    score_shard(paths[1], (1, 2), records)
+    # 分片 0 中途中断：只写入前一半，之后续跑
+    partial = ScoreCheckpoint(paths[0], FINGERPRINT, (0, 2))
+    shard0 = [k for k in records if shard_of(k, 2) == 0]
+    for pos, key in enumerate(shard0[:len(shard0) // 2]):
+        partial.add(pos, key, *fake_score(key))
+    partial.flush()
+    with pytest.raises(RuntimeError):
+        merge_checkpoints(paths, FINGERPRINT)
+    resumed = score_shard(paths[0], (0, 2), records)
+    assert resumed.resumed == len(shard0) // 2
+
+    expected = {key: fake_score(key)[0] for key in records}
+    assert merge_checkpoints(paths, FINGERPRINT)[0] == expected
+
+
+def test_merge_missing_or_stale_shard(tmp_path):
+    records = keys()
+    paths = [checkpoint_path(tmp_path, "recs.json", (i, 2)) for i in range(2)]
+    score_shard(paths[0], (0, 2), records)
+    with pytest.raises(FileNotFoundError):
+        merge_checkpoints(paths, FINGERPRINT)
+    score_shard(paths[1], (1, 2), records)
+    with pytest.raises(ValueError):
+        merge_checkpoints(paths, "fp-2")
+
+
+def test_merge_matches_unsharded_clipscore(tmp_path):
+    """Sharded compute_scores runs merged = one unsharded run (tiny random CLIP, no download)."""
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from PIL import Image
+
+    from benchmark import tiny_clip
+    from compute_clipscore import compute_scores, record_fields
+
+    model = str(tiny_clip(tmp_path.joinpath("tiny_clip")))
+    records = []
+    for k in range(10):
+        if k < 8:
+            Image.new("RGB", (36, 32), (25 * k, 90, 120)).save(tmp_path.joinpath(f"{k}.jpg"))
+        records.append({"image_id": f"{k % 9}.jpg", "Anomaly Label Description": f"tube {k}", "caption": f"rack {k}"})
+
+    kwargs = dict(device="cpu", model_name=model, batch_size=3, num_workers=0)
+    single = compute_scores(records, tmp_path, **kwargs)
+    n = 3
+    paths = [checkpoint_path(tmp_path, "recs.json", (i, n)) for i in range(n)]
+    for i, path in enumerate(paths):
+        ckpt = ScoreCheckpoint(path, FINGERPRINT, (i, n))
+        shard = [rec for rec in records if shard_of(record_fields(rec)[0], n) == i]
+        compute_scores(shard, tmp_path, checkpoint=ckpt, **kwargs)
+        ckpt.finish(len(shard))
+    merged = merge_checkpoints(paths, FINGERPRINT)
+    assert merged[0].keys() == single[0].keys()
+    for got, want in zip(merged, single):
+        for key, value in want.items():
+            if value is None:
+                assert got[key] is None
+            else:
+                assert got[key] == pytest.approx(value, abs=1e-5)
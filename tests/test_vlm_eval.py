@@ -0,0 +1,94 @@
+# tests/test_vlm_eval.py
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from PIL import Image  # noqa: E402
+
+from prompt_engine import Prompt  # noqa: E402
+from request_packing import pack_items  # noqa: E402
+from vlm_eval import EvalItem, RequestError, VLMClient, completion_text, run_eval  # noqa: E402
+from vlm_stub_server import MALFORMED_BODIES, StubVLM, start_stub  # noqa: E402
+
+
+def make_items(tmp_path, n):
+    items = []
+    for k in range(n):
+        image = tmp_path.joinpath(f"{k}.jpg")
+        Image.new("RGB", (8, 8), (k, 0, 0)).save(image)
+        items.append(EvalItem(k, f"{k}.jpg", image, Prompt("a ", f"step {k % 3}", " b"), "level2", k % 2 == 0,
+                              ("step1", "pre", "bench")))
+    return items
+
+
+async def evaluate(stub, items, pack_size=1, concurrency=2, on_result=None):
+    runner, base_url = await start_stub(stub)
+    rows = []
+
+    def collect(row):
+        rows.append(row)
+        if on_result is not None:
+            on_result(row)
+
+    try:
+        async with VLMClient(base_url, "stub", concurrency=concurrency, retries=2, backoff=0.01) as client:
+            # 出错时也必须在限定时间内结束，不能卡住
+            await asyncio.wait_for(run_eval(pack_items(items, pack_size), client, collect, progress_every=0), 30)
+    finally:
+        await runner.cleanup()
+    return rows, client
+
+
+@pytest.mark.parametrize("body", MALFORMED_BODIES + ({"choices": "oops"}, ["not", "a", "dict"], None))
+def test_completion_text_rejects_malformed_bodies(body):
+    with pytest.raises(RequestError, match="malformed response"):
+        completion_text(body)
+
+
+def test_completion_text():
+    assert completion_text({"choices": [{"message": {"content": "1.Yes"}}]}) == "1.Yes"
+
+
+def test_malformed_responses_fail_their_rows_only(tmp_path):
+    items = make_items(tmp_path, 12)
+    stub = StubVLM(latency=0.0, malformed_rate=1.0)
+    rows, client = asyncio.run(evaluate(stub, items))
+    assert sorted(row["i"] for row in rows) == list(range(12))
+    assert all("malformed response" in row["error"] for row in rows)
+    # 不重试：每个请求只发一次
+    assert stub.stats["requests"] == 12
+    assert client.stats["failed"] == 12 and client.stats["retries"] == 0
+
+
+@pytest.mark.parametrize("pack_size", [1, 3])
+def test_mixed_malformed_responses(tmp_path, pack_size):
+    items = make_items(tmp_path, 30)
+    stub = StubVLM(latency=0.0, malformed_rate=0.4, seed=1)
+    rows, _ = asyncio.run(evaluate(stub, items, pack_size=pack_size, concurrency=4))
+    assert sorted(row["i"] for row in rows) == list(range(30))
+    failed = [row for row in rows if row["error"] is not None]
+    assert failed and len(failed) < len(rows)
+    assert all("malformed response" in row["error"] for row in failed)
+    assert all(row["answer"] for row in rows if row["error"] is None)
+
+
+def test_invalid_json_body(tmp_path):
+    from aiohttp import web
+
+    class BrokenJSON(StubVLM):
+        async def chat_completions(self, request):
+            self.stats["requests"] += 1
+            return web.Response(text="{not json", content_type="application/json")
+
+    rows, _ = asyncio.run(evaluate(BrokenJSON(), make_items(tmp_path, 3)))
+    assert all("invalid JSON" in row["error"] for row in rows)
+
+
+def test_failing_callback_stops_the_run(tmp_path):
+    def on_result(row):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError, match="disk full"):
+        asyncio.run(evaluate(StubVLM(latency=0.0), make_items(tmp_path, 20), on_result=on_result))